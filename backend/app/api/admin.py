@@ -0,0 +1,95 @@
+import asyncio
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import PlainTextResponse
+from app.api.admission import require_admin
+from app.api.responses import api_response
+from app.services.credential_pool import dashscope_credentials, coze_credentials
+from app.services.profiler import (
+    sampling_profiler, heap_snapshots, dump_threads, dump_tasks, ProfilerBusy, MAX_PROFILE_SECONDS
+)
+
+# 管理接口：仅在配置ADMIN_TOKEN后可用，且每个请求都需携带 X-Admin-Token
+admin_router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+@admin_router.post("/profile")
+async def run_profile(
+    seconds: float = Query(10.0, gt=0, le=MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(5.0, ge=1, le=1000)
+):
+    """对所有线程采样指定秒数，返回collapsed-stack文本（可用flamegraph.pl或speedscope打开）"""
+    try:
+        # 在独立线程中采样，事件循环线程本身也会出现在结果里
+        collapsed = await asyncio.to_thread(sampling_profiler.profile, seconds, interval_ms / 1000.0)
+    except ProfilerBusy as e:
+        return api_response(success=False, message=str(e), status_code=409)
+    return PlainTextResponse(
+        collapsed,
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'}
+    )
+
+@admin_router.get("/stacks")
+async def get_stacks():
+    """所有线程和asyncio任务的当前调用栈（排查卡住的轮询循环等）"""
+    return api_response(
+        success=True,
+        message="调用栈获取成功",
+        data={"threads": dump_threads(), "tasks": dump_tasks()}
+    )
+
+@admin_router.get("/tracemalloc")
+async def tracemalloc_status():
+    """tracemalloc状态和已保存的快照编号"""
+    return api_response(success=True, message="获取成功", data=heap_snapshots.status())
+
+@admin_router.post("/tracemalloc/start")
+async def tracemalloc_start(frames: int = Query(25, ge=1, le=100)):
+    """开启tracemalloc（开启后所有内存分配都会被记录，排查完成后请及时关闭）"""
+    heap_snapshots.start(frames)
+    return api_response(success=True, message="tracemalloc已开启", data=heap_snapshots.status())
+
+@admin_router.post("/tracemalloc/stop")
+async def tracemalloc_stop():
+    """关闭tracemalloc并丢弃所有快照"""
+    heap_snapshots.stop()
+    return api_response(success=True, message="tracemalloc已关闭", data=heap_snapshots.status())
+
+@admin_router.post("/tracemalloc/snapshot")
+async def tracemalloc_snapshot(top: int = Query(20, ge=1, le=200)):
+    """保存一个快照，返回编号和占用最多的分配位置"""
+    try:
+        snapshot_id = await asyncio.to_thread(heap_snapshots.take)
+    except RuntimeError as e:
+        return api_response(success=False, message=str(e), status_code=400)
+    # 统计分配位置同样耗CPU，放到工作线程，不冻结正在被排查的worker
+    top_stats = await asyncio.to_thread(heap_snapshots.top, snapshot_id, top)
+    return api_response(
+        success=True,
+        message="快照已保存",
+        data={"snapshot_id": snapshot_id, "top": top_stats}
+    )
+
+@admin_router.get("/tracemalloc/diff")
+async def tracemalloc_diff(
+    base: int = Query(...),
+    target: int = Query(...),
+    top: int = Query(20, ge=1, le=200),
+    key_type: str = Query("lineno", pattern="^(lineno|filename|traceback)$")
+):
+    """比较两个快照，按增长量列出分配位置（如对比会话存储增长前后）"""
+    try:
+        diff = await asyncio.to_thread(heap_snapshots.diff, base, target, top, key_type)
+    except KeyError as e:
+        return api_response(success=False, message=str(e.args[0]), status_code=404)
+    return api_response(success=True, message="比较完成", data={"base": base, "target": target, "diff": diff})
+
+@admin_router.get("/credentials")
+async def get_credentials():
+    """各上游账号凭据的进行中请求数、累计请求/限流/失败次数和剩余隔离时间（不含密钥）"""
+    return api_response(
+        success=True,
+        message="凭据状态获取成功",
+        data={
+            pool.kind: pool.stats()
+            for pool in (dashscope_credentials, coze_credentials) if pool is not None
+        }
+    )
@@ -0,0 +1,59 @@
+import hmac
+import math
+import os
+from typing import Optional
+from fastapi import HTTPException, Request
+from app.services.lifecycle import drain_controller
+from app.services.metrics import ADMISSION_REJECTED
+from app.services.rate_limiter import rate_limiter
+
+# 仅在部署于可信反向代理之后时才信任 X-Forwarded-For
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+# 管理接口令牌；未配置时管理接口整体不可用
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+class RateLimitExceeded(Exception):
+    """请求被准入控制拒绝，由main.py中的异常处理器转换为429响应"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def client_identity(request: Request) -> str:
+    """识别调用方：优先使用 X-User-Id，其次客户端IP"""
+    user_id = request.headers.get("x-user-id")
+    if user_id:
+        return f"user:{user_id.strip()[:64]}"
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def admission(endpoint: str, upstream: Optional[str] = None):
+    """
+    生成准入控制依赖：按调用方限流，并占用上游并发名额直到请求结束
+    服务优雅下线期间直接拒绝（503），已准入的请求计入进行中，下线时等待其完成
+    用法: @router.post(..., dependencies=[Depends(admission("generate", upstream="coze"))])
+    """
+    def dependency(request: Request):
+        with drain_controller.track():
+            result = rate_limiter.admit(endpoint, client_identity(request), upstream)
+            if not result.allowed:
+                ADMISSION_REJECTED.inc(endpoint=endpoint, reason=result.reason)
+                raise RateLimitExceeded(f"{result.reason}，请稍后重试", result.retry_after)
+            try:
+                yield
+            finally:
+                result.release()
+
+    return dependency
+
+def require_admin(request: Request) -> None:
+    """管理接口鉴权：要求请求头 X-Admin-Token 与 ADMIN_TOKEN 一致；未配置令牌时表现为接口不存在"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="需要管理员权限")
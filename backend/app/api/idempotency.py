@@ -0,0 +1,129 @@
+import asyncio
+import base64
+import hashlib
+import math
+import os
+import time
+import uuid
+from typing import Any, Dict, Optional
+from fastapi import Request
+from fastapi.responses import Response
+from app.api.admission import client_identity
+from app.services.state_store import state_store
+
+# 已完成请求的结果保留时间
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 86400))
+# 处理中标记的最长保留时间，需覆盖最慢的生成；持有者崩溃后到期即可由重试重新执行
+IDEMPOTENCY_LOCK_TTL = float(os.getenv("IDEMPOTENCY_LOCK_TTL", 360))
+# 重复请求等待原请求完成的最长时间，超时返回409
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", 330))
+# 客户端提供的键最长长度
+MAX_KEY_LENGTH = 255
+
+class IdempotencyError(Exception):
+    """Idempotency-Key无法使用（键无效、与原请求内容不一致、原请求仍在处理），由main.py转换为错误响应"""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after)) if retry_after else None
+
+class IdempotentReplay(Exception):
+    """重复请求：直接返回原请求保存的响应，由main.py中的异常处理器输出"""
+
+    def __init__(self, record: Dict[str, Any]):
+        super().__init__("idempotent replay")
+        self.record = record
+
+    def to_response(self) -> Response:
+        record = self.record
+        if "body_b64" in record:
+            body = base64.b64decode(record["body_b64"])
+        else:
+            # 旧格式记录：响应体以文本保存，只有media_type
+            body = record["body"].encode("utf-8")
+        headers = dict(record.get("headers") or {"content-type": record.get("media_type") or "application/json"})
+        headers["Idempotent-Replayed"] = "true"
+        return Response(content=body, status_code=record["status_code"], headers=headers)
+
+class IdempotencyClaim:
+    """本请求首次使用该键，执行完成后由中间件保存响应"""
+
+    def __init__(self, key: str, token: str, fingerprint: str):
+        self.key = key
+        self.token = token
+        self.fingerprint = fingerprint
+
+    def complete(self, status_code: int, body: bytes, headers: Dict[str, str]) -> None:
+        """保存原始响应体字节和响应头（不含Content-Length），重放时原样返回"""
+        # 429和5xx不保存：限流或生成失败后重试应当重新执行
+        if status_code == 429 or status_code >= 500:
+            self.release()
+            return
+        state_store.set(self.key, {
+            "state": "done",
+            "fingerprint": self.fingerprint,
+            "status_code": status_code,
+            "body_b64": base64.b64encode(body).decode("ascii"),
+            "headers": {name: value for name, value in headers.items() if name.lower() != "content-length"},
+            "completed_at": time.time(),
+        }, ttl=IDEMPOTENCY_TTL)
+
+    def release(self) -> None:
+        """放弃该键（仅删除自己持有的处理中标记）"""
+        state_store.update(
+            self.key, lambda record: None if record and record.get("token") == self.token else record
+        )
+
+def _fingerprint(request: Request, body: bytes) -> str:
+    digest = hashlib.sha256(f"{request.method} {request.url.path}\0".encode("utf-8"))
+    digest.update(body)
+    return digest.hexdigest()
+
+async def _claim(key: str, fingerprint: str) -> Optional[IdempotencyClaim]:
+    """键不存在时写入处理中标记并返回claim，已存在返回None"""
+    token = uuid.uuid4().hex
+    record = {"state": "in_progress", "fingerprint": fingerprint, "token": token, "started_at": time.time()}
+    if await asyncio.to_thread(state_store.add, key, record, IDEMPOTENCY_LOCK_TTL):
+        return IdempotencyClaim(key, token, fingerprint)
+    return None
+
+def idempotency(endpoint: str):
+    """
+    生成Idempotency-Key依赖：请求头带Idempotency-Key时，同一调用方使用相同键的重复请求不会重复执行
+    - 原请求已完成：直接返回保存的响应（响应头 Idempotent-Replayed: true）
+    - 原请求仍在处理：等待其完成后返回同样的结果，超过IDEMPOTENCY_WAIT返回409
+    - 相同键但请求内容不同：返回422
+    需放在准入控制之前，重试不消耗限流令牌和上游并发名额
+    用法: @router.post(..., dependencies=[Depends(idempotency("generate")), Depends(admission(...))])
+    """
+    async def dependency(request: Request):
+        client_key = request.headers.get("idempotency-key")
+        if client_key is None:
+            return
+        client_key = client_key.strip()
+        if not client_key or len(client_key) > MAX_KEY_LENGTH:
+            raise IdempotencyError(f"Idempotency-Key需为1-{MAX_KEY_LENGTH}个字符", 400)
+
+        key = f"idempotency:{endpoint}:{client_identity(request)}:{client_key}"
+        fingerprint = _fingerprint(request, await request.body())
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            # 首次使用该键，或原请求失败后释放了键（处理中标记过期同理）时由本请求执行
+            claim = await _claim(key, fingerprint)
+            if claim is not None:
+                request.state.idempotency_claim = claim
+                return
+            record = await asyncio.to_thread(state_store.get, key)
+            if record is None:
+                continue
+            if record["fingerprint"] != fingerprint:
+                raise IdempotencyError("Idempotency-Key已被内容不同的请求使用", 422)
+            if record["state"] == "done":
+                raise IdempotentReplay(record)
+            if time.monotonic() >= deadline:
+                raise IdempotencyError("相同Idempotency-Key的请求仍在处理中，请稍后重试", 409, retry_after=5)
+            await asyncio.sleep(0.25)
+
+    return dependency
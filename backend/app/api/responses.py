@@ -0,0 +1,162 @@
+import os
+import re
+from typing import Any, Dict, Optional, Tuple
+import anyio
+from fastapi.responses import Response
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from pydantic import BaseModel
+from pydantic_core import to_json
+from app.models.schemas import APIResponse
+
+class FastJSONResponse(Response):
+    """
+    直接把pydantic模型序列化为JSON字节的响应类
+    与JSONResponse(content=model.dict())相比，省去了中间dict和标准库json的二次编码
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        # pydantic_core.to_json 可直接处理模型、嵌套模型和普通容器，输出bytes
+        return to_json(content)
+
+def api_response(
+    success: bool,
+    message: str,
+    data: Optional[Dict[str, Any]] = None,
+    session_id: Optional[str] = None,
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+) -> FastJSONResponse:
+    """
+    构建统一格式的API响应
+    data中可以直接放入Session、AIAnalysis、MusicPrompt等模型，无需先调用.dict()
+    """
+    # 字段均由服务端构造，使用model_construct跳过重复校验
+    body: BaseModel = APIResponse.model_construct(
+        success=success,
+        message=message,
+        data=data,
+        session_id=session_id,
+    )
+    return FastJSONResponse(content=body, status_code=status_code, headers=headers)
+
+# 流式响应头（SSE/NDJSON）：禁止代理缓冲
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+# 不压缩的响应类型：流式响应（事件会被压缩缓冲区攒住）和本身已压缩的媒体（压缩后Range偏移也会失效）
+GZIP_EXCLUDED_MEDIA_TYPES = ("text/event-stream", "application/x-ndjson", "audio/", "image/", "video/")
+
+class _SelectiveGZipResponder(GZipResponder):
+    def __init__(self, app: ASGIApp, minimum_size: int, compresslevel: int = 9) -> None:
+        super().__init__(app, minimum_size, compresslevel=compresslevel)
+        self.passthrough = False
+
+    async def send_with_gzip(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.passthrough = content_type.startswith(GZIP_EXCLUDED_MEDIA_TYPES)
+        if self.passthrough:
+            await self.send(message)
+            return
+        await super().send_with_gzip(message)
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """按响应的Content-Type跳过GZIP_EXCLUDED_MEDIA_TYPES中的类型，其余与GZipMiddleware相同"""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _SelectiveGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+def sse_event(event: str, data: Any) -> bytes:
+    """编码一条SSE事件，data可以是模型或普通容器"""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + to_json(data) + b"\n\n"
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个Range区间，返回闭区间(start, end)
+    格式不支持（如多区间）时返回None表示忽略Range返回完整内容；区间无法满足时抛出ValueError
+    """
+    match = _RANGE.match(value.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # bytes=-N：最后N个字节
+        length = int(last)
+        if length == 0:
+            raise ValueError(value)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(value)
+    return start, end
+
+class RangeFileResponse(Response):
+    """
+    支持Range(206)、ETag/If-None-Match(304)和If-Range的静态文件响应，在线程中分块读取
+    """
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: str, request_headers: Headers, etag: str, media_type: str,
+                 cache_control: str = "public, max-age=31536000, immutable"):
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        size = os.stat(path).st_size
+        self.start, self.end = 0, size - 1
+        self.status_code = 200
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Cache-Control": cache_control,
+        }
+
+        if_none_match = request_headers.get("if-none-match")
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            self.status_code = 304
+        elif range_header and (if_range is None or if_range.strip() == etag):
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                self.status_code = 416
+                headers["Content-Range"] = f"bytes */{size}"
+            else:
+                if byte_range is not None:
+                    self.start, self.end = byte_range
+                    self.status_code = 206
+                    headers["Content-Range"] = f"bytes {self.start}-{self.end}/{size}"
+
+        self.length = 0 if self.status_code in (304, 416) else self.end - self.start + 1
+        if self.status_code != 304:
+            headers["Content-Length"] = str(self.length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.length == 0 or scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
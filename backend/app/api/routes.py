@@ -1,14 +1,34 @@
+import asyncio
 import os
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Body
-from fastapi.responses import JSONResponse
+import json
+import base64
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Body, Query, Depends, Request
+from fastapi.responses import StreamingResponse, RedirectResponse
+from pydantic_core import to_json
 from typing import Optional
 from app.models.schemas import (
-    UserInput, InputType, ClarificationResponse, APIResponse, 
+    UserInput, InputType, ClarificationResponse,
     SessionStatus
 )
-from app.services.session_manager import session_manager
+from app.api.responses import api_response, sse_event, SSE_HEADERS, RangeFileResponse
+from app.api.admission import admission, client_identity
+from app.api.idempotency import idempotency
+from app.services.session_manager import session_manager, iso_to_monotonic, monotonic_to_wall, wall_to_monotonic
 from app.services.ai_service import ai_service
 from app.services.coze_music_service import coze_music_service
+from app.services.generation_scheduler import generation_scheduler
+from app.services.generation_journal import generation_journal, current_session
+from app.services.model_router import model_router
+from app.services.deadline import DeadlineExceeded
+from app.services.concurrency_limiter import dashscope_limiter, coze_limiter
+from app.services.batch_service import BatchItem, batch_runner
+from app.services.variant_service import variant_runner, VARIANT_MAX_COUNT
+from app.services.warm_pool import warm_pool
+from app.services.audio_cache import audio_cache
+from app.services.waveform import waveform_service
+from app.utils.lyrics_timeline import LyricsTimeline, parse_lyrics
+from app.services.metrics import BCRYPT_SECONDS, AUDIO_REQUESTS
+from app.services.tracing import tracer
 from app.models.models import User
 from app.models.db import SessionLocal
 from sqlalchemy.exc import IntegrityError
@@ -21,8 +41,49 @@ router = APIRouter()
 # 配置文件上传限制
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 10485760))  # 10MB
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+# 会话列表单页上限
+SESSION_PAGE_MAX_LIMIT = int(os.getenv("SESSION_PAGE_MAX_LIMIT", 500))
+# 单个批量请求最多包含的输入数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
 
-@router.post("/analyze/text")
+def _question_items(questions) -> list:
+    return [
+        {
+            "question_id": q.question_id,
+            "question": q.question,
+            "options": q.options
+        }
+        for q in questions
+    ]
+
+def _audio_fields(music_url: str, lyrics=None) -> dict:
+    """
+    登记生成的曲目到本地音频缓存，返回供前端播放的本地地址（缓存关闭时为空）
+    歌词带时间信息时解析为时间轴随曲目保存，并在响应中附带紧凑格式，前端可直接按播放时间高亮
+    """
+    fields = {}
+    track_id = audio_cache.register(music_url)
+    if track_id is not None:
+        fields.update({"audio_id": track_id, "audio_url": f"/api/audio/{track_id}"})
+    timeline = parse_lyrics(lyrics) if lyrics else None
+    if timeline is not None:
+        compact = timeline.to_compact()
+        lyrics_id = audio_cache.set_lyrics(music_url, compact)
+        fields.update({"lyrics_timeline": compact, "lyrics_url": f"/api/audio/{lyrics_id}/lyrics"})
+    return fields
+
+def _analysis_response_data(ai_analysis) -> dict:
+    """分析接口的响应数据"""
+    response_data = {
+        "understanding": ai_analysis.understanding,
+        "music_elements": ai_analysis.music_elements,
+        "needs_clarification": ai_analysis.needs_clarification
+    }
+    if ai_analysis.needs_clarification and ai_analysis.clarification_questions:
+        response_data["clarification_questions"] = _question_items(ai_analysis.clarification_questions)
+    return response_data
+
+@router.post("/analyze/text", dependencies=[Depends(admission("analyze_text", upstream="dashscope"))])
 async def analyze_text(
     text_content: str = Form(...),
     session_id: Optional[str] = Form(None)
@@ -40,58 +101,80 @@ async def analyze_text(
         if not session_id:
             session_id = session_manager.create_session(user_input)
         else:
-            session = session_manager.get_session(session_id)
-            if not session:
-                return JSONResponse(
-                    status_code=404,
-                    content=APIResponse(
-                        success=False,
-                        message="会话不存在",
-                        session_id=session_id
-                    ).dict()
+            if not session_manager.get_record(session_id):
+                return api_response(
+                    success=False,
+                    message="会话不存在",
+                    session_id=session_id,
+                    status_code=404
                 )
         
         # 调用AI服务分析
-        ai_analysis = ai_service.analyze_input(user_input)
+        # 同步的上游调用（含并发名额排队、对冲等待）放到工作线程，不阻塞事件循环
+        ai_analysis = await asyncio.to_thread(ai_service.analyze_input, user_input)
         
         # 更新会话
         session_manager.update_ai_analysis(session_id, ai_analysis)
         
-        # 构建响应
-        response_data = {
-            "understanding": ai_analysis.understanding,
-            "music_elements": ai_analysis.music_elements,
-            "needs_clarification": ai_analysis.needs_clarification
-        }
-        
-        if ai_analysis.needs_clarification and ai_analysis.clarification_questions:
-            response_data["clarification_questions"] = [
-                {
-                    "question_id": q.question_id,
-                    "question": q.question,
-                    "options": q.options
-                }
-                for q in ai_analysis.clarification_questions
-            ]
-        
-        return JSONResponse(content=APIResponse(
+        return api_response(
             success=True,
             message="文本分析完成",
-            data=response_data,
+            data=_analysis_response_data(ai_analysis),
             session_id=session_id
-        ).dict())
+        )
         
     except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content=APIResponse(
-                success=False,
-                message=f"文本分析失败: {str(e)}",
-                session_id=session_id
-            ).dict()
+        return api_response(
+            success=False,
+            message=f"文本分析失败: {str(e)}",
+            session_id=session_id,
+            status_code=500
         )
 
-@router.post("/analyze/image")
+@router.post("/analyze/text/stream", dependencies=[Depends(admission("analyze_text", upstream="dashscope"))])
+async def analyze_text_stream(
+    text_content: str = Form(...),
+    session_id: Optional[str] = Form(None)
+):
+    """
+    流式分析文本输入（SSE）
+    事件顺序：session → understanding（增量文本，多次）→ music_elements → clarification_questions → done
+    done事件携带与 /analyze/text 相同的完整数据；出错时发送error事件
+    """
+    user_input = UserInput(
+        session_id=session_id,
+        input_type=InputType.TEXT,
+        text_content=text_content
+    )
+    if not session_id:
+        session_id = session_manager.create_session(user_input)
+    elif not session_manager.get_record(session_id):
+        return api_response(
+            success=False,
+            message="会话不存在",
+            session_id=session_id,
+            status_code=404
+        )
+
+    def events():
+        yield sse_event("session", {"session_id": session_id})
+        try:
+            for event, payload in ai_service.stream_analysis(user_input):
+                if event == "understanding":
+                    yield sse_event(event, {"delta": payload})
+                elif event == "clarification_questions":
+                    yield sse_event(event, _question_items(payload))
+                elif event == "analysis":
+                    session_manager.update_ai_analysis(session_id, payload)
+                    yield sse_event("done", _analysis_response_data(payload))
+                else:
+                    yield sse_event(event, payload)
+        except Exception as e:
+            yield sse_event("error", {"message": f"文本分析失败: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/analyze/image", dependencies=[Depends(admission("analyze_image", upstream="dashscope"))])
 async def analyze_image(
     image: UploadFile = File(...),
     session_id: Optional[str] = Form(None)
@@ -128,148 +211,226 @@ async def analyze_image(
         if not session_id:
             session_id = session_manager.create_session(user_input)
         else:
-            session = session_manager.get_session(session_id)
-            if not session:
-                return JSONResponse(
-                    status_code=404,
-                    content=APIResponse(
-                        success=False,
-                        message="会话不存在",
-                        session_id=session_id
-                    ).dict()
+            if not session_manager.get_record(session_id):
+                return api_response(
+                    success=False,
+                    message="会话不存在",
+                    session_id=session_id,
+                    status_code=404
                 )
         
         # 调用AI服务分析（使用内存字节流）
-        ai_analysis = ai_service.analyze_input(user_input, image_bytes=content)
+        ai_analysis = await asyncio.to_thread(ai_service.analyze_input, user_input, image_bytes=content)
         
         # 更新会话
         session_manager.update_ai_analysis(session_id, ai_analysis)
         
-        # 构建响应
-        response_data = {
-            "understanding": ai_analysis.understanding,
-            "music_elements": ai_analysis.music_elements,
-            "needs_clarification": ai_analysis.needs_clarification
-        }
-        
-        if ai_analysis.needs_clarification and ai_analysis.clarification_questions:
-            response_data["clarification_questions"] = [
-                {
-                    "question_id": q.question_id,
-                    "question": q.question,
-                    "options": q.options
-                }
-                for q in ai_analysis.clarification_questions
-            ]
-        
-        return JSONResponse(content=APIResponse(
+        return api_response(
             success=True,
             message="图片分析完成",
-            data=response_data,
+            data=_analysis_response_data(ai_analysis),
             session_id=session_id
-        ).dict())
+        )
         
     except HTTPException:
         raise
     except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content=APIResponse(
-                success=False,
-                message=f"图片分析失败: {str(e)}",
-                session_id=session_id
-            ).dict()
+        return api_response(
+            success=False,
+            message=f"图片分析失败: {str(e)}",
+            session_id=session_id,
+            status_code=500
         )
 
-@router.post("/clarify")
+def _check_image(filename: Optional[str], content: bytes) -> None:
+    """校验图片文件名后缀和大小，不合法时抛出ValueError"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        raise ValueError(f"不支持的文件类型。支持的类型: {', '.join(ALLOWED_EXTENSIONS)}")
+    if len(content) > MAX_FILE_SIZE:
+        raise ValueError(f"文件过大。最大允许大小: {MAX_FILE_SIZE/1024/1024}MB")
+
+async def _read_batch_items(request: Request) -> list:
+    """
+    解析批量输入
+    - application/x-ndjson: 每行 {"id": 可选, "text": "..."} 或 {"id": 可选, "image": "base64", "filename": "a.jpg"}
+    - multipart/form-data: 可重复的texts文本字段和images文件字段
+    """
+    items = []
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        for text in form.getlist("texts"):
+            items.append(BatchItem(len(items), None, InputType.TEXT.value, text=str(text)))
+        for upload in form.getlist("images"):
+            items.append(BatchItem(len(items), upload.filename, InputType.IMAGE.value,
+                                   image_bytes=await upload.read(), filename=upload.filename))
+    else:
+        async for line in _iter_lines(request):
+            record = json.loads(line)
+            if record.get("image") is not None:
+                items.append(BatchItem(len(items), record.get("id"), InputType.IMAGE.value,
+                                       image_bytes=base64.b64decode(record["image"]),
+                                       filename=record.get("filename") or "image.jpg"))
+            else:
+                items.append(BatchItem(len(items), record.get("id"), InputType.TEXT.value, text=record.get("text") or ""))
+            if len(items) > BATCH_MAX_ITEMS:
+                break
+    return items
+
+async def _iter_lines(request: Request):
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+def _analyze_batch_item(item: BatchItem) -> dict:
+    """处理批量中的单个输入：新建会话并分析（在工作线程中执行）"""
+    if item.input_type == InputType.IMAGE.value:
+        _check_image(item.filename, item.image_bytes)
+        user_input = UserInput(input_type=InputType.IMAGE, image_filename=None)
+    else:
+        if not item.text.strip():
+            raise ValueError("文本内容为空")
+        user_input = UserInput(input_type=InputType.TEXT, text_content=item.text)
+    ai_analysis = ai_service.analyze_input(user_input, image_bytes=item.image_bytes, allow_fallback=False)
+    session_id = session_manager.create_session(user_input)
+    session_manager.update_ai_analysis(session_id, ai_analysis)
+    return {"session_id": session_id, "data": _analysis_response_data(ai_analysis)}
+
+@router.post("/analyze/batch", dependencies=[Depends(admission("analyze_batch"))])
+async def analyze_batch(request: Request, batch_id: Optional[str] = Query(None)):
+    """
+    批量分析文本/图片输入，以NDJSON流式返回结果（按完成顺序，每行一条，最后一行为summary）
+    相同内容的输入只分析一次；传入之前返回的batch_id重新提交时，已成功的输入直接返回保存的结果
+    """
+    try:
+        items = await _read_batch_items(request)
+    except (ValueError, KeyError) as e:
+        return api_response(success=False, message=f"批量输入格式错误: {str(e)}", status_code=400)
+    if not items:
+        return api_response(success=False, message="批量输入为空", status_code=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return api_response(success=False, message=f"单个批次最多 {BATCH_MAX_ITEMS} 条输入", status_code=413)
+
+    batch_id = batch_id or batch_runner.new_batch_id()
+
+    async def generate_lines():
+        yield to_json({"type": "batch", "batch_id": batch_id, "inputs": len(items)}) + b"\n"
+        async for line in batch_runner.run(batch_id, items, _analyze_batch_item):
+            yield to_json(line) + b"\n"
+
+    return StreamingResponse(
+        generate_lines(), media_type="application/x-ndjson", headers={**SSE_HEADERS, "X-Batch-Id": batch_id}
+    )
+
+@router.get("/analyze/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    """批次进度：输入总数（去重后）及成功/失败的输入"""
+    meta = batch_runner.get_batch(batch_id)
+    if meta is None:
+        return api_response(success=False, message="批次不存在或已过期", status_code=404)
+    return api_response(
+        success=True,
+        message="批次状态获取成功",
+        data={
+            "batch_id": batch_id,
+            "total": meta.get("total", 0),
+            "succeeded": len(meta["succeeded"]),
+            "failed": len(meta["failed"]),
+            "updated_at": meta.get("updated_at"),
+        }
+    )
+
+@router.post("/clarify", dependencies=[
+    Depends(idempotency("clarify")), Depends(admission("clarify", upstream="dashscope"))
+])
 async def submit_clarification(clarification: ClarificationResponse):
     """提交澄清回答"""
     try:
         # 获取会话
-        session = session_manager.get_session(clarification.session_id)
-        if not session:
-            return JSONResponse(
-                status_code=404,
-                content=APIResponse(
-                    success=False,
-                    message="会话不存在",
-                    session_id=clarification.session_id
-                ).dict()
+        tracer.set_attribute("session.id", clarification.session_id)
+        record = session_manager.get_record(clarification.session_id)
+        if not record:
+            return api_response(
+                success=False,
+                message="会话不存在",
+                session_id=clarification.session_id,
+                status_code=404
             )
         
         # 添加澄清回答
-        session_manager.add_clarification_response(clarification.session_id, clarification)
+        with tracer.span("session.add_clarification"):
+            session_manager.add_clarification_response(clarification.session_id, clarification)
         
         # 检查是否还需要更多澄清
-        updated_session = session_manager.get_session(clarification.session_id)
-        if (updated_session.ai_analysis and 
-            updated_session.ai_analysis.clarification_questions and
-            len(updated_session.clarification_history) < len(updated_session.ai_analysis.clarification_questions)):
+        if record.questions and record.answered_count < len(record.questions):
             
             # 还有未回答的问题
-            remaining_questions = updated_session.ai_analysis.clarification_questions[len(updated_session.clarification_history):]
-            return JSONResponse(content=APIResponse(
+            remaining_questions = record.questions[record.answered_count:]
+            return api_response(
                 success=True,
                 message="澄清回答已收到，请继续回答剩余问题",
                 data={
                     "needs_more_clarification": True,
                     "remaining_questions": [
                         {
-                            "question_id": q.question_id,
-                            "question": q.question,
-                            "options": q.options
+                            "question_id": question_id,
+                            "question": question,
+                            "options": options
                         }
-                        for q in remaining_questions
+                        for question, options, question_id in remaining_questions
                     ]
                 },
                 session_id=clarification.session_id
-            ).dict())
+            )
         
         # 所有问题都已回答，生成最终音乐提示词
-        session_data = {
-            "original_input": updated_session.original_input.dict(),
-            "ai_analysis": updated_session.ai_analysis.dict() if updated_session.ai_analysis else {},
-            "clarification_history": [resp.dict() for resp in updated_session.clarification_history]
-        }
+        session_data = record.to_session_data()
         
-        final_prompt = ai_service.generate_final_prompt(session_data)
-        session_manager.set_final_prompt(clarification.session_id, final_prompt)
+        final_prompt = await asyncio.to_thread(ai_service.generate_final_prompt, session_data)
+        with tracer.span("session.set_final_prompt"):
+            session_manager.set_final_prompt(clarification.session_id, final_prompt)
         
-        return JSONResponse(content=APIResponse(
+        return api_response(
             success=True,
             message="澄清完成，音乐提示词已生成",
             data={
                 "needs_more_clarification": False,
-                "final_prompt": final_prompt.dict(),
+                "final_prompt": final_prompt,
                 "ready_for_generation": True
             },
             session_id=clarification.session_id
-        ).dict())
+        )
         
     except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content=APIResponse(
-                success=False,
-                message=f"澄清处理失败: {str(e)}",
-                session_id=clarification.session_id
-            ).dict()
+        return api_response(
+            success=False,
+            message=f"澄清处理失败: {str(e)}",
+            session_id=clarification.session_id,
+            status_code=500
         )
 
-@router.post("/generate/{session_id}")
-async def generate_music(session_id: str, request: Optional[dict] = None):
+@router.post("/generate/{session_id}", dependencies=[
+    Depends(idempotency("generate")), Depends(admission("generate", upstream="coze"))
+])
+async def generate_music(session_id: str, http_request: Request, request: Optional[dict] = None):
     """生成音乐"""
     try:
         # 获取会话
-        session = session_manager.get_session(session_id)
-        if not session:
-            return JSONResponse(
-                status_code=404,
-                content=APIResponse(
-                    success=False,
-                    message="会话不存在",
-                    session_id=session_id
-                ).dict()
+        tracer.set_attribute("session.id", session_id)
+        record = session_manager.get_record(session_id)
+        if not record:
+            return api_response(
+                success=False,
+                message="会话不存在",
+                session_id=session_id,
+                status_code=404
             )
         
         # 如果有用户参数，使用用户参数生成提示词；否则使用现有的final_prompt
@@ -277,33 +438,66 @@ async def generate_music(session_id: str, request: Optional[dict] = None):
             print(f"🎯 接收到用户音乐参数: {request}")
             
             # 将用户参数保存到session中，并重新生成final_prompt
-            session_data = {
-                'original_input': session.original_input.__dict__ if session.original_input else {},
-                'ai_analysis': session.ai_analysis.__dict__ if session.ai_analysis else {},
-                'clarification_history': session.clarification_history,
-                'user_music_params': request  # 新增用户参数
-            }
+            session_data = record.to_session_data()
+            session_data['user_music_params'] = request  # 新增用户参数
             
-            # 使用AI服务重新生成音乐提示词，结合用户参数
-            session.final_prompt = ai_service.generate_final_prompt_with_user_params(session_data, request)
-            print(f"🎵 根据用户参数重新生成提示词: {session.final_prompt}")
+            # 使用AI服务重新生成音乐提示词，结合用户参数（同步的上游调用放到工作线程，不阻塞事件循环）
+            final_prompt = await asyncio.to_thread(
+                ai_service.generate_final_prompt_with_user_params, session_data, request
+            )
+            session_manager.set_final_prompt(session_id, final_prompt)
+            print(f"🎵 根据用户参数重新生成提示词: {final_prompt}")
         
-        elif not session.final_prompt:
-            return JSONResponse(
-                status_code=400,
-                content=APIResponse(
-                    success=False,
-                    message="未找到音乐生成提示词，请先完成澄清流程或提供音乐参数",
-                    session_id=session_id
-                ).dict()
+        elif record.final_prompt is None:
+            return api_response(
+                success=False,
+                message="未找到音乐生成提示词，请先完成澄清流程或提供音乐参数",
+                session_id=session_id,
+                status_code=400
             )
         
+        else:
+            final_prompt = record.to_final_prompt()
+        
+        # 热门gen_bgm预设：统计请求频率，曲目池里有现成曲目时直接返回
+        if warm_pool.enabled and final_prompt.interface == "gen_bgm":
+            normalized_prompt = coze_music_service.normalized(final_prompt)
+            # 统计和取曲目都要写共享状态存储（SQLite后端为写事务），放到工作线程
+            await asyncio.to_thread(warm_pool.record, normalized_prompt)
+            track = await asyncio.to_thread(warm_pool.take, normalized_prompt)
+            if track:
+                tracer.set_attribute("generation.warm_pool", "hit")
+                session_manager.set_generated_music(session_id, track["music_url"])
+                response_data = {
+                    "music_url": track["music_url"],
+                    "music_prompt": normalized_prompt,
+                    "generation_completed": True,
+                    "from_pool": True,
+                    **_audio_fields(track["music_url"], track.get("lyrics"))
+                }
+                if track.get("lyrics"):
+                    response_data["lyrics"] = track["lyrics"]
+                return api_response(
+                    success=True,
+                    message="音乐生成完成",
+                    data=response_data,
+                    session_id=session_id
+                )
+        
         # 更新状态为生成中
         session_manager.update_session_status(session_id, SessionStatus.GENERATING)
         
-        # 调用Coze音乐生成API
+        # 调用Coze音乐生成API（进入生成队列，按用户公平调度，在工作线程中执行）
         print(f"开始为会话 {session_id} 生成音乐")
-        success, result, lyrics = coze_music_service.generate_music(session.final_prompt)
+        # 生成日志按会话记录已提交的对话，进程重启后可恢复结果
+        current_session.set(session_id)
+        with tracer.span("generation.scheduled", interface=final_prompt.interface):
+            success, result, lyrics = await generation_scheduler.run(
+                lambda: coze_music_service.generate_music(final_prompt),
+                user_id=client_identity(http_request),
+                interface=final_prompt.interface,
+                duration=final_prompt.duration
+            )
         
         if not success:
             # 音乐生成失败
@@ -320,22 +514,20 @@ async def generate_music(session_id: str, request: Optional[dict] = None):
             elif "未返回音乐链接" in result:
                 error_message = "音乐生成完成但未获取到下载链接，请重新生成"
             
-            return JSONResponse(
-                status_code=500,
-                content=APIResponse(
-                    success=False,
-                    message=f"音乐生成失败: {error_message}",
-                    data={
-                        "error_detail": result,
-                        "suggestions": [
-                            "尝试选择不同的音乐风格组合",
-                            "检查输入的文字描述是否过长或包含特殊字符", 
-                            "稍后重新尝试生成",
-                            "如果问题持续，请联系技术支持"
-                        ]
-                    },
-                    session_id=session_id
-                ).dict()
+            return api_response(
+                success=False,
+                message=f"音乐生成失败: {error_message}",
+                data={
+                    "error_detail": result,
+                    "suggestions": [
+                        "尝试选择不同的音乐风格组合",
+                        "检查输入的文字描述是否过长或包含特殊字符", 
+                        "稍后重新尝试生成",
+                        "如果问题持续，请联系技术支持"
+                    ]
+                },
+                session_id=session_id,
+                status_code=500
             )
         
         # 音乐生成成功
@@ -348,8 +540,9 @@ async def generate_music(session_id: str, request: Optional[dict] = None):
         # 构建响应数据
         response_data = {
             "music_url": music_url,
-            "music_prompt": session.final_prompt.dict(),
-            "generation_completed": True
+            "music_prompt": final_prompt,
+            "generation_completed": True,
+            **_audio_fields(music_url, lyrics)
         }
         
         # 如果有歌词，添加到响应中
@@ -357,82 +550,302 @@ async def generate_music(session_id: str, request: Optional[dict] = None):
             response_data["lyrics"] = lyrics
             print(f"包含歌词: {lyrics[:100]}...")
         
-        return JSONResponse(content=APIResponse(
+        return api_response(
             success=True,
             message="音乐生成完成",
             data=response_data,
             session_id=session_id
-        ).dict())
+        )
         
+    except DeadlineExceeded as e:
+        session_manager.set_error_status(session_id)
+        return api_response(
+            success=False,
+            message=f"音乐生成失败: {e.message}",
+            session_id=session_id,
+            status_code=504
+        )
     except Exception as e:
         session_manager.set_error_status(session_id)
-        return JSONResponse(
-            status_code=500,
-            content=APIResponse(
-                success=False,
-                message=f"音乐生成失败: {str(e)}",
-                session_id=session_id
-            ).dict()
+        return api_response(
+            success=False,
+            message=f"音乐生成失败: {str(e)}",
+            session_id=session_id,
+            status_code=500
+        )
+
+@router.post("/generate/{session_id}/variants", dependencies=[Depends(admission("generate_variants"))])
+async def generate_music_variants(
+    session_id: str,
+    http_request: Request,
+    count: int = Query(3, ge=2, le=VARIANT_MAX_COUNT)
+):
+    """
+    基于会话的最终提示词并行生成多个版本（每个版本变化一项风格参数），以NDJSON流式返回
+    每个版本完成即返回一行，最后一行为summary；会话记录第一个成功版本的音乐链接
+    """
+    tracer.set_attribute("session.id", session_id)
+    record = session_manager.get_record(session_id)
+    if not record:
+        return api_response(success=False, message="会话不存在", session_id=session_id, status_code=404)
+    if record.final_prompt is None:
+        return api_response(
+            success=False,
+            message="未找到音乐生成提示词，请先完成澄清流程",
+            session_id=session_id,
+            status_code=400
         )
 
+    variants = coze_music_service.derive_variants(record.to_final_prompt(), count, seed=session_id)
+    user_id = client_identity(http_request)
+    session_manager.update_session_status(session_id, SessionStatus.GENERATING)
+
+    async def generate_lines():
+        music_url = None
+        try:
+            async for line in variant_runner.run(user_id, variants, coze_music_service.generate_music):
+                if line.get("status") == "done":
+                    line.update(_audio_fields(line["music_url"], line.get("lyrics")))
+                    if music_url is None:
+                        music_url = line["music_url"]
+                        session_manager.set_generated_music(session_id, music_url)
+                yield to_json(line) + b"\n"
+        finally:
+            if music_url is None:
+                session_manager.set_error_status(session_id)
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson", headers=SSE_HEADERS)
+
+@router.get("/generation/queue")
+async def get_generation_queue():
+    """获取生成队列状态、各优先级类别的排队等待统计和Coze自适应并发上限"""
+    return api_response(
+        success=True,
+        message="生成队列状态获取成功",
+        data={**generation_scheduler.stats(), "upstream_limit": coze_limiter.stats()}
+    )
+
+@router.get("/analyze/routes")
+async def get_model_routes():
+    """DashScope各模型路由的延迟分位数、对冲次数、token用量、估算费用和自适应并发上限"""
+    return api_response(
+        success=True,
+        message="模型路由统计获取成功",
+        data={**model_router.stats(), "upstream_limit": dashscope_limiter.stats()}
+    )
+
+@router.get("/generation/warm-pool")
+async def get_warm_pool():
+    """预生成曲目池：当前最热门的gen_bgm预设及各自现成的曲目数"""
+    return api_response(success=True, message="曲目池状态获取成功", data=await asyncio.to_thread(warm_pool.stats))
+
+@router.api_route("/audio/{track_id}", methods=["GET", "HEAD"])
+async def get_audio(track_id: str, request: Request):
+    """
+    播放/下载生成的曲目：已缓存时从本地磁盘返回（支持Range拖动、ETag），
+    尚未缓存完成或已被淘汰时临时重定向到上游链接
+    """
+    track = audio_cache.get_track(track_id)
+    if track is None:
+        return api_response(success=False, message="曲目不存在或已过期", status_code=404)
+    path = audio_cache.open_blob(track)
+    if path is not None:
+        try:
+            response = RangeFileResponse(
+                path, request.headers, etag=f'"{track["sha256"]}"', media_type=track["content_type"] or "audio/mpeg"
+            )
+        except FileNotFoundError:
+            # 刚好被淘汰
+            pass
+        else:
+            AUDIO_REQUESTS.inc(result="hit")
+            return response
+    AUDIO_REQUESTS.inc(result="miss")
+    return RedirectResponse(track["url"], status_code=307)
+
+@router.get("/audio/{track_id}/peaks")
+async def get_audio_peaks(track_id: str, bins: int = Query(1000, ge=1, le=100000)):
+    """
+    曲目的波形峰值（int8的min/max交替数组，格式同audiowaveform JSON）
+    返回区间数不少于bins的最粗一级，前端按宽度请求即可直接绘制
+    """
+    track = audio_cache.get_track(track_id)
+    if track is None:
+        return api_response(success=False, message="曲目不存在或已过期", status_code=404)
+    peaks = await asyncio.to_thread(waveform_service.load, track, bins)
+    if peaks is None:
+        return api_response(
+            success=False, message="波形数据尚未生成，请稍后重试", status_code=404, headers={"Retry-After": "2"}
+        )
+    return api_response(
+        success=True, message="波形获取成功", data=peaks, headers={"Cache-Control": "public, max-age=86400"}
+    )
+
+@router.get("/audio/{track_id}/lyrics")
+async def get_audio_lyrics(track_id: str, t: Optional[float] = Query(None, ge=0)):
+    """
+    曲目的歌词时间轴（紧凑格式：t为各行开始毫秒，d为持续毫秒，text为歌词）
+    带t（秒）时额外返回该播放时间所在行的下标current（不在任何一行内时为-1）
+    """
+    compact = audio_cache.get_lyrics(track_id)
+    if compact is None:
+        return api_response(success=False, message="歌词时间轴不存在或已过期", status_code=404)
+    data = dict(compact)
+    if t is not None:
+        data["current"] = LyricsTimeline.from_compact(compact).at(int(t * 1000))
+    return api_response(
+        success=True, message="歌词获取成功", data=data, headers={"Cache-Control": "public, max-age=86400"}
+    )
+
 @router.get("/session/{session_id}")
 async def get_session_status(session_id: str):
     """获取会话状态"""
     try:
         session = session_manager.get_session(session_id)
         if not session:
-            return JSONResponse(
-                status_code=404,
-                content=APIResponse(
-                    success=False,
-                    message="会话不存在",
+            # 会话已随进程重启丢失，但生成日志恢复了该会话的生成结果
+            result = generation_journal.result(session_id)
+            if result is not None:
+                return api_response(
+                    success=True,
+                    message="会话已过期，返回恢复的生成结果",
+                    data={"session": None, "generation": result},
                     session_id=session_id
-                ).dict()
+                )
+            return api_response(
+                success=False,
+                message="会话不存在",
+                session_id=session_id,
+                status_code=404
             )
         
-        return JSONResponse(content=APIResponse(
+        return api_response(
             success=True,
             message="会话状态获取成功",
             data={
-                "session": session.dict()
+                "session": session
             },
             session_id=session_id
-        ).dict())
+        )
         
     except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content=APIResponse(
-                success=False,
-                message=f"获取会话状态失败: {str(e)}",
-                session_id=session_id
-            ).dict()
+        return api_response(
+            success=False,
+            message=f"获取会话状态失败: {str(e)}",
+            session_id=session_id,
+            status_code=500
         )
 
+def _encode_cursor(sort_key) -> str:
+    """将分页排序键编码为不透明游标；创建时间换算为墙上时间，重启或请求落到其他worker后游标仍然有效"""
+    created_at, session_id = sort_key
+    raw = json.dumps([monotonic_to_wall(created_at), session_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str):
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return wall_to_monotonic(float(created_at)), str(session_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+def _parse_time_filter(value: Optional[str]) -> Optional[float]:
+    """解析ISO格式的时间过滤参数，格式错误时抛出ValueError"""
+    if not value:
+        return None
+    try:
+        return iso_to_monotonic(value)
+    except ValueError:
+        raise ValueError(f"无效的时间格式: {value}，请使用ISO格式")
+
+def _parse_status_filter(status: Optional[str]):
+    """解析逗号分隔的状态过滤参数，格式错误时抛出ValueError"""
+    if not status:
+        return None
+    try:
+        return [SessionStatus(item.strip()) for item in status.split(",") if item.strip()]
+    except ValueError:
+        valid = ", ".join(s.value for s in SessionStatus)
+        raise ValueError(f"无效的会话状态，可选值: {valid}")
+
 @router.get("/sessions")
-async def list_sessions():
-    """列出所有会话（用于调试）"""
+async def list_sessions(
+    status: Optional[str] = Query(None, description="按状态过滤，多个状态用逗号分隔"),
+    created_after: Optional[str] = Query(None, description="创建时间下界（ISO格式，含）"),
+    created_before: Optional[str] = Query(None, description="创建时间上界（ISO格式，不含）"),
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor"),
+    limit: int = Query(50, ge=1, le=SESSION_PAGE_MAX_LIMIT)
+):
+    """分页列出会话（用于调试）"""
     try:
-        sessions = {
-            session_id: session.dict() 
-            for session_id, session in session_manager.sessions.items()
-        }
+        statuses = _parse_status_filter(status)
+        sort_key = _decode_cursor(cursor) if cursor else None
+        after_ts = _parse_time_filter(created_after)
+        before_ts = _parse_time_filter(created_before)
+    except ValueError as e:
+        return api_response(
+            success=False,
+            message=str(e),
+            status_code=400
+        )
+
+    try:
+        page, next_key = session_manager.list_sessions(
+            statuses=statuses,
+            created_after=after_ts,
+            created_before=before_ts,
+            cursor=sort_key,
+            limit=limit
+        )
         
-        return JSONResponse(content=APIResponse(
+        return api_response(
             success=True,
             message="会话列表获取成功",
-            data={"sessions": sessions}
-        ).dict())
+            data={
+                "sessions": [record.to_session() for record in page],
+                "next_cursor": _encode_cursor(next_key) if next_key else None,
+                "total": session_manager.count_sessions()
+            }
+        )
         
     except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content=APIResponse(
-                success=False,
-                message=f"获取会话列表失败: {str(e)}"
-            ).dict()
+        return api_response(
+            success=False,
+            message=f"获取会话列表失败: {str(e)}",
+            status_code=500
+        )
+
+@router.get("/sessions/export")
+async def export_sessions(
+    status: Optional[str] = Query(None, description="按状态过滤，多个状态用逗号分隔"),
+    created_after: Optional[str] = Query(None, description="创建时间下界（ISO格式，含）"),
+    created_before: Optional[str] = Query(None, description="创建时间上界（ISO格式，不含）")
+):
+    """以NDJSON流式导出会话（每行一个会话，内存占用与会话总数无关）"""
+    try:
+        statuses = _parse_status_filter(status)
+        after_ts = _parse_time_filter(created_after)
+        before_ts = _parse_time_filter(created_before)
+    except ValueError as e:
+        return api_response(
+            success=False,
+            message=str(e),
+            status_code=400
         )
 
+    def generate_lines():
+        # 同步生成器由Starlette放到线程池中迭代，不阻塞事件循环
+        for record in session_manager.iter_sessions(
+            statuses=statuses,
+            created_after=after_ts,
+            created_before=before_ts
+        ):
+            yield record.to_session().model_dump_json() + "\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson", headers=SSE_HEADERS)
+
 @router.post("/register")
 def register(user: dict = Body(...)):
     db: Session = SessionLocal()
@@ -440,10 +853,12 @@ def register(user: dict = Body(...)):
         if db.query(User).filter(User.username == user['username']).first():
             raise HTTPException(status_code=400, detail="用户名已存在")
         password = user['password'][:72]  # 截断密码为72字节
+        with BCRYPT_SECONDS.time(operation="hash"):
+            hashed_password = bcrypt.hash(password)
         new_user = User(
             username=user['username'],
             email=user['email'],
-            hashed_password=bcrypt.hash(password)
+            hashed_password=hashed_password
         )
         db.add(new_user)
         db.commit()
@@ -459,7 +874,11 @@ def login(user: dict = Body(...)):
     db: Session = SessionLocal()
     try:
         db_user = db.query(User).filter(User.username == user['username']).first()
-        if not db_user or not bcrypt.verify(user['password'], db_user.hashed_password):
+        password_ok = False
+        if db_user:
+            with BCRYPT_SECONDS.time(operation="verify"):
+                password_ok = bcrypt.verify(user['password'], db_user.hashed_password)
+        if not password_ok:
             return {"success": False, "message": "用户名或密码错误"}
         return {"success": True, "message": "登录成功"}
     except Exception as e:
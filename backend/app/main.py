@@ -1,3 +1,4 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -6,9 +7,23 @@ load_dotenv()
 
 from app.models.db import SessionLocal
 import uvicorn
-from fastapi import FastAPI, HTTPException
+import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import router
+from app.api.admin import admin_router
+from app.api.admission import RateLimitExceeded
+from app.api.idempotency import IdempotencyError, IdempotentReplay
+from app.api.responses import api_response, SelectiveGZipMiddleware
+from app.services.metrics import metrics, HTTP_REQUEST_SECONDS
+from app.services.coze_music_service import coze_music_service
+from app.services.deadline import deadline, DeadlineExceeded
+from app.services.generation_journal import generation_journal
+from app.services.generation_scheduler import generation_scheduler
+from app.services.lifecycle import drain_controller, ServiceDraining
+from app.services.warm_pool import warm_pool
+from app.services.tracing import tracer
 from sqlalchemy import text  
 
 # 创建FastAPI应用
@@ -27,8 +42,177 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """记录每个请求的处理耗时；按路由模板聚合，避免session_id等路径参数撑大标签基数"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    为每个请求开启一条链路；链路会被导出时（采样、出错或慢请求）在响应头X-Trace-Id中返回trace id
+    请求带 X-Trace-Debug: 1 时强制采样，便于复现单个慢请求/异常请求
+    """
+    with tracer.trace_request(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent"),
+        force=request.headers.get("X-Trace-Debug") == "1",
+        **{"http.method": request.method, "http.target": request.url.path},
+    ) as span:
+        response = await call_next(request)
+        if span is not None:
+            route = request.scope.get("route")
+            if route is not None:
+                span.name = f"{request.method} {route.path}"
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_error(f"HTTP {response.status_code}")
+            if tracer.will_export(span):
+                response.headers["X-Trace-Id"] = span.trace_id
+        return response
+
+# 各路由前缀的默认截止时间（秒），其余请求使用REQUEST_DEADLINE
+ROUTE_DEADLINES = (
+    ("/api/analyze/batch", float(os.getenv("BATCH_DEADLINE", 600))),
+    ("/api/generate", float(os.getenv("GENERATION_DEADLINE", 330))),
+)
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 60))
+
+@app.middleware("http")
+async def propagate_deadline(request: Request, call_next):
+    """
+    为每个请求设置截止时间，随contextvars传递到DashScope/Coze调用、轮询、生成队列和数据库操作
+    客户端可通过 X-Request-Timeout（秒）声明自己愿意等待的时间，只能缩短路由的默认值
+    """
+    path = request.url.path
+    seconds = next((s for prefix, s in ROUTE_DEADLINES if path.startswith(prefix)), REQUEST_DEADLINE)
+    try:
+        seconds = min(seconds, float(request.headers.get("x-request-timeout") or seconds))
+    except ValueError:
+        pass
+    with deadline(seconds):
+        return await call_next(request)
+
+@app.middleware("http")
+async def complete_idempotent_requests(request: Request, call_next):
+    """带Idempotency-Key的请求首次执行完成后，保存响应供重复请求直接返回（键的占用见app.api.idempotency）"""
+    try:
+        response = await call_next(request)
+    except BaseException:
+        claim = getattr(request.state, "idempotency_claim", None)
+        if claim is not None:
+            claim.release()
+        raise
+    claim = getattr(request.state, "idempotency_claim", None)
+    if claim is None:
+        return response
+    try:
+        body = b"".join([chunk async for chunk in response.body_iterator])
+    except BaseException:
+        claim.release()
+        raise
+    headers = dict(response.headers)
+    try:
+        await asyncio.to_thread(claim.complete, response.status_code, body, headers)
+    except Exception as e:
+        # 保存失败时放弃该键，重试会重新执行；本次结果照常返回
+        print(f"保存幂等响应失败: {e}")
+        claim.release()
+    return Response(content=body, status_code=response.status_code, headers=headers)
+
+# 超过阈值的响应体进行gzip压缩（仅当客户端声明支持gzip时生效；流式响应和音频等媒体不压缩）
+# 最后注册、位于最外层：其余中间件（包括保存幂等响应）处理的都是未压缩的响应体
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    minimum_size=int(os.getenv("RESPONSE_GZIP_MIN_SIZE", 1024)),
+)
+
 # 注册路由
 app.include_router(router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus抓取端点"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request, exc: RateLimitExceeded):
+    """准入控制拒绝时快速返回429，并通过Retry-After告知客户端重试时间"""
+    return api_response(
+        success=False,
+        message=exc.message,
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(ServiceDraining)
+async def service_draining_handler(request, exc: ServiceDraining):
+    """优雅下线期间拒绝新的分析/生成请求，客户端重试时会被负载均衡到其他实例"""
+    return api_response(
+        success=False,
+        message=exc.message,
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    """请求截止时间内无法完成：返回504，不再占用上游名额和工作线程"""
+    return api_response(success=False, message=exc.message, status_code=504)
+
+@app.exception_handler(IdempotentReplay)
+async def idempotent_replay_handler(request, exc: IdempotentReplay):
+    """重复的Idempotency-Key请求：返回原请求的响应"""
+    return exc.to_response()
+
+@app.exception_handler(IdempotencyError)
+async def idempotency_error_handler(request, exc: IdempotencyError):
+    return api_response(
+        success=False,
+        message=exc.message,
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    )
+
+@app.on_event("startup")
+async def recover_generations():
+    """接管已退出进程遗留的生成日志，继续轮询重启前（或其他进程下线时）未完成的Coze对话"""
+    generation_journal.start(
+        coze_music_service.resume_chat,
+        lambda func, interface: generation_scheduler.submit(
+            func, user_id="generation-recovery", interface=interface, priority="bulk"
+        ),
+    )
+
+@app.on_event("startup")
+async def install_drain_handler():
+    """
+    SIGTERM时先优雅下线再退出：等待生成队列清空，超时后停止调度器并交出生成日志
+    DRAIN_TIMEOUT需小于编排系统的强制终止等待时间（如Kubernetes的terminationGracePeriodSeconds）
+    """
+    drain_controller.add_idle_check(lambda: generation_scheduler.queued() == 0 and generation_scheduler.running() == 0)
+    drain_controller.add_handoff(warm_pool.close)
+    drain_controller.add_handoff(generation_scheduler.close)
+    drain_controller.add_handoff(generation_journal.close)
+    drain_controller.install_signal_handler()
+
+@app.on_event("shutdown")
+async def close_generation_journal():
+    generation_journal.close()
 
 @app.get("/")
 async def root():
@@ -38,6 +222,16 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "服务运行正常"}
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪探针：收到SIGTERM后立即返回503，负载均衡据此停止转发新请求"""
+    if drain_controller.draining:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "draining", "message": "服务正在下线", "in_flight": drain_controller.in_flight()}
+        )
+    return {"status": "ready", "message": "服务可以接收请求"}
+
 if __name__ == "__main__":
     host = os.getenv("HOST", "127.0.0.1")
     port = int(os.getenv("PORT", 8000))
@@ -1,10 +1,12 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 from sqlalchemy.exc import OperationalError
 from sqlalchemy import text as sa_text
 import pathlib
+from app.services.deadline import check
+from app.services.metrics import metrics
 
 # 加载环境变量（确保无论导入顺序如何，都能读取到 .env）
 load_dotenv()
@@ -57,6 +59,23 @@ def _create_engine_with_fallback(url: str):
 engine = _create_engine_with_fallback(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+@event.listens_for(engine, "before_cursor_execute")
+def _check_deadline(conn, cursor, statement, parameters, context, executemany):
+    """请求截止时间已到时不再执行SQL（抛出DeadlineExceeded）"""
+    check("db")
+
+def _pool_stats():
+    """连接池状态（QueuePool提供size/checkedout/overflow，其他池类型只报告支持的项）"""
+    pool = engine.pool
+    samples = []
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        func = getattr(pool, name, None)
+        if callable(func):
+            samples.append(((name,), func()))
+    return samples
+
+metrics.gauge("db_pool_connections", "数据库连接池状态", ("state",), callback=_pool_stats)
+
 Base = declarative_base()
 
 # 创建所有表的函数
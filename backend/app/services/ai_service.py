@@ -2,31 +2,34 @@ import os
 import json
 import base64
 import requests
-import re
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from app.models.schemas import AIAnalysis, ClarificationQuestion, MusicPrompt, UserInput, InputType
+from app.services.metrics import DASHSCOPE_REQUEST_SECONDS, LLM_JSON_PARSE_SECONDS, AI_FALLBACK
+from app.services.credential_pool import dashscope_credentials
+from app.services.concurrency_limiter import dashscope_limiter
+from app.services.deadline import budget, check
+from app.services.model_router import model_router, throttle_seconds, overloaded, REQUEST_TIMEOUT
+from app.services.tracing import tracer, SPAN_KIND_CLIENT
+from app.utils.json_extractor import extract_json, JSONStreamExtractor
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class QwenOmniService:
     def __init__(self):
-        # 使用标准的DashScope环境变量名称
-        self.api_key = os.getenv("DASHSCOPE_API_KEY")
-        if not self.api_key:
+        # 使用标准的DashScope环境变量名称；多个账号用DASHSCOPE_API_KEYS配置为凭据池，每次调用时选择
+        if dashscope_credentials is None:
             raise RuntimeError("DASHSCOPE_API_KEY is not set. Please configure it in your environment.")
-        # 使用多模态API endpoint，支持qwen-vl-max模型
-        self.api_url = os.getenv(
-            "DASHSCOPE_API_URL",
-            "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation",
-        )
-        # 模型名称可配置
-        self.model_name = os.getenv("DASHSCOPE_MODEL", "qwen-vl-max")
+        # 模型和接口地址由model_router按请求类型选择（DASHSCOPE_MODEL / DASHSCOPE_TEXT_MODEL等）
         self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "X-DashScope-SSE": "disable"
         }
+        # 可选：把模型原始回复追加记录到JSONL文件，作为JSON提取器的基准语料
+        self.record_file = os.getenv("LLM_RESPONSE_RECORD_FILE") or None
+        self._record_lock = threading.Lock()
         print("初始化QwenOmniService")  # 调试信息
     
     def encode_image_to_base64(self, image_path: str) -> str:
@@ -38,31 +41,22 @@ class QwenOmniService:
         """将图片字节流编码为base64"""
         return base64.b64encode(image_bytes).decode('utf-8')
     
-    def _clean_json_response(self, content: str) -> str:
-        """清理AI响应中的markdown格式和多余文本"""
-        # 移除markdown代码块标记
-        content = re.sub(r'```json\s*', '', content)
-        content = re.sub(r'```\s*$', '', content)
-        content = re.sub(r'```', '', content)
-        
-        # 移除开头和结尾的空白
-        content = content.strip()
-        
-        # 尝试找到JSON部分
-        # 寻找第一个 { 和最后一个 }
-        start_idx = content.find('{')
-        end_idx = content.rfind('}')
-        
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            content = content[start_idx:end_idx + 1]
-        
-        return content
-    
-    def analyze_input(self, user_input: UserInput, image_path: Optional[str] = None, image_bytes: Optional[bytes] = None) -> AIAnalysis:
-        """分析用户输入并返回音乐理解"""
+    def _record_response(self, stage: str, content: str, model: str) -> None:
+        """记录模型原始回复（未配置LLM_RESPONSE_RECORD_FILE时不做任何事）"""
+        if not self.record_file:
+            return
+        line = json.dumps({"stage": stage, "model": model, "content": content}, ensure_ascii=False)
         try:
-            # 构建提示词
-            system_prompt = """你是一个专业的音乐生成助手。你的任务是理解用户的输入（文字描述或图片），并分析出音乐生成所需的元素。
+            with self._record_lock, open(self.record_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ 记录模型回复失败: {e}")
+
+    def _build_analysis_payload(self, user_input: UserInput, image_path: Optional[str] = None,
+                                image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+        """构建输入分析请求体（普通模式和流式模式共用）"""
+        # 构建提示词
+        system_prompt = """你是一个专业的音乐生成助手。你的任务是理解用户的输入（文字描述或图片），并分析出音乐生成所需的元素。
 
 请严格按照以下JSON格式用中文回复，所有内容都必须是中文：
 
@@ -93,52 +87,69 @@ class QwenOmniService:
 4. 直接返回纯JSON，不要任何解释性文字
 """
 
-            # 构建消息内容
-            messages = []
-            
-            if user_input.input_type == InputType.TEXT:
-                user_message = f"请分析这段文字描述并提取音乐元素：{user_input.text_content}"
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-            
-            elif user_input.input_type == InputType.IMAGE:
-                # 优先使用内存中的图片字节流
-                if image_bytes is not None:
-                    image_base64 = self.encode_image_bytes_to_base64(image_bytes)
-                elif image_path:
-                    image_base64 = self.encode_image_to_base64(image_path)
-                else:
-                    raise Exception("未提供图片数据")
-                
-                # qwen-vl-max的图片消息格式
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {
-                        "role": "user", 
-                        "content": [
-                            {"type": "text", "text": "请分析这张图片并提取音乐元素："},
-                            {"type": "image", "image": f"data:image/jpeg;base64,{image_base64}"}
-                        ]
-                    }
-                ]
+        # 构建消息内容
+        messages = []
+        
+        if user_input.input_type == InputType.TEXT:
+            user_message = f"请分析这段文字描述并提取音乐元素：{user_input.text_content}"
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ]
+        
+        elif user_input.input_type == InputType.IMAGE:
+            # 优先使用内存中的图片字节流
+            if image_bytes is not None:
+                image_base64 = self.encode_image_bytes_to_base64(image_bytes)
+            elif image_path:
+                image_base64 = self.encode_image_to_base64(image_path)
+            else:
+                raise Exception("未提供图片数据")
             
-            # 调用API - 使用DashScope格式和qwen-vl-max模型
-            payload = {
-                "model": self.model_name,
-                "input": {
-                    "messages": messages
-                },
-                "parameters": {
-                    "temperature": 0.7,
-                    "max_tokens": 1500,
-                    "result_format": "message"
+            # qwen-vl-max的图片消息格式
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {
+                    "role": "user", 
+                    "content": [
+                        {"type": "text", "text": "请分析这张图片并提取音乐元素："},
+                        {"type": "image", "image": f"data:image/jpeg;base64,{image_base64}"}
+                    ]
                 }
+            ]
+        
+        # 调用API - 使用DashScope格式，纯文本走文本模型，图片走VL模型
+        payload = {
+            "model": model_router.route_for(user_input.input_type).model,
+            "input": {
+                "messages": messages
+            },
+            "parameters": {
+                "temperature": 0.7,
+                "max_tokens": 1500,
+                "result_format": "message"
             }
+        }
+        return payload
+
+    @tracer.traced("ai.analyze_input")
+    def analyze_input(self, user_input: UserInput, image_path: Optional[str] = None, image_bytes: Optional[bytes] = None,
+                      allow_fallback: bool = True) -> AIAnalysis:
+        """分析用户输入并返回音乐理解；allow_fallback为False时API失败直接抛出异常（批量任务据此重试）"""
+        try:
+            route = model_router.route_for(user_input.input_type)
+            payload = self._build_analysis_payload(user_input, image_path, image_bytes)
             
-            print(f"发送API请求到qwen-vl-max: {payload}")  # 调试信息
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
+            print(f"发送API请求到{route.model}: {payload}")  # 调试信息
+            with DASHSCOPE_REQUEST_SECONDS.time(
+                model=route.model, input_type=user_input.input_type.value, outcome="exception"
+            ) as labels, tracer.span(
+                "POST dashscope", SPAN_KIND_CLIENT,
+                **{"llm.model": route.model, "llm.route": route.name, "input_type": labels["input_type"]}
+            ) as span:
+                response = model_router.post(route, payload, self.headers)
+                labels["outcome"] = "ok" if response.status_code == 200 else f"http_{response.status_code}"
+                span.set_attribute("http.status_code", response.status_code)
             print(f"API响应状态码: {response.status_code}")  # 调试信息
             
             if response.status_code == 200:
@@ -181,17 +192,19 @@ class QwenOmniService:
                         raise Exception(f"API调用失败: {result}")
                 
                 # 解析JSON响应
+                self._record_response("analysis", content, route.model)
+                parse_start = time.perf_counter()
                 try:
                     print(f"🔍 尝试解析JSON: {content[:200]}...")
                     
-                    # 清理AI响应中的markdown格式
-                    cleaned_content = self._clean_json_response(content)
-                    print(f"🧹 清理后的内容: {cleaned_content[:200]}...")
-                    
-                    analysis_data = json.loads(cleaned_content)
+                    # 提取并修复JSON（markdown包裹、多余逗号、全角引号、输出被截断等）
+                    with tracer.span("llm.parse_json", stage="analysis"):
+                        analysis_data = extract_json(content)
+                    LLM_JSON_PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage="analysis", outcome="ok")
                     print(f"✅ JSON解析成功: {analysis_data}")
                     return self._parse_analysis_response(analysis_data, user_input)
                 except json.JSONDecodeError as e:
+                    LLM_JSON_PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage="analysis", outcome="error")
                     print(f"❌ JSON解析失败: {e}")
                     print(f"原始内容: {content[:300]}...")
                     # 如果AI没有返回JSON格式，创建一个基于内容的分析
@@ -202,16 +215,139 @@ class QwenOmniService:
                 
         except Exception as e:
             print(f"AI分析错误: {str(e)}")
+            if not allow_fallback:
+                raise
             return self._create_fallback_analysis(user_input)
     
-    def _parse_analysis_response(self, data: Dict[str, Any], user_input: UserInput) -> AIAnalysis:
-        """解析标准JSON响应并生成针对性问题"""
+    @staticmethod
+    def _iter_sse_text(response: requests.Response) -> Iterator[str]:
+        """逐条读取DashScope的SSE事件，产出增量文本（需请求参数incremental_output=true）"""
+        event = ""
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = ""
+                continue
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            data = json.loads(line[5:])
+            if event == "error" or "output" not in data:
+                raise Exception(f"API错误: {data.get('message', data)}")
+            output = data["output"]
+            if "choices" in output:
+                if not output["choices"]:
+                    continue
+                content = output["choices"][0]["message"]["content"]
+                if isinstance(content, list):
+                    text = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+                else:
+                    text = content or ""
+            else:
+                text = output.get("text") or ""
+            if text:
+                yield text
+
+    def stream_analysis(self, user_input: UserInput, image_bytes: Optional[bytes] = None) -> Iterator[Tuple[str, Any]]:
+        """
+        以SSE流式模式分析用户输入，边接收边解析，依次产出：
+          ("understanding", 新增的理解文本)      —— 随生成逐段产出
+          ("music_elements", dict)              —— music_elements字段完整后立即产出
+          ("clarification_questions", list)     —— 紧随音乐元素，由本地规则生成
+          ("analysis", AIAnalysis)              —— 最终结果，失败时与analyze_input一样退回本地分析
+        """
+        extractor = JSONStreamExtractor()
+        parts: List[str] = []
+        sent_understanding = ""
+        music_elements = None
+        questions = None
+        route = model_router.route_for(user_input.input_type)
+        start = time.perf_counter()
+        outcome = "exception"
+        try:
+            payload = self._build_analysis_payload(user_input, image_bytes=image_bytes)
+            payload["parameters"]["incremental_output"] = True
+            # 流式调用只做路由，不对冲（首个增量已经很快返回）；并发名额和凭据都占用到流读取结束
+            with dashscope_limiter.acquire() as slot, dashscope_credentials.lease() as credential:
+                with tracer.span(
+                    "POST dashscope (sse)", SPAN_KIND_CLIENT, **{"llm.model": route.model, "llm.route": route.name}
+                ) as span:
+                    headers = {**self.headers, "Authorization": f"Bearer {credential.secret}", "X-DashScope-SSE": "enable"}
+                    response = requests.post(
+                        route.api_url, headers=headers, json=payload, stream=True,
+                        timeout=budget("dashscope_stream", REQUEST_TIMEOUT)
+                    )
+                    span.set_attribute("http.status_code", response.status_code)
+                with response:
+                    if response.status_code != 200:
+                        if overloaded(response):
+                            slot.dropped()
+                        quarantine = throttle_seconds(response)
+                        if quarantine is not None:
+                            credential.throttled(quarantine)
+                        outcome = f"http_{response.status_code}"
+                        raise Exception(f"HTTP请求失败: {response.status_code}")
+                    for delta in self._iter_sse_text(response):
+                        # 截止时间已到时停止读取，退回本地分析
+                        check("dashscope_stream")
+                        parts.append(delta)
+                        if music_elements is not None:
+                            continue
+                        extractor.feed(delta)
+                        partial = extractor.snapshot()
+                        if not isinstance(partial, dict):
+                            continue
+                        understanding = partial.get("understanding")
+                        if (isinstance(understanding, str) and len(understanding) > len(sent_understanding)
+                                and understanding.startswith(sent_understanding)):
+                            yield "understanding", understanding[len(sent_understanding):]
+                            sent_understanding = understanding
+                        # 字典保持键的出现顺序：后面已经出现了别的键，说明music_elements已经完整
+                        if "music_elements" in partial and (next(reversed(partial)) != "music_elements" or extractor.done):
+                            music_elements = partial["music_elements"]
+                            if not isinstance(music_elements, dict):
+                                music_elements = {}
+                            questions = self._generate_targeted_questions(user_input, music_elements)
+                            yield "music_elements", music_elements
+                            yield "clarification_questions", questions
+                    outcome = "ok"
+        except Exception as e:
+            print(f"AI流式分析错误: {str(e)}")
+            yield "analysis", self._create_fallback_analysis(user_input)
+            return
+        finally:
+            DASHSCOPE_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, model=route.model,
+                input_type=f"{user_input.input_type.value}_stream", outcome=outcome
+            )
+
+        content = "".join(parts)
+        self._record_response("analysis", content, route.model)
+        parse_start = time.perf_counter()
+        try:
+            analysis_data = extract_json(content)
+        except json.JSONDecodeError as e:
+            LLM_JSON_PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage="analysis", outcome="error")
+            print(f"❌ 流式JSON解析失败: {e}")
+            yield "analysis", self._create_analysis_from_text(content, user_input)
+            return
+        LLM_JSON_PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage="analysis", outcome="ok")
+        if music_elements is not None:
+            analysis_data["music_elements"] = music_elements
+        yield "analysis", self._parse_analysis_response(analysis_data, user_input, questions)
+
+    @tracer.traced("ai.normalize_analysis")
+    def _parse_analysis_response(self, data: Dict[str, Any], user_input: UserInput,
+                                 clarification_questions: Optional[List[ClarificationQuestion]] = None) -> AIAnalysis:
+        """解析标准JSON响应并生成针对性问题（流式模式下传入已推送给用户的问题）"""
         # 获取AI分析的音乐元素
         music_elements = data.get("music_elements", {})
         understanding = data.get("understanding", "")
         
         # 无论AI是否返回澄清问题，我们都生成自己的2-4个针对性问题
-        clarification_questions = self._generate_targeted_questions(user_input, music_elements)
+        if clarification_questions is None:
+            clarification_questions = self._generate_targeted_questions(user_input, music_elements)
         
         print(f"🎯 为标准JSON响应生成了 {len(clarification_questions)} 个针对性问题")
         
@@ -246,6 +382,8 @@ class QwenOmniService:
     def _create_analysis_from_text(self, content: str, user_input: UserInput) -> AIAnalysis:
         """从AI的文本响应中创建分析(当AI没有返回JSON时)"""
         print(f"📝 基于AI文本内容创建分析: {content}")
+        AI_FALLBACK.inc(kind="analysis_from_text")
+        tracer.set_attribute("ai.fallback", "analysis_from_text")
         
         # 使用AI的文本内容作为理解
         understanding = content[:300] + "..." if len(content) > 300 else content
@@ -574,6 +712,8 @@ class QwenOmniService:
     def _create_fallback_analysis(self, user_input: UserInput) -> AIAnalysis:
         """创建备用分析结果（仅在API完全失败时使用）"""
         print(f"⚠️ API调用完全失败，使用备用分析")
+        AI_FALLBACK.inc(kind="analysis")
+        tracer.set_attribute("ai.fallback", "analysis")
         return self._create_smart_analysis(user_input, "API服务暂时不可用，使用本地分析")
     
     def _analyze_clarification_for_interface(self, session_data: Dict[str, Any]) -> str:
@@ -616,6 +756,7 @@ class QwenOmniService:
         
         return interface_preference or 'gen_song'
     
+    @tracer.traced("ai.generate_final_prompt_with_user_params")
     def generate_final_prompt_with_user_params(self, session_data: Dict[str, Any], user_params: Dict[str, Any]) -> MusicPrompt:
         """根据用户直接提供的参数生成音乐提示词（优先级更高）"""
         try:
@@ -680,6 +821,7 @@ class QwenOmniService:
             # 失败时回退到原有逻辑
             return self.generate_final_prompt(session_data)
     
+    @tracer.traced("ai.generate_final_prompt")
     def generate_final_prompt(self, session_data: Dict[str, Any]) -> MusicPrompt:
         """根据澄清后的信息生成最终音乐提示词"""
         try:
@@ -772,8 +914,9 @@ class QwenOmniService:
                 {"role": "user", "content": prompt}
             ]
             
+            route = model_router.route("text")
             payload = {
-                "model": self.model_name,
+                "model": route.model,
                 "input": {
                     "messages": messages
                 },
@@ -785,7 +928,14 @@ class QwenOmniService:
             }
             
             print(f"生成最终提示词API请求: {payload}")  # 调试信息
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
+            with DASHSCOPE_REQUEST_SECONDS.time(
+                model=route.model, input_type="prompt", outcome="exception"
+            ) as labels, tracer.span(
+                "POST dashscope", SPAN_KIND_CLIENT, **{"llm.model": route.model, "llm.route": route.name, "input_type": "prompt"}
+            ) as span:
+                response = model_router.post(route, payload, self.headers)
+                labels["outcome"] = "ok" if response.status_code == 200 else f"http_{response.status_code}"
+                span.set_attribute("http.status_code", response.status_code)
             print(f"生成提示词API响应状态码: {response.status_code}")  # 调试信息
             
             if response.status_code == 200:
@@ -824,12 +974,13 @@ class QwenOmniService:
                     print(f"生成提示词API返回错误: {result}")
                     return self._create_fallback_prompt()
                 
+                self._record_response("prompt", content, route.model)
+                parse_start = time.perf_counter()
                 try:
-                    # 清理生成提示词的响应格式
-                    cleaned_content = self._clean_json_response(content)
-                    print(f"🧹 清理后的提示词内容: {cleaned_content[:200]}...")
-                    
-                    prompt_data = json.loads(cleaned_content)
+                    # 提取并修复提示词JSON
+                    with tracer.span("llm.parse_json", stage="prompt"):
+                        prompt_data = extract_json(content)
+                    LLM_JSON_PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage="prompt", outcome="ok")
                     
                     # 根据接口类型返回不同的MusicPrompt结构
                     interface_type = prompt_data.get("interface", "gen_bgm")
@@ -868,6 +1019,7 @@ class QwenOmniService:
                         return self._create_fallback_prompt()
                         
                 except json.JSONDecodeError as e:
+                    LLM_JSON_PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage="prompt", outcome="error")
                     print(f"❌ 生成提示词JSON解析失败: {e}")
                     print(f"原始内容: {content[:300]}...")
                     return self._create_fallback_prompt()
@@ -880,6 +1032,8 @@ class QwenOmniService:
     
     def _create_fallback_prompt(self) -> MusicPrompt:
         """创建备用音乐提示词"""
+        AI_FALLBACK.inc(kind="prompt")
+        tracer.set_attribute("ai.fallback", "prompt")
         return MusicPrompt(
             interface="gen_bgm",
             mood=["happy", "peaceful"],
@@ -0,0 +1,216 @@
+import hashlib
+import mimetypes
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+import requests
+from dotenv import load_dotenv
+from app.services.metrics import metrics, AUDIO_FETCH
+from app.services.state_store import StateStore, state_store
+
+load_dotenv()
+
+class AudioCache:
+    """
+    生成曲目的本地磁盘缓存
+    - register()为上游音频链接分配稳定的track_id，并在后台线程下载
+    - 文件按内容sha256寻址保存（blobs/ab/abcd...），相同内容只存一份，ETag即内容哈希
+    - 每次读取刷新文件mtime，总大小超过max_bytes时按mtime从旧到新淘汰（LRU）
+    track_id到文件的映射保存在共享状态存储中，多个worker共用同一缓存目录
+    """
+
+    def __init__(self, store: StateStore, directory: str, max_bytes: int, track_ttl: float,
+                 fetch_workers: int, fetch_timeout: float):
+        self.store = store
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.track_ttl = track_ttl
+        self.fetch_timeout = fetch_timeout
+        self._executor = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="audio-fetch")
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+        self._fetching: set = set()
+        self._listeners: List[Callable[[str, str, str], None]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def track_id(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "blobs", digest[:2], digest)
+
+    def add_listener(self, func: Callable[[str, str, str], None]) -> None:
+        """曲目缓存完成后的处理步骤，func(sha256, 文件路径, content_type)在下载线程中调用"""
+        self._listeners.append(func)
+
+    def sidecar_path(self, digest: str, suffix: str) -> str:
+        """曲目附属数据（如波形）的路径，与曲目放在同一目录，一起计入容量并参与LRU淘汰"""
+        return self._blob_path(digest) + suffix
+
+    def write_sidecar(self, digest: str, suffix: str, data: bytes) -> str:
+        path = self.sidecar_path(digest, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._grow(len(data))
+        return path
+
+    def get_track(self, track_id: str) -> Optional[Dict[str, Any]]:
+        """{"url", "sha256", "size", "content_type"}；sha256为None表示尚未缓存"""
+        return self.store.get(f"audio:track:{track_id}")
+
+    def set_lyrics(self, url: str, timeline: Dict[str, Any]) -> str:
+        """保存曲目的歌词时间轴（紧凑格式），与曲目记录同样保留track_ttl；缓存关闭时也可使用"""
+        track_id = self.track_id(url)
+        self.store.set(f"audio:lyrics:{track_id}", timeline, ttl=self.track_ttl)
+        return track_id
+
+    def get_lyrics(self, track_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(f"audio:lyrics:{track_id}")
+
+    def register(self, url: str) -> Optional[str]:
+        """登记一个上游音频链接并在后台缓存，返回track_id（缓存关闭时返回None）"""
+        if not self.enabled or not url:
+            return None
+        track_id = self.track_id(url)
+        track = self.store.update(
+            f"audio:track:{track_id}",
+            lambda track: track or {"url": url, "sha256": None, "size": None, "content_type": None},
+            ttl=self.track_ttl,
+        )
+        if not track.get("sha256") or not os.path.exists(self._blob_path(track["sha256"])):
+            self._schedule(track_id, url)
+        return track_id
+
+    def _schedule(self, track_id: str, url: str) -> None:
+        with self._lock:
+            if track_id in self._fetching:
+                return
+            self._fetching.add(track_id)
+        self._executor.submit(self._fetch, track_id, url)
+
+    def _fetch(self, track_id: str, url: str) -> None:
+        """下载到临时文件，边写边计算哈希，完成后原子地移入内容寻址路径"""
+        tmp_dir = os.path.join(self.directory, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with requests.get(url, stream=True, timeout=self.fetch_timeout) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=256 * 1024):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            if not content_type or content_type == "application/octet-stream":
+                content_type = mimetypes.guess_type(url.split("?")[0])[0] or "audio/mpeg"
+            sha = digest.hexdigest()
+            path = self._blob_path(sha)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                os.utime(path)
+            else:
+                os.replace(tmp_path, path)
+                self._grow(size)
+            self.store.set(
+                f"audio:track:{track_id}",
+                {"url": url, "sha256": sha, "size": size, "content_type": content_type},
+                ttl=self.track_ttl,
+            )
+            AUDIO_FETCH.inc(status="success")
+            for listener in self._listeners:
+                try:
+                    listener(sha, path, content_type)
+                except Exception as e:
+                    print(f"曲目缓存后处理失败 {listener.__qualname__}: {e}")
+        except Exception as e:
+            print(f"缓存音频失败 {url}: {e}")
+            AUDIO_FETCH.inc(status="failed")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        finally:
+            with self._lock:
+                self._fetching.discard(track_id)
+
+    def open_blob(self, track: Dict[str, Any]) -> Optional[str]:
+        """返回已缓存曲目的文件路径并刷新其LRU时间；文件已被淘汰时重新下载并返回None"""
+        digest = track.get("sha256")
+        if not digest:
+            return None
+        path = self._blob_path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._schedule(self.track_id(track["url"]), track["url"])
+            return None
+        return path
+
+    def _scan(self):
+        blobs_dir = os.path.join(self.directory, "blobs")
+        if not os.path.isdir(blobs_dir):
+            return
+        for shard in os.scandir(blobs_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file():
+                        yield entry
+
+    def _grow(self, size: int) -> None:
+        with self._lock:
+            if self._total is None:
+                # 首次写入时统计一次目录大小，之后增量维护（其他worker写入的部分在淘汰时重新统计）
+                self._total = sum(entry.stat().st_size for entry in self._scan())
+            else:
+                self._total += size
+            if self._total <= self.max_bytes:
+                return
+            self._evict()
+
+    def _evict(self) -> None:
+        """按mtime从旧到新删除文件，直到总大小降到max_bytes的90%（调用方需持有锁）"""
+        entries = sorted((st.st_mtime, st.st_size, e.path) for e in self._scan() for st in (e.stat(),))
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total = total
+
+    def size(self) -> int:
+        with self._lock:
+            if self._total is None:
+                self._total = sum(entry.stat().st_size for entry in self._scan())
+            return self._total
+
+# 全局音频缓存实例；AUDIO_CACHE_MAX_BYTES为0（默认）时关闭，直接使用上游链接
+# 缓存目录按启动时的工作目录解析为绝对路径，生产环境应配置AUDIO_CACHE_DIR
+audio_cache = AudioCache(
+    state_store,
+    directory=os.path.abspath(os.getenv("AUDIO_CACHE_DIR", "audio_cache")),
+    max_bytes=int(os.getenv("AUDIO_CACHE_MAX_BYTES", 0)),
+    track_ttl=float(os.getenv("AUDIO_TRACK_TTL", 30 * 86400)),
+    fetch_workers=int(os.getenv("AUDIO_FETCH_WORKERS", 2)),
+    fetch_timeout=float(os.getenv("AUDIO_FETCH_TIMEOUT", 60)),
+)
+
+metrics.gauge(
+    "audio_cache_bytes", "本地音频缓存占用的字节数",
+    callback=lambda: [((), audio_cache.size())] if audio_cache.enabled else [],
+)
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from app.services.deadline import remaining
+from app.services.rate_limiter import rate_limiter
+from app.services.state_store import StateStore, state_store
+
+load_dotenv()
+
+class BatchItem:
+    """批量请求中的一条输入"""
+    __slots__ = ("index", "client_id", "input_type", "text", "image_bytes", "filename", "key")
+
+    def __init__(self, index: int, client_id: Optional[str], input_type: str,
+                 text: Optional[str] = None, image_bytes: Optional[bytes] = None, filename: Optional[str] = None):
+        self.index = index
+        self.client_id = client_id
+        self.input_type = input_type
+        self.text = text
+        self.image_bytes = image_bytes
+        self.filename = filename
+        # 按内容去重：同一批次内相同的输入只分析一次，重试时已成功的输入直接复用结果
+        digest = hashlib.sha256(input_type.encode("utf-8") + b"\0")
+        digest.update(image_bytes if image_bytes is not None else (text or "").encode("utf-8"))
+        self.key = digest.hexdigest()[:32]
+
+class BatchRunner:
+    """
+    批量分析执行器
+    - 相同内容的输入只处理一次，结果复制给所有重复项
+    - 同一时间最多parallelism个输入在处理，每个输入还要占用一个DashScope全局并发名额
+    - 每个输入的结果单独写入状态存储；带着同一个batch_id重新提交时，已成功的输入直接返回保存的结果
+    """
+
+    def __init__(self, store: StateStore, parallelism: int, ttl: float, upstream_wait: float):
+        self.store = store
+        self.parallelism = parallelism
+        self.ttl = ttl
+        self.upstream_wait = upstream_wait
+
+    @staticmethod
+    def new_batch_id() -> str:
+        return uuid.uuid4().hex
+
+    def _meta_key(self, batch_id: str) -> str:
+        return f"batch:{batch_id}"
+
+    def _item_key(self, batch_id: str, key: str) -> str:
+        return f"batch:{batch_id}:item:{key}"
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """批次概况：总数、成功/失败数和最后更新时间"""
+        return self.store.get(self._meta_key(batch_id))
+
+    def _record(self, batch_id: str, key: str, result: Dict[str, Any]) -> None:
+        if result["status"] == "done":
+            self.store.set(self._item_key(batch_id, key), result, ttl=self.ttl)
+
+        def bump(meta):
+            meta = meta or {"succeeded": [], "failed": []}
+            succeeded, failed = set(meta["succeeded"]), set(meta["failed"])
+            if result["status"] == "done":
+                succeeded.add(key)
+                failed.discard(key)
+            else:
+                failed.add(key)
+            meta.update(succeeded=sorted(succeeded), failed=sorted(failed), updated_at=time.time())
+            return meta
+
+        self.store.update(self._meta_key(batch_id), bump, ttl=self.ttl)
+
+    def _process(self, batch_id: str, process: Callable[[BatchItem], Dict[str, Any]], item: BatchItem) -> Dict[str, Any]:
+        """在工作线程中等待DashScope并发名额、处理单个输入并保存结果"""
+        try:
+            left = remaining()
+            deadline = time.monotonic() + (self.upstream_wait if left is None else min(self.upstream_wait, left))
+            lease_id = rate_limiter.acquire_upstream("dashscope")
+            while lease_id is None:
+                if time.monotonic() >= deadline:
+                    raise RuntimeError("上游服务繁忙，请稍后重试该批次")
+                time.sleep(0.2)
+                lease_id = rate_limiter.acquire_upstream("dashscope")
+            try:
+                result = {"status": "done", **process(item)}
+            finally:
+                rate_limiter.release_upstream("dashscope", lease_id)
+        except Exception as e:
+            result = {"status": "failed", "error": str(e)}
+        self._record(batch_id, item.key, result)
+        return result
+
+    async def run(self, batch_id: str, items: List[BatchItem],
+                  process: Callable[[BatchItem], Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        处理一个批次，按完成顺序产出每个输入的结果，最后产出汇总
+        process在工作线程中执行，返回可JSON序列化的结果数据，抛出异常表示该输入失败
+        """
+        groups: Dict[str, List[BatchItem]] = {}
+        for item in items:
+            groups.setdefault(item.key, []).append(item)
+        self.store.update(
+            self._meta_key(batch_id),
+            lambda meta: {**(meta or {"succeeded": [], "failed": []}), "total": len(groups), "updated_at": time.time()},
+            ttl=self.ttl,
+        )
+
+        def lines(key: str, result: Dict[str, Any], cached: bool):
+            for n, item in enumerate(groups[key]):
+                line = {"type": "item", "index": item.index, "id": item.client_id, "cached": cached, **result}
+                if n > 0:
+                    line["duplicate_of"] = groups[key][0].index
+                yield line
+
+        counts = {"done": 0, "failed": 0, "cached": 0}
+        pending = []
+        for key in groups:
+            saved = self.store.get(self._item_key(batch_id, key))
+            if saved is not None:
+                counts["done"] += 1
+                counts["cached"] += 1
+                for line in lines(key, saved, cached=True):
+                    yield line
+            else:
+                pending.append(key)
+
+        semaphore = asyncio.Semaphore(self.parallelism)
+
+        async def handle(key: str):
+            async with semaphore:
+                return key, await asyncio.to_thread(self._process, batch_id, process, groups[key][0])
+
+        tasks = [asyncio.create_task(handle(key)) for key in pending]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                key, result = await finished
+                counts[result["status"]] += 1
+                for line in lines(key, result, cached=False):
+                    yield line
+        finally:
+            # 客户端断开时取消尚未开始的输入；已在线程中执行的会跑完并写入结果，重试时可复用
+            for task in tasks:
+                task.cancel()
+
+        yield {
+            "type": "summary",
+            "batch_id": batch_id,
+            "inputs": len(items),
+            "unique": len(groups),
+            "succeeded": counts["done"],
+            "failed": counts["failed"],
+            "resumed": counts["cached"],
+        }
+
+# 全局批量执行器实例
+batch_runner = BatchRunner(
+    state_store,
+    parallelism=int(os.getenv("BATCH_PARALLELISM", 4)),
+    ttl=float(os.getenv("BATCH_STATE_TTL", 86400)),
+    upstream_wait=float(os.getenv("BATCH_UPSTREAM_WAIT", 120)),
+)
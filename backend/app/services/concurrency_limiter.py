@@ -0,0 +1,210 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+from dotenv import load_dotenv
+from app.services.deadline import remaining
+from app.services.metrics import metrics, ADAPTIVE_LIMIT_SHED
+from app.services.rate_limiter import rate_limiter
+
+load_dotenv()
+
+class UpstreamOverloaded(Exception):
+    """自适应并发上限已满且排队已满或等待超时，调用方应直接降级（本地兜底或返回繁忙）"""
+
+    def __init__(self, name: str, reason: str):
+        super().__init__(f"{name} 上游繁忙（{reason}），请稍后重试")
+        self.name = name
+        self.reason = reason
+
+class LimiterSlot:
+    """一次并发名额占用；上游返回限流/5xx等过载信号时调用dropped()"""
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.ok = True
+        self.started = time.monotonic()
+
+    def dropped(self) -> None:
+        self.ok = False
+
+class AdaptiveLimiter:
+    """
+    按观测到的延迟和失败自动调整的进程内并发上限（gradient + AIMD）
+    - 维护两条耗时：short是最近请求的均值，long是无负载时的基线（跟随更低的耗时，约long_window个样本才跟上更高的耗时）
+    - 每次成功返回：gradient = clamp(tolerance * long / short, 0.5, 1)，
+      新上限 = 上限 * gradient + sqrt(上限)（留出少量排队余量），再按smoothing平滑；
+      上游变慢时short升高、上限收缩，恢复后上限逐步增长
+    - 每次过载信号（异常、限流、5xx）：上限乘以backoff（乘性减小，每个short耗时内最多一次）
+    - 近期失败率超过max_error_rate时不增长；进行中请求不到上限一半时也不增长（流量本身不足，延迟不能说明上游还能承受更多）
+    - 超出上限的调用最多排队max_queue个、每个最多等待queue_timeout秒（且不超过请求剩余时间），否则抛出UpstreamOverloaded
+    耗时样本除以调用方给出的weight（如生成时长对应的代价），不同规格的请求可以放在一起比较
+    上限只在本进程内生效；rate_limiter的跨worker静态上限仍作为硬上限在准入时检查
+    """
+
+    def __init__(self, name: str, initial: float, min_limit: int, max_limit: int, tolerance: float,
+                 smoothing: float, backoff: float, max_error_rate: float, max_queue: int, queue_timeout: float,
+                 long_window: int):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._long_alpha = 1.0 / long_window
+        self._short_alpha = 0.3
+        self.max_error_rate = max_error_rate
+        self.short_rtt = 0.0
+        self.long_rtt = 0.0
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.dropped = 0
+        self.shed = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _admit(self) -> None:
+        """等待名额（调用方需持有锁）"""
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        if self.queued >= self.max_queue:
+            self._shed("queue_full")
+        # 排队时间不超过请求剩余时间
+        left = remaining()
+        deadline = time.monotonic() + (self.queue_timeout if left is None else min(self.queue_timeout, left))
+        self.queued += 1
+        try:
+            while self.in_flight >= int(self.limit):
+                wait_left = deadline - time.monotonic()
+                if wait_left <= 0:
+                    self._shed("timeout")
+                self._cond.wait(wait_left)
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+
+    def _shed(self, reason: str) -> None:
+        self.shed += 1
+        ADAPTIVE_LIMIT_SHED.inc(upstream=self.name, reason=reason)
+        raise UpstreamOverloaded(self.name, "排队已满" if reason == "queue_full" else "排队超时")
+
+    @contextmanager
+    def acquire(self, weight: float = 1.0) -> Iterator[LimiterSlot]:
+        """占用一个并发名额直到with结束；with内抛出异常视为过载信号"""
+        with self._cond:
+            self._admit()
+        slot = LimiterSlot(max(weight, 1e-6))
+        try:
+            yield slot
+        except Exception:
+            slot.dropped()
+            raise
+        finally:
+            self.release(slot)
+
+    def try_acquire(self, weight: float = 1.0) -> Optional[LimiterSlot]:
+        """不排队地占用一个名额（如对冲请求），没有空闲名额时返回None；用完后调用release(slot)"""
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+        return LimiterSlot(max(weight, 1e-6))
+
+    def release(self, slot: LimiterSlot, observe: bool = True) -> None:
+        """归还名额；observe为False时（如调用未真正发出）不计入耗时样本"""
+        with self._cond:
+            self.in_flight -= 1
+            if observe:
+                self._observe(time.monotonic() - slot.started, slot.weight, slot.ok)
+            self._cond.notify_all()
+
+    def _observe(self, elapsed: float, weight: float, ok: bool) -> None:
+        """根据一个样本调整上限（调用方需持有锁）"""
+        self.completed += 1
+        rtt = elapsed / weight
+        self.error_rate += self._short_alpha * ((not ok) - self.error_rate)
+        if not ok:
+            self.dropped += 1
+            # 同一波过载会连续失败多个请求，每个（同规格请求的）short耗时内只减小一次
+            now = time.monotonic()
+            if now - self._last_decrease >= self.short_rtt * weight:
+                self._last_decrease = now
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+            return
+
+        if not self.long_rtt:
+            self.short_rtt = self.long_rtt = rtt
+            return
+        self.short_rtt += self._short_alpha * (rtt - self.short_rtt)
+        # 基线跟踪无负载时的耗时：更快的样本立即拉低基线；持续过载时只缓慢上升，
+        # 否则基线会被过载时的耗时带高，上限永远不会收缩
+        if self.short_rtt < self.long_rtt:
+            self.long_rtt = self.short_rtt
+        else:
+            self.long_rtt += self._long_alpha * (self.short_rtt - self.long_rtt)
+        if self.in_flight + 1 < self.limit / 2 or self.error_rate > self.max_error_rate:
+            return
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = min(float(self.max_limit), max(float(self.min_limit), limit))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "short_rtt": round(self.short_rtt, 3),
+                "long_rtt": round(self.long_rtt, 3),
+                "error_rate": round(self.error_rate, 3),
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "shed": self.shed,
+            }
+
+def _limiter(name: str, initial: int, queue_timeout: float) -> AdaptiveLimiter:
+    """<上游名>_ADAPTIVE_*环境变量配置；上限默认不超过rate_limiter中的跨worker静态上限"""
+    prefix = f"{name.upper()}_ADAPTIVE"
+    max_limit = int(os.getenv(f"{prefix}_MAX") or rate_limiter.upstream_caps.get(name) or 64)
+    return AdaptiveLimiter(
+        name,
+        initial=float(os.getenv(f"{prefix}_INITIAL", initial)),
+        min_limit=int(os.getenv(f"{prefix}_MIN", 1)),
+        max_limit=max_limit,
+        tolerance=float(os.getenv(f"{prefix}_TOLERANCE", 1.5)),
+        smoothing=float(os.getenv(f"{prefix}_SMOOTHING", 0.2)),
+        backoff=float(os.getenv(f"{prefix}_BACKOFF", 0.9)),
+        max_error_rate=float(os.getenv(f"{prefix}_MAX_ERROR_RATE", 0.1)),
+        max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", max_limit)),
+        queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", queue_timeout)),
+        long_window=int(os.getenv(f"{prefix}_WINDOW", 500)),
+    )
+
+# 全局自适应并发上限：DashScope调用（分析、提示词生成）和Coze音乐生成（提交到对话完成）
+dashscope_limiter = _limiter("dashscope", initial=8, queue_timeout=5)
+coze_limiter = _limiter("coze", initial=8, queue_timeout=30)
+adaptive_limiters = (dashscope_limiter, coze_limiter)
+
+metrics.gauge(
+    "adaptive_concurrency_limit", "自适应并发上限的当前值", ("upstream",),
+    callback=lambda: [((limiter.name,), int(limiter.limit)) for limiter in adaptive_limiters],
+)
+metrics.gauge(
+    "adaptive_concurrency_in_flight", "占用自适应并发名额的进行中调用数", ("upstream",),
+    callback=lambda: [((limiter.name,), limiter.in_flight) for limiter in adaptive_limiters],
+)
+metrics.gauge(
+    "adaptive_concurrency_queue_depth", "等待自适应并发名额的调用数", ("upstream",),
+    callback=lambda: [((limiter.name,), limiter.queued) for limiter in adaptive_limiters],
+)
@@ -1,31 +1,96 @@
 import os
 import json
 import requests
+import random
 import time
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, List, Set, Tuple, Optional
 from app.models.schemas import MusicPrompt
+from app.services.concurrency_limiter import coze_limiter, LimiterSlot, UpstreamOverloaded
+from app.services.credential_pool import coze_credentials, CredentialLease, CredentialNotFound
+from app.services.deadline import budget, remaining, DeadlineExceeded, MIN_BUDGET
+from app.services.generation_scheduler import estimate_cost
+from app.services.generation_journal import generation_journal
+from app.services.metrics import COZE_GENERATION_SECONDS, COZE_POLL_ITERATIONS, COZE_PARSE_RESULT, DEADLINE_EXCEEDED
+from app.services.tracing import tracer, SPAN_KIND_CLIENT
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# 单次Coze接口调用的超时上限（秒），请求有截止时间时取两者中较小者
+REQUEST_TIMEOUT = float(os.getenv("COZE_REQUEST_TIMEOUT", 30))
+# 等待对话完成的最长时间（秒），请求有截止时间时取两者中较小者
+MAX_WAIT_TIME = float(os.getenv("COZE_MAX_WAIT_TIME", 300))
+
+# 对话进行中时增量查看消息列表，插件结果一出现就结束等待，不必等机器人写完收尾文本
+EARLY_RESULT = os.getenv("COZE_EARLY_RESULT", "true").lower() == "true"
+# 提前返回只信任插件结果消息：进行中的机器人回复可能只写了一半，其中的链接不可靠
+EARLY_RESULT_TYPES = ("tool_response", "tool_output")
+
+# Coze表示账号被限流或额度用尽的业务错误码（HTTP 200返回），命中时隔离该账号
+COZE_THROTTLE_CODES = {
+    int(code) for code in os.getenv("COZE_THROTTLE_CODES", "4013,4028").split(",") if code.strip()
+}
+
+# Coze音乐插件各接口参数的可选值（参数校验和多版本生成共用）
+BGM_MOOD_VALUES = [
+    'positive', 'uplifting', 'energetic', 'happy', 'bright', 'optimistic',
+    'hopeful', 'cool', 'dreamy', 'fun', 'light', 'powerful', 'calm',
+    'confident', 'joyful', 'dramatic', 'peaceful', 'playful', 'soft',
+    'groovy', 'reflective', 'easy', 'relaxed', 'lively', 'smooth',
+    'romantic', 'intense', 'elegant', 'mellow', 'emotional',
+    'sentimental', 'cheerful', 'contemplative'
+]
+BGM_INSTRUMENT_VALUES = [
+    'piano', 'drums', 'guitar', 'percussion', 'synth', 'electric guitar',
+    'acoustic guitar', 'bass guitar', 'brass', 'violin', 'cello', 'flute',
+    'organ', 'trumpet', 'ukulele', 'saxophone', 'double bass', 'harp',
+    'glockenspiel', 'synthesizer', 'keyboard', 'marimba', 'bass', 'banjo', 'strings'
+]
+BGM_GENRE_VALUES = [
+    'corporate', 'dance/edm', 'orchestral', 'chill out', 'rock', 'hip hop',
+    'folk', 'funk', 'ambient', 'holiday', 'jazz', 'kids', 'world', 'travel',
+    'commercial', 'advertising', 'driving', 'cinematic', 'upbeat', 'epic',
+    'inspiring', 'business', 'video game', 'dark', 'pop', 'trailer',
+    'modern', 'electronic', 'documentary', 'soundtrack', 'fashion',
+    'acoustic', 'movie', 'tv', 'high tech', 'industrial'
+]
+BGM_THEME_VALUES = [
+    'inspirational', 'motivational', 'achievement', 'discovery', 'every day',
+    'love', 'technology', 'lifestyle', 'journey', 'meditation', 'drama',
+    'children', 'hope', 'fantasy', 'holiday', 'health', 'family', 'real estate',
+    'media', 'kids', 'science', 'education', 'progress', 'world', 'vacation',
+    'training', 'christmas', 'sales'
+]
+SONG_MOOD_VALUES = [
+    'Happy', 'Dynamic/Energetic', 'Sentimental/Melancholic/Lonely',
+    'Inspirational/Hopeful', 'Nostalgic/Memory', 'Excited',
+    'Sorrow/Sad', 'Chill', 'Romantic'
+]
+SONG_GENRE_VALUES = ['Folk', 'Pop', 'Rock', 'Chinese Style', 'Hip Hop/Rap', 'R&B/Soul', 'Punk', 'Electronic', 'Jazz', 'Reggae', 'DJ']
+SONG_TIMBRE_VALUES = ['Warm', 'Bright', 'Husky', 'Electrified voice', 'Sweet_AUDIO_TIMBRE', 'Cute_AUDIO_TIMBRE', 'Loud and sonorous', 'Powerful', 'Sexy/Lazy']
+
+# 多版本生成时依次变化的参数（每个版本只改一项，保持与原始提示词接近）
+VARIANT_FIELDS = {
+    'gen_bgm': [('mood', BGM_MOOD_VALUES), ('genre', BGM_GENRE_VALUES), ('instrument', BGM_INSTRUMENT_VALUES)],
+    'gen_song': [('mood_single', SONG_MOOD_VALUES), ('genre_single', SONG_GENRE_VALUES), ('timbre', SONG_TIMBRE_VALUES)],
+    'lyrics_gen_song': [('mood_single', SONG_MOOD_VALUES), ('genre_single', SONG_GENRE_VALUES), ('timbre', SONG_TIMBRE_VALUES)],
+}
+
 class CozeMusicService:
     def __init__(self):
         # Coze API配置 - 使用更简单的对话接口
         base_url = os.getenv("COZE_API_BASE_URL", "https://api.coze.cn")
         # 组合出需要的各接口URL
         self.api_url = f"{base_url}/v3/chat"
-        self.token = os.getenv("COZE_TOKEN")
-        self.bot_id = os.getenv("COZE_BOT_ID")
-        if not self.token:
-            raise RuntimeError("COZE_TOKEN is not set. Please configure it in your environment.")
-        if not self.bot_id:
-            raise RuntimeError("COZE_BOT_ID is not set. Please configure it in your environment.")
+        # 账号凭据池：COZE_CREDENTIALS配置多个token:bot_id，或COZE_TOKEN搭配COZE_BOT_ID/COZE_BOT_IDS
+        if coze_credentials is None:
+            raise RuntimeError("COZE_TOKEN/COZE_BOT_ID is not set. Please configure it in your environment.")
         self.headers = {
-            "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json"
         }
         print("初始化CozeMusicService (使用对话接口)")
     
+    @tracer.traced("coze.normalize_parameters")
     def _validate_and_fix_parameters(self, music_prompt: MusicPrompt) -> MusicPrompt:
         """验证和修复参数，确保符合接口要求"""
         print(f"🔧 开始验证接口 {music_prompt.interface} 的参数...")
@@ -51,28 +116,13 @@ class CozeMusicService:
             'romantic': 'Romantic'
         }
         
-        song_mood_valid_values = [
-            'Happy', 'Dynamic/Energetic', 'Sentimental/Melancholic/Lonely',
-            'Inspirational/Hopeful', 'Nostalgic/Memory', 'Excited', 
-            'Sorrow/Sad', 'Chill', 'Romantic'
-        ]
-        
         # 处理gen_bgm接口参数验证
         if music_prompt.interface == 'gen_bgm':
             # 验证bgm的mood参数（数组格式）
-            bgm_mood_valid_values = [
-                'positive', 'uplifting', 'energetic', 'happy', 'bright', 'optimistic', 
-                'hopeful', 'cool', 'dreamy', 'fun', 'light', 'powerful', 'calm', 
-                'confident', 'joyful', 'dramatic', 'peaceful', 'playful', 'soft', 
-                'groovy', 'reflective', 'easy', 'relaxed', 'lively', 'smooth', 
-                'romantic', 'intense', 'elegant', 'mellow', 'emotional', 
-                'sentimental', 'cheerful', 'contemplative'
-            ]
-            
             if music_prompt.mood:
                 fixed_mood = []
                 for mood_item in music_prompt.mood:
-                    if mood_item.lower() in bgm_mood_valid_values:
+                    if mood_item.lower() in BGM_MOOD_VALUES:
                         fixed_mood.append(mood_item.lower())
                     else:
                         # 尝试映射
@@ -84,7 +134,7 @@ class CozeMusicService:
                             'chill': 'calm'
                         }
                         mapped_mood = mood_mapping.get(mood_item.lower())
-                        if mapped_mood and mapped_mood in bgm_mood_valid_values:
+                        if mapped_mood and mapped_mood in BGM_MOOD_VALUES:
                             print(f"🔧 修复BGM mood参数: {mood_item} → {mapped_mood}")
                             fixed_mood.append(mapped_mood)
                         else:
@@ -95,17 +145,10 @@ class CozeMusicService:
                 music_prompt.mood = ['happy']
             
             # 验证instrument参数
-            bgm_instrument_valid_values = [
-                'piano', 'drums', 'guitar', 'percussion', 'synth', 'electric guitar', 
-                'acoustic guitar', 'bass guitar', 'brass', 'violin', 'cello', 'flute', 
-                'organ', 'trumpet', 'ukulele', 'saxophone', 'double bass', 'harp', 
-                'glockenspiel', 'synthesizer', 'keyboard', 'marimba', 'bass', 'banjo', 'strings'
-            ]
-            
             if music_prompt.instrument:
                 fixed_instruments = []
                 for instrument in music_prompt.instrument:
-                    if instrument.lower() in bgm_instrument_valid_values:
+                    if instrument.lower() in BGM_INSTRUMENT_VALUES:
                         fixed_instruments.append(instrument.lower())
                     else:
                         print(f"⚠️ 未知BGM instrument值 {instrument}，使用默认值 'piano'")
@@ -115,19 +158,10 @@ class CozeMusicService:
                 music_prompt.instrument = ['piano']
             
             # 验证genre参数
-            bgm_genre_valid_values = [
-                'corporate', 'dance/edm', 'orchestral', 'chill out', 'rock', 'hip hop', 
-                'folk', 'funk', 'ambient', 'holiday', 'jazz', 'kids', 'world', 'travel', 
-                'commercial', 'advertising', 'driving', 'cinematic', 'upbeat', 'epic', 
-                'inspiring', 'business', 'video game', 'dark', 'pop', 'trailer', 
-                'modern', 'electronic', 'documentary', 'soundtrack', 'fashion', 
-                'acoustic', 'movie', 'tv', 'high tech', 'industrial'
-            ]
-            
             if music_prompt.genre:
                 fixed_genres = []
                 for genre in music_prompt.genre:
-                    if genre.lower() in bgm_genre_valid_values:
+                    if genre.lower() in BGM_GENRE_VALUES:
                         fixed_genres.append(genre.lower())
                     else:
                         genre_mapping = {
@@ -137,7 +171,7 @@ class CozeMusicService:
                             'techno': 'electronic'
                         }
                         mapped_genre = genre_mapping.get(genre.lower())
-                        if mapped_genre and mapped_genre in bgm_genre_valid_values:
+                        if mapped_genre and mapped_genre in BGM_GENRE_VALUES:
                             print(f"🔧 修复BGM genre参数: {genre} → {mapped_genre}")
                             fixed_genres.append(mapped_genre)
                         else:
@@ -148,18 +182,10 @@ class CozeMusicService:
                 music_prompt.genre = ['ambient']
             
             # 验证theme参数
-            bgm_theme_valid_values = [
-                'inspirational', 'motivational', 'achievement', 'discovery', 'every day', 
-                'love', 'technology', 'lifestyle', 'journey', 'meditation', 'drama', 
-                'children', 'hope', 'fantasy', 'holiday', 'health', 'family', 'real estate', 
-                'media', 'kids', 'science', 'education', 'progress', 'world', 'vacation', 
-                'training', 'christmas', 'sales'
-            ]
-            
             if music_prompt.theme:
                 fixed_themes = []
                 for theme in music_prompt.theme:
-                    if theme.lower() in bgm_theme_valid_values:
+                    if theme.lower() in BGM_THEME_VALUES:
                         fixed_themes.append(theme.lower())
                     else:
                         print(f"⚠️ 未知BGM theme值 {theme}，使用默认值 'meditation'")
@@ -180,7 +206,7 @@ class CozeMusicService:
             # 修复mood参数
             if music_prompt.mood_single:
                 # 先尝试直接匹配
-                if music_prompt.mood_single not in song_mood_valid_values:
+                if music_prompt.mood_single not in SONG_MOOD_VALUES:
                     # 尝试映射
                     mapped_mood = song_mood_mapping.get(music_prompt.mood_single.lower())
                     if mapped_mood:
@@ -194,9 +220,8 @@ class CozeMusicService:
                 music_prompt.mood_single = 'Happy'
             
             # 修复genre参数
-            song_genre_valid_values = ['Folk', 'Pop', 'Rock', 'Chinese Style', 'Hip Hop/Rap', 'R&B/Soul', 'Punk', 'Electronic', 'Jazz', 'Reggae', 'DJ']
             if music_prompt.genre_single:
-                if music_prompt.genre_single not in song_genre_valid_values:
+                if music_prompt.genre_single not in SONG_GENRE_VALUES:
                     # 简单映射
                     genre_mapping = {
                         'pop': 'Pop',
@@ -223,9 +248,8 @@ class CozeMusicService:
                 music_prompt.genre_single = 'Pop'
             
             # 修复timbre参数
-            timbre_valid_values = ['Warm', 'Bright', 'Husky', 'Electrified voice', 'Sweet_AUDIO_TIMBRE', 'Cute_AUDIO_TIMBRE', 'Loud and sonorous', 'Powerful', 'Sexy/Lazy']
             if music_prompt.timbre:
-                if music_prompt.timbre not in timbre_valid_values:
+                if music_prompt.timbre not in SONG_TIMBRE_VALUES:
                     timbre_mapping = {
                         'warm': 'Warm',
                         'bright': 'Bright',
@@ -272,6 +296,39 @@ class CozeMusicService:
         
         return music_prompt
 
+    def normalized(self, music_prompt: MusicPrompt) -> MusicPrompt:
+        """返回参数校验修复后的副本，不修改传入的提示词"""
+        return self._validate_and_fix_parameters(music_prompt.model_copy(deep=True))
+
+    def derive_variants(self, music_prompt: MusicPrompt, count: int, seed: str = "") -> List[Tuple[MusicPrompt, Dict[str, Any]]]:
+        """
+        从一个提示词派生count个版本（第一个为原提示词本身）
+        其余版本每个只替换一项参数（gen_bgm: mood/genre/instrument，歌曲: mood/genre/timbre），取值限定在插件可选值内
+        相同seed得到相同的版本，返回: [(提示词, 相对原提示词的改动)]
+        """
+        base = self.normalized(music_prompt)
+        variants: List[Tuple[MusicPrompt, Dict[str, Any]]] = [(base, {})]
+        fields = VARIANT_FIELDS.get(base.interface)
+        if not fields:
+            return variants
+        rng = random.Random(f"{seed}:{base.model_dump_json()}")
+        used = {name: set(getattr(base, name) if isinstance(getattr(base, name), list) else [getattr(base, name)])
+                for name, _ in fields}
+        for i in range(1, count):
+            name, values = fields[(i - 1) % len(fields)]
+            choices = [v for v in values if v not in used[name]] or values
+            value = rng.choice(choices)
+            used[name].add(value)
+            variant = base.model_copy(deep=True)
+            current = getattr(base, name)
+            if isinstance(current, list):
+                # 数组参数只替换第一项，其余保持不变
+                value = [value] + [v for v in current[1:] if v != value]
+            setattr(variant, name, value)
+            variants.append((variant, {name: value}))
+        return variants
+
+    @tracer.traced("coze.format_prompt")
     def _format_music_prompt(self, music_prompt: MusicPrompt) -> str:
         """将MusicPrompt格式化为Coze插件能理解的文本"""
         try:
@@ -285,16 +342,8 @@ class CozeMusicService:
                 theme_list = music_prompt.theme or ["meditation"]
                 instrument_list = music_prompt.instrument or ["piano"]
                 
-                # 确保参数值符合教程.txt中的选项
-                valid_moods = ["positive", "uplifting", "energetic", "happy", "bright", "optimistic", 
-                              "hopeful", "cool", "dreamy", "fun", "light", "powerful", "calm", 
-                              "confident", "joyful", "dramatic", "peaceful", "playful", "soft", 
-                              "groovy", "reflective", "easy", "relaxed", "lively", "smooth", 
-                              "romantic", "intense", "elegant", "mellow", "emotional", 
-                              "sentimental", "cheerful", "contemplative"]
-                
-                # 过滤无效的mood值
-                mood_list = [m for m in mood_list if m in valid_moods]
+                # 确保参数值符合教程.txt中的选项，过滤无效的mood值
+                mood_list = [m for m in mood_list if m in BGM_MOOD_VALUES]
                 if not mood_list:
                     mood_list = ["peaceful"]
                 
@@ -345,11 +394,47 @@ class CozeMusicService:
             print(f"格式化音乐提示词失败: {e}")
             return "请生成一首优美的背景音乐"
     
+    @tracer.traced("coze.generate_music")
     def generate_music(self, music_prompt: MusicPrompt) -> Tuple[bool, str, Optional[str]]:
         """
         调用Coze对话API生成音乐
         返回: (success, music_url_or_error_message, lyrics)
         """
+        tracer.set_attribute("coze.interface", music_prompt.interface)
+        with COZE_GENERATION_SECONDS.time(interface=music_prompt.interface, status="exception") as labels:
+            # 提交到对话完成全程占用一个Coze自适应并发名额；耗时按接口和时长折算后参与上限调整
+            try:
+                # 剩余时间不够提交对话时直接放弃，不占用名额
+                budget("coze_submit", REQUEST_TIMEOUT)
+                with coze_limiter.acquire(estimate_cost(music_prompt.interface, music_prompt.duration)) as slot:
+                    result = self._generate_music(music_prompt, slot)
+                labels["status"] = "success" if result[0] else "failed"
+            except UpstreamOverloaded as e:
+                result = False, str(e), None
+                labels["status"] = "shed"
+            except DeadlineExceeded as e:
+                result = False, e.message, None
+                labels["status"] = "deadline"
+            tracer.set_attribute("coze.status", labels["status"])
+            return result
+
+    def _headers(self, credential: CredentialLease) -> Dict[str, str]:
+        return {**self.headers, "Authorization": f"Bearer {credential.secret}"}
+
+    def _generate_music(self, music_prompt: MusicPrompt, slot: LimiterSlot) -> Tuple[bool, str, Optional[str]]:
+        """选择进行中生成最少的Coze账号提交对话；账号被限流时隔离并换下一个账号重试"""
+        for retries_left in range(max(len(coze_credentials), 1) - 1, -1, -1):
+            with coze_credentials.lease() as credential:
+                result = self._submit_chat(music_prompt, credential)
+            if credential.outcome != "ok":
+                # 限流或接口报错视为过载信号，收缩并发上限
+                slot.dropped()
+            if credential.outcome != "throttled" or not retries_left:
+                break
+        return result
+
+    def _submit_chat(self, music_prompt: MusicPrompt, credential: CredentialLease) -> Tuple[bool, str, Optional[str]]:
+        """用指定账号提交对话并等待生成结果（对话的查询必须使用同一账号）"""
         try:
             # 格式化提示词
             prompt_text = self._format_music_prompt(music_prompt)
@@ -357,7 +442,7 @@ class CozeMusicService:
             
             # 构建对话请求数据 - 使用v3/chat接口
             payload = {
-                "bot_id": self.bot_id,
+                "bot_id": credential.extra["bot_id"],
                 "user_id": "music_generator_user",  # 固定用户ID
                 "stream": False,  # 使用非流式响应
                 "auto_save_history": True,  # 保存对话记录以便查看结果
@@ -377,12 +462,20 @@ class CozeMusicService:
             print(f"发送对话API请求到Coze: {json.dumps(payload, ensure_ascii=False, indent=2)}")
             
             # 发送请求
-            response = requests.post(self.api_url, headers=self.headers, json=payload)
+            with tracer.span("POST coze /v3/chat", SPAN_KIND_CLIENT, **{"coze.credential": credential.name}) as span:
+                response = requests.post(
+                    self.api_url, headers=self._headers(credential), json=payload,
+                    timeout=budget("coze_submit", REQUEST_TIMEOUT)
+                )
+                span.set_attribute("http.status_code", response.status_code)
             print(f"Coze对话API响应状态码: {response.status_code}")
             
             if response.status_code == 200:
                 result = response.json()
                 print(f"Coze对话API响应: {json.dumps(result, ensure_ascii=False, indent=2)}")
+                if result.get("code") in COZE_THROTTLE_CODES:
+                    credential.throttled()
+                    return False, f"Coze账号被限流: {result.get('msg')}", None
                 
                 # 获取对话ID和会话ID
                 chat_id = result.get("data", {}).get("id")
@@ -393,14 +486,17 @@ class CozeMusicService:
                 
                 print(f"对话创建成功，Chat ID: {chat_id}, Conversation ID: {conversation_id}")
                 
-                # 等待对话完成并获取结果
-                music_url, lyrics = self._wait_for_chat_completion(chat_id, conversation_id)
-                if music_url:
-                    return True, music_url, lyrics
-                else:
-                    return False, "音乐生成超时或失败", None
+                # 先记入生成日志再轮询：进程中途重启时由恢复流程用同一账号继续等待并交付结果
+                entry_id = generation_journal.submitted(chat_id, conversation_id, music_prompt, credential.name)
+                result = self._await_chat(chat_id, conversation_id, credential)
+                generation_journal.finished(entry_id, *result)
+                return result
                     
             else:
+                if response.status_code == 429:
+                    credential.throttled()
+                else:
+                    credential.failed()
                 error_msg = f"Coze对话API调用失败: {response.status_code} - {response.text}"
                 print(error_msg)
                 return False, error_msg, None
@@ -410,9 +506,31 @@ class CozeMusicService:
             print(error_msg)
             return False, error_msg, None
     
-    def _wait_for_chat_completion(self, chat_id: str, conversation_id: str, max_wait_time: int = 300, poll_interval: int = 2) -> Tuple[Optional[str], Optional[str]]:
+    def resume_chat(self, chat_id: str, conversation_id: str,
+                    credential_name: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
+        """
+        等待进程重启前已提交的对话完成（对话只能用提交时的账号查询；未记录账号时任选一个）
+        返回: (success, music_url_or_error_message, lyrics)
         """
-        等待对话完成并获取音乐生成结果
+        try:
+            with coze_credentials.lease(credential_name) as credential:
+                return self._await_chat(chat_id, conversation_id, credential)
+        except CredentialNotFound as e:
+            print(f"无法恢复对话 {chat_id}: {e.message}")
+            return False, f"提交对话的Coze账号已不在配置中: {credential_name}", None
+
+    def _await_chat(self, chat_id: str, conversation_id: str,
+                    credential: CredentialLease) -> Tuple[bool, str, Optional[str]]:
+        music_url, lyrics = self._wait_for_chat_completion(chat_id, conversation_id, self._headers(credential))
+        if music_url:
+            return True, music_url, lyrics
+        return False, "音乐生成超时或失败", None
+
+    @tracer.traced("coze.wait_for_completion")
+    def _wait_for_chat_completion(self, chat_id: str, conversation_id: str, headers: Dict[str, str],
+                                  max_wait_time: float = MAX_WAIT_TIME, poll_interval: float = 2) -> Tuple[Optional[str], Optional[str]]:
+        """
+        等待对话完成并获取音乐生成结果；请求有截止时间时最多等到截止时间
         返回: (music_url, lyrics)
         """
         print(f"开始等待对话完成，Chat ID: {chat_id}")
@@ -421,50 +539,116 @@ class CozeMusicService:
         base_url = os.getenv("COZE_API_BASE_URL", "https://api.coze.cn")
         chat_detail_url = f"{base_url}/v3/chat/retrieve?chat_id={chat_id}&conversation_id={conversation_id}"
         
+        # 已查看过的消息id，提前查看时只解析新出现的消息
+        seen: Set[str] = set()
         start_time = time.time()
-        while time.time() - start_time < max_wait_time:
+        left = remaining()
+        limited_by_deadline = left is not None and left < max_wait_time
+        end_time = start_time + (min(max_wait_time, left) if left is not None else max_wait_time)
+        polls = 0
+        while end_time - time.time() > MIN_BUDGET:
             try:
                 # 查询对话状态
-                response = requests.get(chat_detail_url, headers=self.headers)
+                polls += 1
+                with tracer.span("GET coze /v3/chat/retrieve", SPAN_KIND_CLIENT, **{"coze.poll": polls}) as span:
+                    response = requests.get(
+                        chat_detail_url, headers=headers, timeout=min(REQUEST_TIMEOUT, end_time - time.time())
+                    )
+                    span.set_attribute("http.status_code", response.status_code)
                 if response.status_code == 200:
                     result = response.json()
                     chat_status = result.get("data", {}).get("status")
+                    span.set_attribute("coze.chat_status", str(chat_status))
                     
                     print(f"对话状态: {chat_status}")
                     
                     # 检查是否完成
                     if chat_status in ["completed", "failed", "canceled"]:
+                        COZE_POLL_ITERATIONS.observe(polls, status=chat_status)
                         if chat_status == "completed":
                             # 获取对话消息
-                            return self._get_chat_messages(chat_id, conversation_id)
+                            return self._get_chat_messages(chat_id, conversation_id, headers)
                         else:
                             print(f"对话失败，状态: {chat_status}")
                             return None, None
                     elif chat_status == "required_action":
+                        COZE_POLL_ITERATIONS.observe(polls, status=chat_status)
                         print("对话需要用户操作")
                         return None, None
+                    elif EARLY_RESULT and chat_status == "in_progress":
+                        music_url, lyrics = self._peek_chat_messages(chat_id, conversation_id, headers, seen)
+                        if music_url:
+                            COZE_POLL_ITERATIONS.observe(polls, status="early_result")
+                            print("插件已返回音乐链接，对话仍在进行中，提前结束等待")
+                            return music_url, lyrics
                 
                 print(f"等待对话完成... ({int(time.time() - start_time)}s)")
-                time.sleep(poll_interval)
+                time.sleep(max(0.0, min(poll_interval, end_time - time.time())))
                 
             except Exception as e:
                 print(f"等待对话完成时出错: {e}")
-                time.sleep(poll_interval)
+                time.sleep(max(0.0, min(poll_interval, end_time - time.time())))
         
+        if limited_by_deadline:
+            DEADLINE_EXCEEDED.inc(stage="coze_poll")
+        COZE_POLL_ITERATIONS.observe(polls, status="deadline" if limited_by_deadline else "timeout")
         print("对话等待超时")
         return None, None
 
-    def _get_chat_messages(self, chat_id: str, conversation_id: str) -> Tuple[Optional[str], Optional[str]]:
+    def _messages_url(self, chat_id: str, conversation_id: str) -> str:
+        base_url = os.getenv("COZE_API_BASE_URL", "https://api.coze.cn")
+        return f"{base_url}/v3/chat/message/list?chat_id={chat_id}&conversation_id={conversation_id}"
+
+    @tracer.traced("coze.peek_messages")
+    def _peek_chat_messages(self, chat_id: str, conversation_id: str, headers: Dict[str, str],
+                            seen: Set[str]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        对话进行中时查看消息列表：只解析上次查看之后新出现的插件结果消息，找到音乐链接即返回
+        查看失败不影响轮询，返回 (None, None)
+        返回: (music_url, lyrics)
+        """
+        try:
+            with tracer.span("GET coze /v3/chat/message/list", SPAN_KIND_CLIENT, **{"coze.peek": True}) as span:
+                response = requests.get(
+                    self._messages_url(chat_id, conversation_id), headers=headers,
+                    timeout=budget("coze_messages", REQUEST_TIMEOUT)
+                )
+                span.set_attribute("http.status_code", response.status_code)
+            if response.status_code != 200:
+                return None, None
+            messages = response.json().get("data") or []
+        except Exception as e:
+            print(f"查看对话消息时出错: {e}")
+            return None, None
+
+        for index, message in enumerate(messages):
+            message_id = message.get("id") or f"#{index}"
+            # 插件结果消息可能先出现、内容稍后才写入：有内容后才记为已查看
+            if message_id in seen or message.get("type") not in EARLY_RESULT_TYPES or not message.get("content"):
+                continue
+            seen.add(message_id)
+            # 查看过程中的解析不计入解析结果指标，只在拿到结果时记录一次
+            music_url, lyrics, outcome = self._parse_music_content(message["content"])
+            if music_url:
+                COZE_PARSE_RESULT.inc(outcome=outcome)
+                return music_url, lyrics
+        return None, None
+
+    @tracer.traced("coze.list_messages")
+    def _get_chat_messages(self, chat_id: str, conversation_id: str,
+                           headers: Dict[str, str]) -> Tuple[Optional[str], Optional[str]]:
         """
         获取对话消息内容，处理插件调用的多条响应
         返回: (music_url, lyrics)
         """
         try:
-            # 构建查询消息的URL
-            base_url = os.getenv("COZE_API_BASE_URL", "https://api.coze.cn")
-            messages_url = f"{base_url}/v3/chat/message/list?chat_id={chat_id}&conversation_id={conversation_id}"
+            messages_url = self._messages_url(chat_id, conversation_id)
             
-            response = requests.get(messages_url, headers=self.headers)
+            with tracer.span("GET coze /v3/chat/message/list", SPAN_KIND_CLIENT) as span:
+                response = requests.get(
+                    messages_url, headers=headers, timeout=budget("coze_messages", REQUEST_TIMEOUT)
+                )
+                span.set_attribute("http.status_code", response.status_code)
             print(f"消息查询响应状态码: {response.status_code}")
             
             if response.status_code == 200:
@@ -582,6 +766,7 @@ class CozeMusicService:
         
         return None
     
+    @tracer.traced("coze.parse_music_response")
     def _parse_music_response(self, content: str) -> Tuple[Optional[str], Optional[str]]:
         """
         解析Coze返回的音乐生成结果
@@ -589,6 +774,13 @@ class CozeMusicService:
         1. 简单文本格式: "第一行是音乐下载链接后面是歌词"
         2. 插件调用格式: JSON格式的插件响应
         """
+        music_url, lyrics, outcome = self._parse_music_content(content)
+        if outcome:
+            COZE_PARSE_RESULT.inc(outcome=outcome)
+        return music_url, lyrics
+
+    def _parse_music_content(self, content: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """_parse_music_response的解析部分，不记录指标；返回 (music_url, lyrics, 解析结果类别)"""
         try:
             # 首先尝试解析JSON格式（插件调用）
             if content.strip().startswith('{') and content.strip().endswith('}'):
@@ -600,7 +792,7 @@ class CozeMusicService:
                         print(f"检测到音乐生成插件调用: {plugin_response.get('name')}")
                         
                         # 插件调用本身不包含结果，需要等待后续消息
-                        return None, None
+                        return None, None, "plugin_call"
                     
                     # 检查是否是插件执行结果
                     if 'code' in plugin_response:
@@ -618,19 +810,19 @@ class CozeMusicService:
                                         print(f"从插件响应的SongDetail中解析到音乐链接: {music_url}")
                                         if lyrics:
                                             print(f"解析到歌词: {lyrics[:100]}...")
-                                        return music_url, lyrics
+                                        return music_url, lyrics, "song_detail"
                                 
                                 # 备用：检查其他可能的字段
                                 music_url = data.get('music_url') or data.get('url') or data.get('download_url') or data.get('AudioUrl')
                                 lyrics = data.get('lyrics') or data.get('lyric') or data.get('Lyrics')
                                 if music_url:
                                     print(f"从插件响应的data中解析到音乐链接: {music_url}")
-                                    return music_url, lyrics
+                                    return music_url, lyrics, "plugin_data"
                         else:
                             # 插件执行失败
                             error_msg = plugin_response.get('msg', '未知错误')
                             print(f"插件执行失败: {plugin_response.get('code')} - {error_msg}")
-                            return None, None
+                            return None, None, "plugin_error"
                             
                 except json.JSONDecodeError:
                     pass  # 不是JSON格式，继续尝试文本解析
@@ -638,7 +830,7 @@ class CozeMusicService:
             # 尝试简单文本格式解析
             lines = content.strip().split('\n')
             if not lines:
-                return None, None
+                return None, None, None
             
             # 第一行应该是音乐下载链接
             first_line = lines[0].strip()
@@ -656,7 +848,7 @@ class CozeMusicService:
                 if lyrics:
                     print(f"解析到歌词: {lyrics[:100]}...")
                 
-                return music_url, lyrics
+                return music_url, lyrics, "text_first_line"
             
             # 如果第一行不是链接，尝试在整个内容中查找URL
             import re
@@ -670,14 +862,14 @@ class CozeMusicService:
                 lyrics = lyrics_content if lyrics_content else None
                 
                 print(f"从内容中提取到音乐链接: {music_url}")
-                return music_url, lyrics
+                return music_url, lyrics, "url_in_text"
             
             print(f"未找到有效的音乐链接，内容: {content[:100]}...")
-            return None, None
+            return None, None, "no_url"
             
         except Exception as e:
             print(f"解析音乐响应失败: {e}")
-            return None, None
+            return None, None, "exception"
 
 # 全局Coze音乐服务实例
 coze_music_service = CozeMusicService()
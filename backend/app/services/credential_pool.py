@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+from app.services.metrics import metrics, CREDENTIAL_REQUESTS
+from app.services.state_store import StateStore, state_store
+
+load_dotenv()
+
+class Credential:
+    """一个上游账号凭据；name用于日志、指标和生成日志，不包含密钥本身"""
+    __slots__ = ("name", "secret", "extra", "outstanding", "requests", "throttled", "errors")
+
+    def __init__(self, name: str, secret: str, extra: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.secret = secret
+        self.extra = extra or {}
+        self.outstanding = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+class CredentialLease:
+    """一次凭据占用；调用方根据上游响应调用throttled()/failed()，退出with时归还"""
+
+    def __init__(self, pool: "CredentialPool", credential: Credential):
+        self.pool = pool
+        self.credential = credential
+        self.outcome = "ok"
+
+    @property
+    def name(self) -> str:
+        return self.credential.name
+
+    @property
+    def secret(self) -> str:
+        return self.credential.secret
+
+    @property
+    def extra(self) -> Dict[str, str]:
+        return self.credential.extra
+
+    def throttled(self, quarantine: Optional[float] = None) -> None:
+        """上游返回429或额度不足：隔离该凭据一段时间"""
+        self.outcome = "throttled"
+        self.pool.quarantine(self.credential, quarantine)
+
+    def failed(self) -> None:
+        self.outcome = "error"
+
+class CredentialNotFound(KeyError):
+    """按名称取回的凭据已不在配置中（如重启后移除了账号）"""
+
+    def __init__(self, kind: str, name: str):
+        super().__init__(f"{kind} 凭据 {name} 不在配置中")
+        self.message = self.args[0]
+        self.name = name
+
+class CredentialPool:
+    """
+    同一上游的多个账号凭据
+    - lease()选择进行中请求最少的可用凭据（相同时选累计请求少的），请求分散到各账号
+    - 被限流或额度用尽的凭据隔离quarantine秒；隔离标记保存在共享状态存储中，所有worker一起避开
+    - 全部凭据都在隔离中时仍返回最早解除隔离的一个，由上游决定是否拒绝
+    - 需要保持同一账号的调用（如Coze对话的后续查询）用lease(name)按名称取回，名称不存在时抛出CredentialNotFound
+    """
+
+    def __init__(self, store: StateStore, kind: str, credentials: List[Credential], quarantine: float):
+        if not credentials:
+            raise RuntimeError(f"{kind} 未配置任何凭据")
+        self.store = store
+        self.kind = kind
+        self.credentials = credentials
+        self.default_quarantine = quarantine
+        self._by_name = {c.name: c for c in credentials}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    def _quarantined_until(self, credential: Credential) -> float:
+        return self.store.get(f"credential:quarantine:{self.kind}:{credential.name}") or 0.0
+
+    def quarantine(self, credential: Credential, seconds: Optional[float] = None) -> None:
+        seconds = seconds or self.default_quarantine
+        until = time.time() + seconds
+        self.store.set(f"credential:quarantine:{self.kind}:{credential.name}", until, ttl=seconds)
+        print(f"{self.kind} 凭据 {credential.name} 被限流，隔离 {seconds:.0f}s")
+
+    def _pick(self, now: float) -> Credential:
+        if len(self.credentials) == 1:
+            return self.credentials[0]
+        until = {c.name: self._quarantined_until(c) for c in self.credentials}
+        available = [c for c in self.credentials if until[c.name] <= now]
+        if not available:
+            return min(self.credentials, key=lambda c: until[c.name])
+        return min(available, key=lambda c: (c.outstanding, c.requests))
+
+    def get(self, name: Optional[str]) -> Optional[Credential]:
+        return self._by_name.get(name) if name else None
+
+    @contextmanager
+    def lease(self, name: Optional[str] = None) -> Iterator[CredentialLease]:
+        """占用一个凭据；指定name时必须使用该凭据，不存在时抛出CredentialNotFound"""
+        with self._lock:
+            if name:
+                credential = self.get(name)
+                if credential is None:
+                    raise CredentialNotFound(self.kind, name)
+            else:
+                credential = self._pick(time.time())
+            credential.outstanding += 1
+            credential.requests += 1
+        lease = CredentialLease(self, credential)
+        try:
+            yield lease
+        except Exception:
+            if lease.outcome == "ok":
+                lease.outcome = "error"
+            raise
+        finally:
+            with self._lock:
+                credential.outstanding -= 1
+                credential.throttled += lease.outcome == "throttled"
+                credential.errors += lease.outcome == "error"
+            CREDENTIAL_REQUESTS.inc(pool=self.kind, credential=credential.name, outcome=lease.outcome)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        return [
+            {
+                "name": c.name,
+                **c.extra,
+                "outstanding": c.outstanding,
+                "requests": c.requests,
+                "throttled": c.throttled,
+                "errors": c.errors,
+                "quarantined_for": max(0, round(self._quarantined_until(c) - now, 1)),
+            }
+            for c in self.credentials
+        ]
+
+def _split(value: Optional[str]) -> List[str]:
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+def _mask(secret: str) -> str:
+    return secret[-4:] if len(secret) > 8 else "****"
+
+def _dashscope_credentials() -> List[Credential]:
+    """DASHSCOPE_API_KEYS=key1,key2；未配置时使用DASHSCOPE_API_KEY"""
+    keys = _split(os.getenv("DASHSCOPE_API_KEYS")) or _split(os.getenv("DASHSCOPE_API_KEY"))
+    return [Credential(f"dashscope-{i}-{_mask(key)}", key) for i, key in enumerate(keys)]
+
+def _coze_credentials() -> List[Credential]:
+    """
+    COZE_CREDENTIALS=token1:bot_id1,token2:bot_id2（每个账号一个token和bot）；
+    未配置时使用COZE_TOKEN和COZE_BOT_IDS（逗号分隔，同一账号下的多个bot）或COZE_BOT_ID
+    """
+    pairs = []
+    for entry in _split(os.getenv("COZE_CREDENTIALS")):
+        token, _, bot_id = entry.rpartition(":")
+        if token and bot_id:
+            pairs.append((token, bot_id))
+    if not pairs and os.getenv("COZE_TOKEN"):
+        bot_ids = _split(os.getenv("COZE_BOT_IDS")) or _split(os.getenv("COZE_BOT_ID"))
+        pairs = [(os.getenv("COZE_TOKEN"), bot_id) for bot_id in bot_ids]
+    return [
+        Credential(f"coze-{i}-{_mask(token)}-{bot_id}", token, {"bot_id": bot_id})
+        for i, (token, bot_id) in enumerate(pairs)
+    ]
+
+def _pool(kind: str, credentials: List[Credential]) -> Optional[CredentialPool]:
+    if not credentials:
+        return None
+    return CredentialPool(
+        state_store, kind, credentials,
+        quarantine=float(os.getenv(f"{kind.upper()}_CREDENTIAL_QUARANTINE", 60)),
+    )
+
+# 全局凭据池；未配置任何凭据时为None，由使用方在初始化时报错
+dashscope_credentials = _pool("dashscope", _dashscope_credentials())
+coze_credentials = _pool("coze", _coze_credentials())
+
+metrics.gauge(
+    "credential_outstanding", "各上游凭据进行中的请求数", ("pool", "credential"),
+    callback=lambda: [
+        ((pool.kind, c.name), c.outstanding)
+        for pool in (dashscope_credentials, coze_credentials) if pool is not None
+        for c in pool.credentials
+    ],
+)
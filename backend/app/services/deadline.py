@@ -0,0 +1,59 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from dotenv import load_dotenv
+from app.services.metrics import DEADLINE_EXCEEDED
+
+load_dotenv()
+
+# 剩余时间不足该秒数时不再发起新的上游调用（连接建立+首字节都来不及）
+MIN_BUDGET = float(os.getenv("DEADLINE_MIN_BUDGET", 0.2))
+
+# 当前请求的截止时间（time.monotonic()），None表示没有截止时间（后台任务、恢复流程）
+# 随contextvars传递：asyncio.to_thread、生成调度器和对冲线程池都会复制调用方的上下文
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(TimeoutError):
+    """请求的截止时间已到或剩余时间不足以完成下一步，调用方应立即降级，由main.py转换为504响应"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"请求处理超时（{stage}）")
+        self.message = str(self)
+        self.stage = stage
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """在seconds秒后截止；已有更早的截止时间时保持不变（只能收紧，不能放宽）"""
+    if seconds is None:
+        yield
+        return
+    until = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(until if current is None else min(current, until))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> Optional[float]:
+    """距截止时间的剩余秒数（可能为负），没有截止时间时返回None"""
+    until = _deadline.get()
+    return None if until is None else until - time.monotonic()
+
+def check(stage: str, need: float = 0.0) -> None:
+    """剩余时间不足need秒时抛出DeadlineExceeded"""
+    left = remaining()
+    if left is not None and left <= need:
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage)
+
+def budget(stage: str, cap: float) -> float:
+    """
+    下一步最多可以花的秒数：min(cap, 剩余时间)，用作requests超时、轮询上限等
+    剩余时间不足MIN_BUDGET时直接抛出DeadlineExceeded，不再发起注定超时的调用
+    """
+    check(stage, MIN_BUDGET)
+    left = remaining()
+    return cap if left is None else min(cap, left)
@@ -0,0 +1,350 @@
+import contextvars
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.models.schemas import MusicPrompt
+from app.services.metrics import metrics, GENERATION_RECOVERED
+from app.services.session_manager import session_manager
+from app.services.state_store import StateStore, state_store
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有flock，按单进程处理
+    fcntl = None
+
+load_dotenv()
+
+# 当前请求对应的会话；由生成接口设置，随contextvars传递到生成调度器的工作线程
+current_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("journal_session", default=None)
+
+# 恢复轮询：(chat_id, conversation_id, 提交时使用的凭据名) -> (success, music_url或错误信息, lyrics)
+Resume = Callable[[str, str, Optional[str]], Tuple[bool, str, Optional[str]]]
+# 提交恢复任务：(任务, interface)
+Submit = Callable[[Callable[[], Any], str], Any]
+
+def prompt_hash(prompt: MusicPrompt) -> str:
+    raw = json.dumps(prompt.model_dump(exclude_none=True), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def _lock(f) -> bool:
+    """对日志文件加排他锁；持有锁表示写入该文件的进程仍然存活"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+class GenerationJournal:
+    """
+    已提交Coze生成的追加写日志，进程在轮询期间重启时不丢失chat_id
+    - 每个进程写自己的文件（持有flock），每行一条JSON事件：submitted带会话、chat_id等，completed/failed为结束
+    - submitted需落盘后才开始轮询；写入由后台线程攒批后统一fsync（组提交），结束事件不等待落盘，
+      丢失时恢复阶段重新查询一次即可
+    - start()接管已退出进程遗留的日志（启动时一次，之后每adopt_interval秒一次，接收下线进程交出的对话）：
+      未结束的对话在生成调度器中继续轮询，结果保存到会话
+    - 已结束事件累计到compact_every条后重写文件，只保留未结束的条目
+    """
+
+    def __init__(self, store: StateStore, directory: str, fsync_interval: float, compact_every: int,
+                 max_age: float, result_ttl: float, adopt_interval: float):
+        self.store = store
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.max_age = max_age
+        self.result_ttl = result_ttl
+        self.adopt_interval = adopt_interval
+        self._cond = threading.Condition()
+        self._file = None
+        self._path: Optional[str] = None
+        self._written = 0
+        self._synced = 0
+        self._finished = 0
+        # 本进程未结束的条目（压缩时原样写回）
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._adopter: Optional[threading.Thread] = None
+        self._closed = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _open(self):
+        """新建一个已加锁的日志文件：先以临时名创建并加锁，再改为正式名，其他进程不会把它当作遗留日志"""
+        path = os.path.join(self.directory, f"journal-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        tmp_path = f"{path}.tmp"
+        f = open(tmp_path, "a", encoding="utf-8")
+        _lock(f)
+        return f, tmp_path, path
+
+    def _ensure_open(self) -> None:
+        """调用方需持有锁"""
+        if self._file is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        f, tmp_path, path = self._open()
+        os.replace(tmp_path, path)
+        self._file, self._path = f, path
+        self._flusher = threading.Thread(target=self._flush_loop, name="generation-journal", daemon=True)
+        self._flusher.start()
+
+    def _append(self, event: Dict[str, Any], durable: bool) -> bool:
+        """写入一条事件；durable为True时等待落盘。日志已关闭（未写入）时返回False"""
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._cond:
+            if self._closed:
+                return False
+            self._ensure_open()
+            self._file.write(line)
+            self._written += 1
+            seq = self._written
+            self._cond.notify_all()
+            if durable:
+                while self._synced < seq and not self._closed:
+                    self._cond.wait()
+            # close()会先落盘已写入的事件再关闭
+            return True
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                while self._written == self._synced and not self._closed:
+                    self._cond.wait()
+                if self._written == self._synced:
+                    return
+            # 等待一小段时间，让并发提交的多条事件合并为一次fsync
+            time.sleep(self.fsync_interval)
+            with self._cond:
+                target = self._written
+                try:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                except (OSError, ValueError) as e:
+                    print(f"生成日志落盘失败: {e}")
+                self._synced = target
+                self._cond.notify_all()
+
+    def submitted(self, chat_id: str, conversation_id: str, prompt: MusicPrompt,
+                  credential: Optional[str] = None) -> Optional[str]:
+        """记录已提交的对话（落盘后返回），返回条目id；未绑定会话或日志关闭时返回None"""
+        session_id = current_session.get()
+        if not self.enabled or session_id is None:
+            return None
+        entry = {
+            "id": uuid.uuid4().hex,
+            "state": "submitted",
+            "session_id": session_id,
+            "chat_id": chat_id,
+            "conversation_id": conversation_id,
+            "credential": credential,
+            "prompt_hash": prompt_hash(prompt),
+            "interface": prompt.interface,
+            "ts": time.time(),
+        }
+        with self._cond:
+            self._entries[entry["id"]] = entry
+        if not self._append(entry, durable=True):
+            with self._cond:
+                self._entries.pop(entry["id"], None)
+            return None
+        return entry["id"]
+
+    def finished(self, entry_id: Optional[str], success: bool, result: str, lyrics: Optional[str]) -> None:
+        """记录对话结束，并把结果保存到会话（进程重启后仍可查询）"""
+        if entry_id is None:
+            return
+        with self._cond:
+            entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self._save_result(entry, success, result, lyrics)
+        self._append({"id": entry_id, "state": "completed" if success else "failed", "ts": time.time()}, durable=False)
+        with self._cond:
+            self._finished += 1
+            if self._finished >= self.compact_every:
+                self._compact()
+
+    def _save_result(self, entry: Dict[str, Any], success: bool, result: str, lyrics: Optional[str]) -> None:
+        session_id = entry["session_id"]
+        if success:
+            session_manager.set_generated_music(session_id, result)
+        else:
+            session_manager.set_error_status(session_id)
+        self.store.set(f"generation:result:{session_id}", {
+            "success": success,
+            "music_url": result if success else None,
+            "error": None if success else result,
+            "lyrics": lyrics,
+            "chat_id": entry["chat_id"],
+            "prompt_hash": entry["prompt_hash"],
+            "completed_at": time.time(),
+        }, ttl=self.result_ttl)
+
+    def result(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """会话最近一次生成的结果（包括重启后恢复的）"""
+        return self.store.get(f"generation:result:{session_id}")
+
+    def _compact(self) -> None:
+        """重写日志文件，只保留未结束的条目（调用方需持有锁）"""
+        if self._file is None:
+            return
+        f, tmp_path, path = self._open()
+        for entry in self._entries.values():
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        old_file, old_path = self._file, self._path
+        self._file, self._path = f, path
+        old_file.close()
+        os.unlink(old_path)
+        self._synced = self._written
+        self._finished = 0
+        self._cond.notify_all()
+
+    @staticmethod
+    def _replay(f) -> List[Dict[str, Any]]:
+        """按条目id合并事件，返回未结束的条目；末尾未写完整的行忽略"""
+        entries: Dict[str, Dict[str, Any]] = {}
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("state") == "submitted":
+                entries[event["id"]] = event
+            else:
+                entries.pop(event.get("id"), None)
+        return list(entries.values())
+
+    def _adopt_orphans(self) -> List[Dict[str, Any]]:
+        """
+        接管已退出进程的日志：未结束条目写入本进程日志后删除原文件
+        本进程日志在接管过程中关闭（下线交接）时原文件保留在磁盘上，由其他进程接管
+        """
+        adopted = []
+        for path in glob.glob(os.path.join(self.directory, "journal-*.jsonl")):
+            if path == self._path:
+                continue
+            try:
+                f = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                # 拿不到锁说明写入进程仍在运行；文件已被其他进程接管删除时跳过
+                if not _lock(f) or os.fstat(f.fileno()).st_nlink == 0:
+                    continue
+                # 接管中途关闭的进程，条目会同时留在原文件和它自己的日志中，按id去重
+                with self._cond:
+                    entries = [entry for entry in self._replay(f) if entry["id"] not in self._entries]
+                for entry in entries:
+                    with self._cond:
+                        self._entries[entry["id"]] = entry
+                    if not self._append(entry, durable=True):
+                        with self._cond:
+                            for other in entries:
+                                self._entries.pop(other["id"], None)
+                        return adopted
+                os.unlink(path)
+            adopted.extend(entries)
+        # 创建过程中退出留下的临时文件
+        for path in glob.glob(os.path.join(self.directory, "journal-*.jsonl.tmp")):
+            with open(path, "a") as f:
+                if _lock(f):
+                    os.unlink(path)
+        return adopted
+
+    def start(self, resume: Resume, submit: Submit) -> None:
+        """启动时调用：立即接管一次遗留日志，之后在后台线程中周期性接管"""
+        if not self.enabled:
+            return
+        self.recover(resume, submit)
+        if self.adopt_interval > 0 and self._adopter is None:
+            self._adopter = threading.Thread(
+                target=self._adopt_loop, args=(resume, submit), name="generation-journal-adopt", daemon=True
+            )
+            self._adopter.start()
+
+    def _adopt_loop(self, resume: Resume, submit: Submit) -> None:
+        while True:
+            time.sleep(self.adopt_interval)
+            if self._closed:
+                return
+            try:
+                self.recover(resume, submit)
+            except Exception as e:
+                print(f"接管遗留生成日志失败: {e}")
+
+    def recover(self, resume: Resume, submit: Submit) -> int:
+        """
+        接管遗留日志，并通过submit把未结束对话的恢复轮询提交到生成调度器
+        返回恢复的条目数
+        """
+        if not self.enabled or self._closed or not os.path.isdir(self.directory):
+            return 0
+        now = time.time()
+        recovered = 0
+        for entry in self._adopt_orphans():
+            if now - entry["ts"] > self.max_age:
+                # 太旧的对话上游已不再保留结果
+                self.finished(entry["id"], False, "生成任务已过期", None)
+                GENERATION_RECOVERED.inc(result="expired")
+                continue
+            submit(lambda entry=entry: self._resume(entry, resume), entry["interface"])
+            recovered += 1
+        if recovered:
+            print(f"从生成日志恢复 {recovered} 个未完成的Coze对话")
+        return recovered
+
+    def _resume(self, entry: Dict[str, Any], resume: Resume) -> None:
+        try:
+            success, result, lyrics = resume(entry["chat_id"], entry["conversation_id"], entry.get("credential"))
+        except Exception as e:
+            success, result, lyrics = False, f"恢复生成失败: {e}", None
+        self.finished(entry["id"], success, result, lyrics)
+        GENERATION_RECOVERED.inc(result="success" if success else "failed")
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    def close(self) -> None:
+        """落盘剩余事件并停止写入；释放文件锁后未结束的条目由其他进程（或下次启动的进程）接管"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._synced = self._written
+                self._file.close()
+                if not self._entries:
+                    os.unlink(self._path)
+
+# 全局生成日志实例；GENERATION_JOURNAL_DIR为空（默认）时关闭，相对路径按启动时的工作目录解析
+_journal_dir = os.getenv("GENERATION_JOURNAL_DIR", "")
+generation_journal = GenerationJournal(
+    state_store,
+    directory=os.path.abspath(_journal_dir) if _journal_dir else "",
+    fsync_interval=float(os.getenv("GENERATION_JOURNAL_FSYNC_INTERVAL", 0.02)),
+    compact_every=int(os.getenv("GENERATION_JOURNAL_COMPACT_EVERY", 200)),
+    max_age=float(os.getenv("GENERATION_JOURNAL_MAX_AGE", 86400)),
+    result_ttl=float(os.getenv("GENERATION_RESULT_TTL", 86400)),
+    adopt_interval=float(os.getenv("GENERATION_JOURNAL_ADOPT_INTERVAL", 30)),
+)
+
+metrics.gauge(
+    "generation_journal_pending", "生成日志中尚未结束的Coze对话数",
+    callback=lambda: [((), generation_journal.pending())],
+)
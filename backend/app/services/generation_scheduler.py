@@ -0,0 +1,294 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.services.deadline import remaining, DeadlineExceeded
+from app.services.metrics import metrics, DEADLINE_EXCEEDED
+
+load_dotenv()
+
+# 优先级类别，数值越小越优先
+PRIORITY_CLASSES = {
+    "interactive": 0,   # 用户在页面上点击生成
+    "bulk": 1,          # 批量/多版本生成
+    "background": 2,    # 后台预热等
+}
+
+# 各类别的最长排队时间（秒），超过后无视优先级优先调度，防止饿死
+DEFAULT_MAX_WAIT = {
+    "interactive": 60.0,
+    "bulk": 180.0,
+    "background": 600.0,
+}
+
+# 请求截止后额外等待执行中任务的秒数（任务按同一截止时间自行结束，返回其失败结果而不是直接超时）
+DEADLINE_GRACE = float(os.getenv("GENERATION_DEADLINE_GRACE", 3))
+
+# 各接口的相对耗时权重（以30秒gen_bgm为1）
+INTERFACE_COST = {
+    "gen_bgm": 1.0,
+    "gen_song": 2.0,
+    "lyrics_gen_song": 3.0,
+}
+
+def estimate_cost(interface: str, duration: int) -> float:
+    """按接口类型和时长估算任务代价"""
+    return INTERFACE_COST.get(interface, 2.0) * max(int(duration or 30), 10) / 30.0
+
+class SchedulerClosed(RuntimeError):
+    """调度器已停止接收新任务"""
+
+class GenerationJob:
+    __slots__ = (
+        "seq", "user_id", "priority", "interface", "cost", "func", "context",
+        "future", "enqueued_at", "finish_tag", "dispatched",
+    )
+
+    def __init__(self, seq: int, user_id: str, priority: str, interface: str, cost: float,
+                 func: Callable[[], Any]):
+        self.seq = seq
+        self.user_id = user_id
+        self.priority = priority
+        self.interface = interface
+        self.cost = cost
+        self.func = func
+        # 在提交线程的上下文中执行任务，保证contextvars（如追踪信息）能传递到工作线程
+        self.context = contextvars.copy_context()
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.finish_tag = 0.0
+        self.dispatched = False
+
+class _ClassQueue:
+    """单个优先级类别内的公平队列（start-time fair queuing）"""
+
+    def __init__(self):
+        # (finish_tag, seq, job)：虚拟完成时间最小者先出队，短任务和少任务的用户自然靠前
+        self.heap: List[Tuple[float, int, GenerationJob]] = []
+        # 按到达顺序保存，用于饿死检测
+        self.arrivals: Deque[GenerationJob] = deque()
+        # 每个用户最后一个已排队任务的虚拟完成时间
+        self.user_finish: Dict[str, float] = {}
+        self.vclock = 0.0
+        self.size = 0
+
+    def push(self, job: GenerationJob) -> None:
+        start = max(self.vclock, self.user_finish.get(job.user_id, 0.0))
+        job.finish_tag = start + job.cost
+        self.user_finish[job.user_id] = job.finish_tag
+        heapq.heappush(self.heap, (job.finish_tag, job.seq, job))
+        self.arrivals.append(job)
+        self.size += 1
+
+    def oldest(self) -> Optional[GenerationJob]:
+        while self.arrivals and self.arrivals[0].dispatched:
+            self.arrivals.popleft()
+        return self.arrivals[0] if self.arrivals else None
+
+    def pop_fair(self) -> Optional[GenerationJob]:
+        while self.heap:
+            _, _, job = heapq.heappop(self.heap)
+            if not job.dispatched:
+                return job
+        return None
+
+    def mark_dispatched(self, job: GenerationJob) -> None:
+        job.dispatched = True
+        self.size -= 1
+        self.vclock = max(self.vclock, job.finish_tag - job.cost)
+        # 用户已没有排队中的任务时清理其虚拟时间，避免字典无限增长
+        if self.user_finish.get(job.user_id) == job.finish_tag:
+            del self.user_finish[job.user_id]
+
+class _WaitStats:
+    """排队等待时间统计（保留最近的样本用于分位数）"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = sorted(self.recent)
+
+        def pct(p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3) if samples else 0.0
+
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "max": round(self.max, 3),
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+        }
+
+class GenerationScheduler:
+    """
+    音乐生成任务调度器
+    - 优先级类别之间按严格优先级调度，但任何任务排队超过该类别的最长等待时间后会被优先执行
+    - 类别内部按用户公平排队，任务代价按接口类型和时长加权，短任务不会被长任务阻塞
+    - 固定数量的工作线程执行任务，事件循环只等待结果
+    """
+
+    def __init__(self, workers: int, max_wait: Dict[str, float]):
+        self.workers = workers
+        self.max_wait = max_wait
+        self._queues = {name: _ClassQueue() for name in PRIORITY_CLASSES}
+        self._wait_stats = {name: _WaitStats() for name in PRIORITY_CLASSES}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+        self._closed = False
+
+    def _ensure_workers(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"generation-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func: Callable[[], Any], user_id: str, interface: str, duration: int = 30,
+               priority: str = "interactive") -> Future:
+        """提交生成任务，返回concurrent.futures.Future"""
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"未知的优先级类别: {priority}")
+        with self._cond:
+            if self._closed:
+                raise SchedulerClosed("生成队列已停止接收新任务")
+            self._ensure_workers()
+            job = GenerationJob(next(self._seq), user_id, priority, interface,
+                                estimate_cost(interface, duration), func)
+            self._queues[priority].push(job)
+            self._cond.notify()
+        return job.future
+
+    async def run(self, func: Callable[[], Any], user_id: str, interface: str, duration: int = 30,
+                  priority: str = "interactive") -> Any:
+        """
+        在事件循环中提交任务并等待结果
+        请求有截止时间时最多等到截止时间（再留少量余量让执行中的任务按同一截止时间自行结束），
+        超时抛出DeadlineExceeded，仍在排队的任务被取消
+        """
+        future = asyncio.wrap_future(self.submit(func, user_id, interface, duration, priority))
+        left = remaining()
+        if left is None:
+            return await future
+        try:
+            return await asyncio.wait_for(future, max(left, 0.0) + DEADLINE_GRACE)
+        except asyncio.TimeoutError:
+            DEADLINE_EXCEEDED.inc(stage="generation")
+            raise DeadlineExceeded("generation")
+
+    def _pick(self, now: float) -> Optional[GenerationJob]:
+        """选择下一个任务（调用方需持有锁）"""
+        # 饿死保护：找出超时比例最大的类别最早到达的任务
+        overdue, overdue_ratio = None, 1.0
+        for name, queue in self._queues.items():
+            job = queue.oldest()
+            if job is None:
+                continue
+            ratio = (now - job.enqueued_at) / self.max_wait[name]
+            if ratio > overdue_ratio:
+                overdue, overdue_ratio = job, ratio
+        if overdue is not None:
+            return overdue
+
+        for name in sorted(PRIORITY_CLASSES, key=PRIORITY_CLASSES.get):
+            job = self._queues[name].pop_fair()
+            if job is not None:
+                return job
+        return None
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    job = self._pick(time.monotonic())
+                    if job is not None:
+                        break
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                self._queues[job.priority].mark_dispatched(job)
+                self._wait_stats[job.priority].observe(time.monotonic() - job.enqueued_at)
+                self._running += 1
+
+            if job.future.set_running_or_notify_cancel():
+                left = job.context.run(remaining)
+                if left is not None and left <= 0:
+                    # 排队期间请求已经超时：不再执行
+                    DEADLINE_EXCEEDED.inc(stage="generation_queue")
+                    job.future.set_exception(DeadlineExceeded("generation_queue"))
+                else:
+                    try:
+                        job.future.set_result(job.context.run(job.func))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        """停止接收新任务；已排队的任务仍会执行完毕"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def queued(self) -> int:
+        return sum(queue.size for queue in self._queues.values())
+
+    def running(self) -> int:
+        return self._running
+
+    def stats(self) -> Dict[str, Any]:
+        """各优先级类别的排队情况和等待时间统计"""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "classes": {
+                    name: {
+                        "queued": self._queues[name].size,
+                        "waiting_users": len(self._queues[name].user_finish),
+                        "max_wait": self.max_wait[name],
+                        "queue_wait_seconds": self._wait_stats[name].snapshot(),
+                    }
+                    for name in PRIORITY_CLASSES
+                },
+            }
+
+# 全局生成调度器实例
+generation_scheduler = GenerationScheduler(
+    workers=int(os.getenv("GENERATION_WORKERS", 4)),
+    max_wait={
+        name: float(os.getenv(f"SCHEDULER_MAX_WAIT_{name.upper()}", default))
+        for name, default in DEFAULT_MAX_WAIT.items()
+    },
+)
+
+metrics.gauge(
+    "generation_queue_depth", "生成队列中等待的任务数", ("priority",),
+    callback=lambda: [((name,), queue.size) for name, queue in generation_scheduler._queues.items()],
+)
+metrics.gauge(
+    "generation_running", "正在执行的生成任务数",
+    callback=lambda: [((), generation_scheduler.running())],
+)
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+from app.services.metrics import metrics
+
+load_dotenv()
+
+class ServiceDraining(Exception):
+    """服务正在下线，不再接收新的分析/生成请求，由main.py转换为503响应"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("服务正在重启，请稍后重试")
+        self.message = str(self)
+        self.retry_after = retry_after
+
+class DrainController:
+    """
+    滚动部署时的优雅下线
+    - 收到SIGTERM后立即进入draining：/ready返回503，准入控制拒绝新的分析/生成请求，状态查询和推送流照常服务
+    - 等待已准入的请求和生成队列中的任务完成，最长timeout秒
+    - 之后依次执行交接步骤（停止调度器、落盘生成日志等，未完成的Coze对话由其他进程接管），再通知uvicorn退出
+    """
+
+    def __init__(self, timeout: float, retry_after: int):
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._draining = False
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._idle_checks: List[Callable[[], bool]] = []
+        self._handoffs: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def draining(self) -> bool:
+        return self._draining
+
+    def add_idle_check(self, func: Callable[[], bool]) -> None:
+        """下线前需要等待的后台工作，func返回True表示已经空闲"""
+        self._idle_checks.append(func)
+
+    def add_handoff(self, func: Callable[[], None]) -> None:
+        """等待结束后（无论是否超时）执行的交接步骤，按注册顺序执行"""
+        self._handoffs.append(func)
+
+    @contextmanager
+    def track(self):
+        """标记一个进行中的请求；下线期间拒绝新请求"""
+        with self._lock:
+            if self._draining:
+                raise ServiceDraining(self.retry_after)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def idle(self) -> bool:
+        return self._in_flight == 0 and all(check() for check in self._idle_checks)
+
+    async def drain(self) -> bool:
+        """进入下线状态并等待进行中的工作完成，返回是否在超时前全部完成"""
+        with self._lock:
+            self._draining = True
+        print(f"开始优雅下线：进行中请求 {self._in_flight} 个，最长等待 {self.timeout}s")
+        deadline = time.monotonic() + self.timeout
+        while not self.idle() and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        finished = self.idle()
+        if not finished:
+            print(f"下线等待超时，仍有 {self._in_flight} 个请求未完成，未完成的生成交由其他进程恢复")
+        for handoff in self._handoffs:
+            try:
+                await asyncio.to_thread(handoff)
+            except Exception as e:
+                print(f"下线交接步骤失败 {handoff.__qualname__}: {e}")
+        return finished
+
+    def install_signal_handler(self) -> bool:
+        """
+        接管SIGTERM（需在事件循环中调用，uvicorn安装信号处理之后）
+        第一次SIGTERM开始下线，完成后向自身发送SIGINT交给uvicorn正常退出；下线期间再次收到SIGTERM立即退出
+        不支持loop.add_signal_handler的平台（Windows）返回False，保持uvicorn的默认行为
+        """
+        loop = asyncio.get_running_loop()
+
+        def exit_now():
+            os.kill(os.getpid(), signal.SIGINT)
+
+        def on_sigterm():
+            if self._task is not None:
+                exit_now()
+                return
+            self._task = loop.create_task(self.drain())
+            self._task.add_done_callback(lambda _: exit_now())
+
+        try:
+            loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        except (NotImplementedError, RuntimeError):
+            return False
+        return True
+
+# 全局下线控制器
+drain_controller = DrainController(
+    timeout=float(os.getenv("DRAIN_TIMEOUT", 90)),
+    retry_after=int(os.getenv("DRAIN_RETRY_AFTER", 5)),
+)
+
+metrics.gauge(
+    "service_draining", "服务是否处于优雅下线状态",
+    callback=lambda: [((), int(drain_controller.draining))],
+)
+metrics.gauge(
+    "in_flight_admitted_requests", "已通过准入控制、仍在处理中的请求数",
+    callback=lambda: [((), drain_controller.in_flight())],
+)
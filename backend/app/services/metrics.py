@@ -0,0 +1,228 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# 默认的延迟直方图分桶（秒），覆盖毫秒级解析到分钟级的Coze生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    """
+    指标基类：每个线程写入自己的分片，写路径不加锁；
+    只有线程第一次写入时注册分片需要加锁，采集时再合并所有分片
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _label_values(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _snapshot_shards(self) -> Iterator[Tuple[LabelValues, object]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # 其他线程可能正在写入该分片，复制失败时重试
+            while True:
+                try:
+                    items = list(shard.items())
+                    break
+                except RuntimeError:
+                    continue
+            yield from items
+
+    def collect(self) -> Iterable[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        shard = self._shard()
+        key = self._label_values(labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    def collect(self) -> Iterable[str]:
+        totals: Dict[LabelValues, float] = {}
+        for key, value in self._snapshot_shards():
+            totals[key] = totals.get(key, 0.0) + value
+        for key, value in sorted(totals.items()):
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        shard = self._shard()
+        key = self._label_values(labels)
+        state = shard.get(key)
+        if state is None:
+            # [各分桶计数..., +Inf计数, 总和]
+            state = [0] * (len(self.buckets) + 1) + [0.0]
+            shard[key] = state
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[Dict[str, object]]:
+        """
+        计时上下文，可在块内修改yield出的标签字典（如记录结果outcome）
+        with histogram.time(model=m) as labels: ...; labels["outcome"] = "ok"
+        """
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> Iterable[str]:
+        merged: Dict[LabelValues, List[float]] = {}
+        for key, state in self._snapshot_shards():
+            total = merged.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, value in enumerate(list(state)):
+                total[i] += value
+        for key, state in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-1]!r}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+class Gauge(_Metric):
+    """回调型仪表：采集时调用函数，返回 [(标签值元组, 数值)]"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Callable[[], Iterable[Tuple[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def collect(self) -> Iterable[str]:
+        try:
+            samples = list(self.callback()) if self.callback else []
+        except Exception as e:
+            print(f"⚠️ 采集指标 {self.name} 失败: {e}")
+            return
+        for key, value in samples:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              callback: Callable[[], Iterable[Tuple[LabelValues, float]]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        """输出Prometheus文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+# 全局指标注册表
+metrics = MetricsRegistry()
+
+# ---- 各流水线阶段使用的指标 ----
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_seconds", "API请求处理耗时", ("method", "route", "status"))
+DASHSCOPE_REQUEST_SECONDS = metrics.histogram(
+    "dashscope_request_seconds", "DashScope调用耗时", ("model", "input_type", "outcome"))
+LLM_JSON_PARSE_SECONDS = metrics.histogram(
+    "llm_json_parse_seconds", "LLM响应JSON清理与解析耗时", ("stage", "outcome"),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+AI_FALLBACK = metrics.counter(
+    "ai_fallback", "AI服务使用本地兜底结果的次数", ("kind",))
+DASHSCOPE_HEDGES = metrics.counter(
+    "dashscope_hedges", "DashScope对冲请求：fired为发出的对冲请求，won为对冲请求先返回，no_capacity为没有空闲并发名额而放弃对冲", ("route", "outcome"))
+DASHSCOPE_COST = metrics.counter(
+    "dashscope_cost", "按响应usage估算的DashScope调用费用（元）", ("route",))
+CREDENTIAL_REQUESTS = metrics.counter(
+    "credential_requests", "按凭据统计的上游请求（throttled为被限流或额度不足）", ("pool", "credential", "outcome"))
+DEADLINE_EXCEEDED = metrics.counter(
+    "deadline_exceeded", "因请求截止时间不足而放弃的处理步骤", ("stage",))
+ADAPTIVE_LIMIT_SHED = metrics.counter(
+    "adaptive_limit_shed", "超出自适应并发上限被拒绝的上游调用（queue_full为排队已满，timeout为排队超时）", ("upstream", "reason"))
+COZE_GENERATION_SECONDS = metrics.histogram(
+    "coze_generation_seconds", "Coze音乐生成总耗时", ("interface", "status"))
+COZE_POLL_ITERATIONS = metrics.histogram(
+    "coze_poll_iterations", "等待Coze对话完成的轮询次数", ("status",),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 150))
+COZE_PARSE_RESULT = metrics.counter(
+    "coze_parse_music_response", "_parse_music_response解析结果", ("outcome",))
+BCRYPT_SECONDS = metrics.histogram(
+    "bcrypt_seconds", "bcrypt哈希/校验耗时", ("operation",),
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0))
+ADMISSION_REJECTED = metrics.counter(
+    "admission_rejected", "被准入控制拒绝的请求数", ("endpoint", "reason"))
+WARM_POOL_REQUESTS = metrics.counter(
+    "warm_pool_requests", "gen_bgm请求命中预生成曲目池的情况", ("result",))
+WARM_POOL_GENERATIONS = metrics.counter(
+    "warm_pool_generations", "曲目池预热生成次数", ("status",))
+AUDIO_FETCH = metrics.counter(
+    "audio_fetch", "后台下载曲目到本地缓存的次数", ("status",))
+AUDIO_REQUESTS = metrics.counter(
+    "audio_requests", "音频请求是否命中本地缓存", ("result",))
+GENERATION_RECOVERED = metrics.counter(
+    "generation_recovered", "进程重启后从生成日志恢复的Coze对话", ("result",))
@@ -0,0 +1,332 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import requests
+from dotenv import load_dotenv
+from app.models.schemas import InputType
+from app.services.concurrency_limiter import LimiterSlot, dashscope_limiter
+from app.services.credential_pool import dashscope_credentials
+from app.services.deadline import budget
+from app.services.metrics import DASHSCOPE_HEDGES, DASHSCOPE_COST
+from app.services.rate_limiter import rate_limiter
+
+load_dotenv()
+
+# 单次DashScope调用的超时上限（秒），请求有截止时间时取两者中较小者
+REQUEST_TIMEOUT = float(os.getenv("DASHSCOPE_REQUEST_TIMEOUT", 60))
+
+# 账号额度类错误（欠费、配额用尽），比普通限流隔离更久
+QUOTA_ERROR_CODES = ("Arrearage", "Throttling.AllocationQuota")
+QUOTA_QUARANTINE = float(os.getenv("DASHSCOPE_QUOTA_QUARANTINE", 600))
+
+def throttle_seconds(response: requests.Response) -> Optional[float]:
+    """DashScope响应是否表示凭据被限流或额度不足：返回建议隔离秒数（0表示使用凭据池默认值），否则返回None"""
+    if response.status_code not in (400, 403, 429):
+        return None
+    try:
+        code = str(response.json().get("code") or "")
+    except ValueError:
+        code = ""
+    if code in QUOTA_ERROR_CODES:
+        return QUOTA_QUARANTINE
+    if response.status_code == 429 or code.startswith("Throttling"):
+        retry_after = response.headers.get("Retry-After", "")
+        return float(retry_after) if retry_after.isdigit() else 0.0
+    return None
+
+def overloaded(response: requests.Response) -> bool:
+    """响应是否表示上游过载（5xx或限流），用于收缩自适应并发上限"""
+    return response.status_code >= 500 or throttle_seconds(response) is not None
+
+def _prices(value: str) -> Tuple[float, float]:
+    """解析价格配置，格式 "输入单价,输出单价"（元/千tokens）"""
+    input_price, _, output_price = value.partition(",")
+    return float(input_price or 0), float(output_price or input_price or 0)
+
+class ModelRoute:
+    """一条模型路由：模型名、接口地址、计价，以及该路由最近的延迟样本和累计用量"""
+
+    def __init__(self, name: str, model: str, api_url: str, prices: Tuple[float, float], window: int):
+        self.name = name
+        self.model = model
+        self.api_url = api_url
+        self.input_price, self.output_price = prices
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < max(min_samples, 1):
+                return None
+            samples = sorted(self.latencies)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def take_hedge(self, max_ratio: float) -> bool:
+        """对冲预算：累计对冲数不超过请求数的max_ratio"""
+        with self._lock:
+            if self.hedged >= max_ratio * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def hedge_won(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def record(self, seconds: float, ok: bool, usage: Optional[Dict[str, Any]]) -> None:
+        """记录一次上游调用（包括被对冲请求取代、结果被丢弃的调用，它们同样消耗延迟和费用）"""
+        input_tokens = int((usage or {}).get("input_tokens") or 0)
+        output_tokens = int((usage or {}).get("output_tokens") or 0)
+        cost = (input_tokens * self.input_price + output_tokens * self.output_price) / 1000.0
+        with self._lock:
+            self.latencies.append(seconds)
+            self.errors += not ok
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cost += cost
+        if cost:
+            DASHSCOPE_COST.inc(cost, route=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        def pct(samples: List[float], p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3) if samples else 0.0
+
+        with self._lock:
+            samples = sorted(self.latencies)
+            return {
+                "model": self.model,
+                "requests": self.requests,
+                "errors": self.errors,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "latency": {"p50": pct(samples, 0.50), "p95": pct(samples, 0.95), "p99": pct(samples, 0.99)},
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "cost": round(self.cost, 4),
+            }
+
+class ModelRouter:
+    """
+    DashScope调用的模型路由和对冲请求
+    - 纯文本分析和最终提示词生成走text路由（更快更便宜的文本模型），图片分析走vision路由（VL模型）
+    - 请求耗时超过该路由最近延迟的hedge_quantile分位数时，再发一个相同的请求，先成功返回的为准，
+      另一个被丢弃；对冲请求数不超过总请求数的hedge_max_ratio，避免上游变慢时流量翻倍
+    - 对冲请求和普通请求一样占用自适应并发名额和跨worker上游名额，但不排队：没有空闲名额时放弃对冲
+    requests无法中断已发出的调用：落败请求若尚未发出则取消，已发出的在返回后立即关闭连接、丢弃结果
+    """
+
+    def __init__(self, routes: Dict[str, ModelRoute], hedge_quantile: float, hedge_min_samples: int,
+                 hedge_min_delay: float, hedge_max_ratio: float, workers: int):
+        self.routes = routes
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dashscope-hedge")
+
+    def route(self, name: str) -> ModelRoute:
+        return self.routes[name]
+
+    def route_for(self, input_type: InputType) -> ModelRoute:
+        return self.routes["vision" if input_type == InputType.IMAGE else "text"]
+
+    def hedge_delay(self, route: ModelRoute) -> Optional[float]:
+        """多久没有返回就发出对冲请求；样本不足或关闭对冲时返回None"""
+        if self.hedge_max_ratio <= 0:
+            return None
+        threshold = route.quantile(self.hedge_quantile, self.hedge_min_samples)
+        return None if threshold is None else max(threshold, self.hedge_min_delay)
+
+    def _attempt(self, route: ModelRoute, payload: Dict[str, Any], headers: Dict[str, str],
+                 cancelled: threading.Event) -> requests.Response:
+        """发送一次调用；凭据被限流时隔离该凭据并立即换下一个凭据重试（最多把凭据池轮一遍）"""
+        for retries_left in range(max(len(dashscope_credentials), 1) - 1, -1, -1):
+            with dashscope_credentials.lease() as credential:
+                start = time.perf_counter()
+                try:
+                    response = requests.post(
+                        route.api_url, headers={**headers, "Authorization": f"Bearer {credential.secret}"}, json=payload,
+                        timeout=budget("dashscope", REQUEST_TIMEOUT)
+                    )
+                except Exception:
+                    route.record(time.perf_counter() - start, False, None)
+                    raise
+                usage = None
+                if response.status_code == 200:
+                    try:
+                        usage = response.json().get("usage")
+                    except ValueError:
+                        pass
+                route.record(time.perf_counter() - start, response.status_code == 200, usage)
+                if response.status_code != 200:
+                    quarantine = throttle_seconds(response)
+                    if quarantine is None:
+                        credential.failed()
+                    else:
+                        credential.throttled(quarantine)
+                        if retries_left and not cancelled.is_set():
+                            response.close()
+                            continue
+            break
+        if cancelled.is_set():
+            response.close()
+        return response
+
+    def _reserve_hedge(self) -> Optional[Tuple[LimiterSlot, Optional[str]]]:
+        """为对冲请求占用自适应并发名额和跨worker上游名额，任一已满时返回None"""
+        slot = dashscope_limiter.try_acquire()
+        if slot is None:
+            return None
+        lease_id = None
+        if rate_limiter.upstream_caps.get("dashscope"):
+            lease_id = rate_limiter.acquire_upstream("dashscope")
+            if lease_id is None:
+                dashscope_limiter.release(slot, observe=False)
+                return None
+        return slot, lease_id
+
+    def _hedge_attempt(self, slot: LimiterSlot, route: ModelRoute, payload: Dict[str, Any],
+                       headers: Dict[str, str], cancelled: threading.Event) -> requests.Response:
+        try:
+            response = self._attempt(route, payload, headers, cancelled)
+        except Exception:
+            slot.dropped()
+            raise
+        if overloaded(response):
+            slot.dropped()
+        return response
+
+    def post(self, route: ModelRoute, payload: Dict[str, Any], headers: Dict[str, str]) -> requests.Response:
+        """
+        按路由发送一次非流式调用，必要时对冲；返回先成功的响应，都失败时返回最后一个响应或抛出最后一个异常
+        调用占用一个DashScope自适应并发名额，名额不足且排队失败时抛出UpstreamOverloaded
+        """
+        with dashscope_limiter.acquire() as slot:
+            response = self._post(route, payload, headers)
+            if overloaded(response):
+                slot.dropped()
+            return response
+
+    def _post(self, route: ModelRoute, payload: Dict[str, Any], headers: Dict[str, str]) -> requests.Response:
+        payload = {**payload, "model": route.model}
+        cancelled = threading.Event()
+        route.count_request()
+        delay = self.hedge_delay(route)
+        if delay is None:
+            return self._attempt(route, payload, headers, cancelled)
+
+        # 工作线程中保留调用方的contextvars（追踪等）
+        primary = self._executor.submit(
+            contextvars.copy_context().run, self._attempt, route, payload, headers, cancelled
+        )
+        attempts = [primary]
+        done, _ = wait(attempts, timeout=delay)
+        if not done:
+            reserved = self._reserve_hedge()
+            if reserved is None:
+                DASHSCOPE_HEDGES.inc(route=route.name, outcome="no_capacity")
+            elif not route.take_hedge(self.hedge_max_ratio):
+                self._release_hedge(reserved, observe=False)
+            else:
+                DASHSCOPE_HEDGES.inc(route=route.name, outcome="fired")
+                hedge = self._executor.submit(
+                    contextvars.copy_context().run, self._hedge_attempt, reserved[0], route, payload, headers, cancelled
+                )
+                # 对冲请求结束（或尚未发出就被取消）时归还名额
+                hedge.add_done_callback(lambda f: self._release_hedge(reserved, observe=not f.cancelled()))
+                attempts.append(hedge)
+
+        pending = set(attempts)
+        fallback: Optional[requests.Response] = None
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if response.status_code != 200:
+                    fallback = response
+                    continue
+                # 有结果了：丢弃另一个请求
+                cancelled.set()
+                for other in pending:
+                    other.cancel()
+                if future is not primary:
+                    route.hedge_won()
+                    DASHSCOPE_HEDGES.inc(route=route.name, outcome="won")
+                return response
+        if fallback is not None:
+            return fallback
+        raise error
+
+    @staticmethod
+    def _release_hedge(reserved: Tuple[LimiterSlot, Optional[str]], observe: bool = True) -> None:
+        slot, lease_id = reserved
+        dashscope_limiter.release(slot, observe=observe)
+        if lease_id:
+            rate_limiter.release_upstream("dashscope", lease_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedge": {
+                "quantile": self.hedge_quantile,
+                "min_samples": self.hedge_min_samples,
+                "min_delay": self.hedge_min_delay,
+                "max_ratio": self.hedge_max_ratio,
+            },
+            "routes": {name: route.stats() for name, route in self.routes.items()},
+        }
+
+_vision_url = os.getenv(
+    "DASHSCOPE_API_URL",
+    "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation",
+)
+_vision_model = os.getenv("DASHSCOPE_MODEL", "qwen-vl-max")
+_text_model = os.getenv("DASHSCOPE_TEXT_MODEL", "qwen-plus")
+_window = int(os.getenv("DASHSCOPE_LATENCY_WINDOW", 200))
+
+# 全局模型路由；DASHSCOPE_TEXT_MODEL配置为与DASHSCOPE_MODEL相同时文本请求仍走VL模型和多模态接口
+model_router = ModelRouter(
+    routes={
+        "text": ModelRoute(
+            "text",
+            model=_text_model,
+            api_url=os.getenv("DASHSCOPE_TEXT_API_URL") or (
+                _vision_url if _text_model == _vision_model
+                else _vision_url.replace("multimodal-generation", "text-generation")
+            ),
+            prices=_prices(os.getenv("DASHSCOPE_TEXT_PRICE", "0.0008,0.002")),
+            window=_window,
+        ),
+        "vision": ModelRoute(
+            "vision",
+            model=_vision_model,
+            api_url=_vision_url,
+            prices=_prices(os.getenv("DASHSCOPE_VL_PRICE", "0.003,0.009")),
+            window=_window,
+        ),
+    },
+    hedge_quantile=float(os.getenv("DASHSCOPE_HEDGE_QUANTILE", 0.95)),
+    hedge_min_samples=int(os.getenv("DASHSCOPE_HEDGE_MIN_SAMPLES", 20)),
+    hedge_min_delay=float(os.getenv("DASHSCOPE_HEDGE_MIN_DELAY", 0.5)),
+    hedge_max_ratio=float(os.getenv("DASHSCOPE_HEDGE_MAX_RATIO", 0.1)),
+    workers=int(os.getenv("DASHSCOPE_HEDGE_WORKERS", 16)),
+)
@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List
+
+# 单次采样的最长时间，避免误操作长时间占用CPU
+MAX_PROFILE_SECONDS = 120
+
+class ProfilerBusy(RuntimeError):
+    """已有采样任务在运行"""
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", code.co_filename)
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+def _format_stack(frame) -> List[str]:
+    """从栈顶到栈底的帧描述列表"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_filename}:{frame.f_lineno} in {code.co_name}")
+        frame = frame.f_back
+    return stack
+
+class SamplingProfiler:
+    """
+    基于sys._current_frames()的采样分析器
+    - 只在调用profile()期间由一个后台线程周期性抓取所有线程的调用栈，平时没有任何开销
+    - 输出collapsed-stack格式（每行 "线程;帧1;帧2;... 次数"），可直接交给flamegraph.pl/speedscope
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.005) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("已有采样任务在运行")
+        try:
+            return self._sample(min(max(seconds, 0.1), MAX_PROFILE_SECONDS), max(interval, 0.001))
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float) -> str:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_label(frame))
+                    frame = frame.f_back
+                frames.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+def dump_threads() -> List[Dict[str, Any]]:
+    """所有线程当前的调用栈"""
+    frames = sys._current_frames()
+    return [
+        {
+            "name": thread.name,
+            "ident": thread.ident,
+            "daemon": thread.daemon,
+            "stack": _format_stack(frames.get(thread.ident)),
+        }
+        for thread in threading.enumerate()
+    ]
+
+def dump_tasks() -> List[Dict[str, Any]]:
+    """当前事件循环中所有asyncio任务的挂起位置（需在事件循环线程中调用）"""
+    tasks = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        tasks.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "done": task.done(),
+            "stack": [
+                f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+                for frame in task.get_stack()
+            ],
+        })
+    return tasks
+
+class HeapSnapshots:
+    """
+    tracemalloc快照管理：按需开启追踪、保存编号快照、对任意两个快照做差异比较
+    未开启时tracemalloc完全不参与内存分配
+    """
+
+    def __init__(self, max_snapshots: int = 8):
+        self.max_snapshots = max_snapshots
+        self._snapshots: "OrderedDict[int, tracemalloc.Snapshot]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, frames: int = 25) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+        tracemalloc.stop()
+
+    def status(self) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with self._lock:
+            snapshot_ids = list(self._snapshots)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "snapshots": snapshot_ids,
+        }
+
+    def take(self) -> int:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc未开启，请先调用start")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        with self._lock:
+            snapshot_id = next(self._ids)
+            self._snapshots[snapshot_id] = snapshot
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def _get(self, snapshot_id: int) -> tracemalloc.Snapshot:
+        with self._lock:
+            snapshot = self._snapshots.get(snapshot_id)
+        if snapshot is None:
+            raise KeyError(f"快照 {snapshot_id} 不存在")
+        return snapshot
+
+    def top(self, snapshot_id: int, limit: int = 20, key_type: str = "lineno") -> List[Dict[str, Any]]:
+        stats = self._get(snapshot_id).statistics(key_type)
+        return [
+            {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in stats[:limit]
+        ]
+
+    def diff(self, base_id: int, target_id: int, limit: int = 20, key_type: str = "lineno") -> List[Dict[str, Any]]:
+        stats = self._get(target_id).compare_to(self._get(base_id), key_type)
+        return [
+            {
+                "location": str(stat.traceback),
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+            }
+            for stat in stats[:limit]
+        ]
+
+# 全局实例
+sampling_profiler = SamplingProfiler()
+heap_snapshots = HeapSnapshots()
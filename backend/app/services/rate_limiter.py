@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from app.services.credential_pool import dashscope_credentials, coze_credentials
+from app.services.state_store import StateStore, state_store
+
+load_dotenv()
+
+def _parse_rate(spec: str) -> Optional[Tuple[int, float]]:
+    """解析 "次数/秒数" 格式的限流配置，0或空表示不限流"""
+    spec = (spec or "").strip()
+    if not spec or spec == "0":
+        return None
+    count, _, period = spec.partition("/")
+    return int(count), float(period or 60)
+
+# 各端点默认的令牌桶配置: 桶容量/补满所需秒数，可通过 RATE_LIMIT_<端点名> 覆盖
+DEFAULT_ENDPOINT_RATES = {
+    "analyze_text": "30/60",
+    "analyze_image": "10/60",
+    "analyze_batch": "2/60",
+    "generate": "5/60",
+    "generate_variants": "2/60",
+}
+
+# 各上游每个账号凭据的全局并发上限（跨worker），总上限按凭据池大小放大，可通过 <上游名>_MAX_CONCURRENCY 直接覆盖总上限
+DEFAULT_UPSTREAM_CONCURRENCY = {
+    "dashscope": 16,
+    "coze": 32,
+}
+
+class Admission:
+    """一次准入结果；allowed为False时retry_after给出建议的重试秒数"""
+
+    def __init__(self, allowed: bool, retry_after: float = 0.0, reason: str = "",
+                 limiter: Optional["RateLimiter"] = None, upstream: Optional[str] = None,
+                 lease_id: Optional[str] = None):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.reason = reason
+        self._limiter = limiter
+        self._upstream = upstream
+        self._lease_id = lease_id
+
+    def release(self) -> None:
+        """归还上游并发名额（可重复调用）"""
+        if self._limiter and self._upstream and self._lease_id:
+            self._limiter.release_upstream(self._upstream, self._lease_id)
+            self._lease_id = None
+
+class RateLimiter:
+    """
+    基于共享状态存储的准入控制
+    - 按 用户/IP × 端点 的令牌桶限流
+    - 按上游（DashScope、Coze）的全局并发上限，名额以带过期时间的租约保存，
+      worker崩溃后租约会自动过期，不会永久占用名额
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self.endpoint_rates: Dict[str, Optional[Tuple[int, float]]] = {
+            name: _parse_rate(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+            for name, default in DEFAULT_ENDPOINT_RATES.items()
+        }
+        pool_sizes = {"dashscope": len(dashscope_credentials or ()), "coze": len(coze_credentials or ())}
+        self.upstream_caps: Dict[str, int] = {
+            name: int(os.getenv(f"{name.upper()}_MAX_CONCURRENCY") or default * max(pool_sizes.get(name, 1), 1))
+            for name, default in DEFAULT_UPSTREAM_CONCURRENCY.items()
+        }
+        # 并发租约的最长持有时间，需覆盖最慢的上游调用（Coze轮询最长300秒）
+        self.lease_ttl = float(os.getenv("UPSTREAM_LEASE_TTL", 360))
+
+    def take_token(self, endpoint: str, client_id: str) -> Tuple[bool, float]:
+        """
+        从令牌桶取一个令牌
+        返回: (是否允许, 需要等待的秒数)
+        """
+        rate = self.endpoint_rates.get(endpoint)
+        if not rate:
+            return True, 0.0
+        capacity, period = rate
+        refill_per_sec = capacity / period
+        now = time.time()
+        result = {}
+
+        def refill(bucket):
+            tokens, last = (bucket["tokens"], bucket["ts"]) if bucket else (float(capacity), now)
+            tokens = min(float(capacity), tokens + (now - last) * refill_per_sec)
+            if tokens >= 1.0:
+                result["allowed"] = True
+                tokens -= 1.0
+            else:
+                result["allowed"] = False
+                result["wait"] = (1.0 - tokens) / refill_per_sec
+            return {"tokens": tokens, "ts": now}
+
+        # 桶在period内无访问即可过期，此时重新创建的桶本来就是满的
+        self.store.update(f"ratelimit:{endpoint}:{client_id}", refill, ttl=period)
+        return result["allowed"], result.get("wait", 0.0)
+
+    def refund_token(self, endpoint: str, client_id: str) -> None:
+        """退还take_token取走的令牌（请求最终未被放行时）"""
+        rate = self.endpoint_rates.get(endpoint)
+        if not rate:
+            return
+        capacity, period = rate
+
+        def refund(bucket):
+            if not bucket:
+                return None
+            return {"tokens": min(float(capacity), bucket["tokens"] + 1.0), "ts": bucket["ts"]}
+
+        self.store.update(f"ratelimit:{endpoint}:{client_id}", refund, ttl=period)
+
+    def acquire_upstream(self, upstream: str) -> Optional[str]:
+        """申请上游并发名额，成功返回租约ID，已满返回None"""
+        cap = self.upstream_caps.get(upstream)
+        if not cap:
+            return None
+        return self.acquire_lease(f"concurrency:{upstream}", cap)
+
+    def release_upstream(self, upstream: str, lease_id: str) -> None:
+        self.release_lease(f"concurrency:{upstream}", lease_id)
+
+    def acquire_lease(self, key: str, cap: int) -> Optional[str]:
+        """在key下申请一个并发租约（最多cap个），成功返回租约ID，已满返回None"""
+        lease_id = uuid.uuid4().hex
+        now = time.time()
+        result = {}
+
+        def acquire(leases):
+            # 先剔除过期租约
+            leases = {k: exp for k, exp in (leases or {}).items() if exp > now}
+            if len(leases) < cap:
+                leases[lease_id] = now + self.lease_ttl
+                result["ok"] = True
+            return leases
+
+        self.store.update(key, acquire)
+        return lease_id if result.get("ok") else None
+
+    def renew_lease(self, key: str, lease_id: str) -> bool:
+        """把仍然有效的租约续期lease_ttl秒，租约已过期或不存在时返回False"""
+        now = time.time()
+        result = {}
+
+        def renew(leases):
+            if leases and leases.get(lease_id, 0) > now:
+                leases[lease_id] = now + self.lease_ttl
+                result["ok"] = True
+            return leases or None
+
+        self.store.update(key, renew)
+        return bool(result.get("ok"))
+
+    def release_lease(self, key: str, lease_id: str) -> None:
+        def release(leases):
+            if leases:
+                leases.pop(lease_id, None)
+            return leases or None
+
+        self.store.update(key, release)
+
+    def admit(self, endpoint: str, client_id: str, upstream: Optional[str] = None) -> Admission:
+        """端点限流 + 上游并发检查，全部通过才放行"""
+        allowed, wait = self.take_token(endpoint, client_id)
+        if not allowed:
+            return Admission(False, retry_after=wait, reason="请求过于频繁")
+
+        if upstream and self.upstream_caps.get(upstream):
+            lease_id = self.acquire_upstream(upstream)
+            if not lease_id:
+                # 上游繁忙被拒绝的请求不消耗用户的限流额度
+                self.refund_token(endpoint, client_id)
+                return Admission(False, retry_after=float(os.getenv("UPSTREAM_BUSY_RETRY_AFTER", 5)),
+                                 reason="服务繁忙")
+            return Admission(True, limiter=self, upstream=upstream, lease_id=lease_id)
+
+        return Admission(True)
+
+# 全局限流器实例
+rate_limiter = RateLimiter(state_store)
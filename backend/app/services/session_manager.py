@@ -1,83 +1,339 @@
+import bisect
+import heapq
+import sys
+import threading
+import time
 import uuid
 from datetime import datetime
-from typing import Dict, Optional
-from app.models.schemas import Session, SessionStatus, UserInput, AIAnalysis, ClarificationResponse, MusicPrompt
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from app.models.schemas import (
+    Session, SessionStatus, UserInput, InputType, AIAnalysis,
+    ClarificationQuestion, ClarificationResponse, MusicPrompt
+)
+from app.services.metrics import metrics
+
+# 内部时间戳使用单调时钟，仅在API边界换算为墙上时间
+_WALL_EPOCH = time.time()
+_MONO_EPOCH = time.monotonic()
+
+def monotonic_to_wall(ts: float) -> float:
+    """单调时间戳换算为Unix时间戳"""
+    return _WALL_EPOCH + (ts - _MONO_EPOCH)
+
+def wall_to_monotonic(ts: float) -> float:
+    """Unix时间戳换算为单调时间戳"""
+    return _MONO_EPOCH + (ts - _WALL_EPOCH)
+
+def iso_to_monotonic(value: str) -> float:
+    """ISO格式时间字符串换算为单调时间戳，格式错误时抛出ValueError"""
+    return wall_to_monotonic(datetime.fromisoformat(value).timestamp())
+
+def _format_ts(ts: float) -> str:
+    return datetime.fromtimestamp(monotonic_to_wall(ts)).isoformat()
+
+# 排序键: (created_at, session_id)，保证同一时间创建的会话也有确定顺序
+SortKey = Tuple[float, str]
+# 澄清问题: (question, options, question_id)
+QuestionTuple = Tuple[str, Tuple[str, ...], str]
+
+class SessionRecord:
+    """
+    会话的内部紧凑表示
+    只保存元组和驻留字符串，不持有pydantic模型；需要对外返回时再转换为Session
+    """
+    __slots__ = (
+        "session_id", "status", "input_type", "text_content", "image_filename",
+        "understanding", "music_elements", "needs_clarification", "questions",
+        "clarifications", "final_prompt", "generated_music_url",
+        "created_at", "updated_at",
+    )
+
+    def __init__(self, session_id: str, user_input: UserInput, now: float):
+        self.session_id = session_id
+        self.status = SessionStatus.INITIAL
+        self.input_type: InputType = user_input.input_type
+        self.text_content: Optional[str] = user_input.text_content
+        self.image_filename: Optional[str] = user_input.image_filename
+        # AI分析结果，understanding为None表示尚未分析
+        self.understanding: Optional[str] = None
+        self.music_elements: Optional[Dict[str, Any]] = None
+        self.needs_clarification = False
+        self.questions: Optional[Tuple[QuestionTuple, ...]] = None
+        # 澄清回答: [(question_id, selected_option)]
+        self.clarifications: List[Tuple[str, str]] = []
+        # 最终提示词只保存非空字段
+        self.final_prompt: Optional[Dict[str, Any]] = None
+        self.generated_music_url: Optional[str] = None
+        self.created_at = now
+        self.updated_at = now
+
+    @property
+    def sort_key(self) -> SortKey:
+        return (self.created_at, self.session_id)
+
+    @property
+    def answered_count(self) -> int:
+        return len(self.clarifications)
+
+    def to_user_input(self) -> UserInput:
+        return UserInput.model_construct(
+            session_id=self.session_id,
+            input_type=self.input_type,
+            text_content=self.text_content,
+            image_filename=self.image_filename,
+        )
+
+    def to_ai_analysis(self) -> Optional[AIAnalysis]:
+        if self.understanding is None:
+            return None
+        questions = None
+        if self.questions is not None:
+            questions = [
+                ClarificationQuestion.model_construct(question=q, options=list(options), question_id=qid)
+                for q, options, qid in self.questions
+            ]
+        return AIAnalysis.model_construct(
+            understanding=self.understanding,
+            music_elements=self.music_elements,
+            needs_clarification=self.needs_clarification,
+            clarification_questions=questions,
+        )
+
+    def to_final_prompt(self) -> Optional[MusicPrompt]:
+        if self.final_prompt is None:
+            return None
+        # 每次构造新模型，下游的参数修复不会改动已保存的提示词
+        return MusicPrompt.model_construct(**self.final_prompt)
+
+    def to_session(self) -> Session:
+        """转换为对外的pydantic Session（仅在API边界调用）"""
+        return Session.model_construct(
+            session_id=self.session_id,
+            status=self.status,
+            original_input=self.to_user_input(),
+            ai_analysis=self.to_ai_analysis(),
+            clarification_history=[
+                ClarificationResponse.model_construct(
+                    session_id=self.session_id, question_id=qid, selected_option=option
+                )
+                for qid, option in self.clarifications
+            ],
+            final_prompt=self.to_final_prompt(),
+            generated_music_url=self.generated_music_url,
+            created_at=_format_ts(self.created_at),
+            updated_at=_format_ts(self.updated_at),
+        )
+
+    def to_session_data(self) -> Dict[str, Any]:
+        """构建AI服务生成提示词所需的会话数据"""
+        analysis = self.to_ai_analysis()
+        return {
+            "original_input": self.to_user_input().model_dump(),
+            "ai_analysis": analysis.model_dump() if analysis else {},
+            "clarification_history": [
+                {"session_id": self.session_id, "question_id": qid, "selected_option": option}
+                for qid, option in self.clarifications
+            ],
+        }
 
 class SessionManager:
     def __init__(self):
-        self.sessions: Dict[str, Session] = {}
-    
+        self.sessions: Dict[str, SessionRecord] = {}
+        # 二级索引：按创建时间排序的键列表 + 按状态分桶
+        self._created_index: List[SortKey] = []
+        self._status_index: Dict[SessionStatus, Dict[str, SortKey]] = {
+            status: {} for status in SessionStatus
+        }
+        self._lock = threading.RLock()
+
     def create_session(self, user_input: UserInput) -> str:
         """创建新会话"""
         session_id = str(uuid.uuid4())
-        current_time = datetime.now().isoformat()
-        
-        session = Session(
-            session_id=session_id,
-            status=SessionStatus.INITIAL,
-            original_input=user_input,
-            created_at=current_time,
-            updated_at=current_time
-        )
-        
-        self.sessions[session_id] = session
+        record = SessionRecord(session_id, user_input, time.monotonic())
+
+        sort_key = record.sort_key
+        with self._lock:
+            self.sessions[session_id] = record
+            # 单调时钟下总是按顺序追加，O(1)
+            if not self._created_index or self._created_index[-1] <= sort_key:
+                self._created_index.append(sort_key)
+            else:
+                bisect.insort(self._created_index, sort_key)
+            self._status_index[record.status][session_id] = sort_key
         return session_id
-    
-    def get_session(self, session_id: str) -> Optional[Session]:
-        """获取会话信息"""
+
+    def get_record(self, session_id: str) -> Optional[SessionRecord]:
+        """获取会话的内部记录（服务内部使用，不要直接返回给客户端）"""
         return self.sessions.get(session_id)
-    
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        """获取会话信息（转换为对外的Session模型）"""
+        record = self.sessions.get(session_id)
+        return record.to_session() if record else None
+
+    def _set_status(self, record: SessionRecord, status: SessionStatus) -> None:
+        """修改会话状态并同步状态索引（调用方需持有锁）"""
+        if record.status is status:
+            return
+        sort_key = self._status_index[record.status].pop(record.session_id)
+        self._status_index[status][record.session_id] = sort_key
+        record.status = status
+
     def update_session_status(self, session_id: str, status: SessionStatus) -> bool:
         """更新会话状态"""
-        if session_id in self.sessions:
-            self.sessions[session_id].status = status
-            self.sessions[session_id].updated_at = datetime.now().isoformat()
-            return True
+        with self._lock:
+            record = self.sessions.get(session_id)
+            if record:
+                self._set_status(record, status)
+                record.updated_at = time.monotonic()
+                return True
         return False
-    
+
     def update_ai_analysis(self, session_id: str, analysis: AIAnalysis) -> bool:
         """更新AI分析结果"""
-        if session_id in self.sessions:
-            self.sessions[session_id].ai_analysis = analysis
-            self.sessions[session_id].updated_at = datetime.now().isoformat()
-            if analysis.needs_clarification:
-                self.sessions[session_id].status = SessionStatus.CLARIFYING
-            return True
+        questions = None
+        if analysis.clarification_questions is not None:
+            # 问题与选项大多来自固定模板，驻留后各会话共享同一份字符串
+            questions = tuple(
+                (sys.intern(q.question), tuple(sys.intern(o) for o in q.options), sys.intern(q.question_id))
+                for q in analysis.clarification_questions
+            )
+        with self._lock:
+            record = self.sessions.get(session_id)
+            if record:
+                record.understanding = analysis.understanding
+                record.music_elements = analysis.music_elements
+                record.needs_clarification = analysis.needs_clarification
+                record.questions = questions
+                record.updated_at = time.monotonic()
+                if analysis.needs_clarification:
+                    self._set_status(record, SessionStatus.CLARIFYING)
+                return True
         return False
-    
+
     def add_clarification_response(self, session_id: str, response: ClarificationResponse) -> bool:
         """添加澄清回答"""
-        if session_id in self.sessions:
-            self.sessions[session_id].clarification_history.append(response)
-            self.sessions[session_id].updated_at = datetime.now().isoformat()
-            return True
+        entry = (sys.intern(response.question_id), sys.intern(response.selected_option))
+        with self._lock:
+            record = self.sessions.get(session_id)
+            if record:
+                record.clarifications.append(entry)
+                record.updated_at = time.monotonic()
+                return True
         return False
-    
+
     def set_final_prompt(self, session_id: str, prompt: MusicPrompt) -> bool:
         """设置最终音乐提示词"""
-        if session_id in self.sessions:
-            self.sessions[session_id].final_prompt = prompt
-            self.sessions[session_id].status = SessionStatus.GENERATING
-            self.sessions[session_id].updated_at = datetime.now().isoformat()
-            return True
+        compact = prompt.model_dump(exclude_none=True)
+        with self._lock:
+            record = self.sessions.get(session_id)
+            if record:
+                record.final_prompt = compact
+                self._set_status(record, SessionStatus.GENERATING)
+                record.updated_at = time.monotonic()
+                return True
         return False
-    
+
     def set_generated_music(self, session_id: str, music_url: str) -> bool:
         """设置生成的音乐文件URL"""
-        if session_id in self.sessions:
-            self.sessions[session_id].generated_music_url = music_url
-            self.sessions[session_id].status = SessionStatus.COMPLETED
-            self.sessions[session_id].updated_at = datetime.now().isoformat()
-            return True
+        with self._lock:
+            record = self.sessions.get(session_id)
+            if record:
+                record.generated_music_url = music_url
+                self._set_status(record, SessionStatus.COMPLETED)
+                record.updated_at = time.monotonic()
+                return True
         return False
-    
+
     def set_error_status(self, session_id: str) -> bool:
         """设置错误状态"""
-        if session_id in self.sessions:
-            self.sessions[session_id].status = SessionStatus.ERROR
-            self.sessions[session_id].updated_at = datetime.now().isoformat()
-            return True
+        with self._lock:
+            record = self.sessions.get(session_id)
+            if record:
+                self._set_status(record, SessionStatus.ERROR)
+                record.updated_at = time.monotonic()
+                return True
         return False
 
+    def count_sessions(self, status: Optional[SessionStatus] = None) -> int:
+        """统计会话数量（可按状态）"""
+        if status is None:
+            return len(self.sessions)
+        return len(self._status_index[status])
+
+    def list_sessions(
+        self,
+        statuses: Optional[Iterable[SessionStatus]] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        cursor: Optional[SortKey] = None,
+        limit: int = 50,
+    ) -> Tuple[List[SessionRecord], Optional[SortKey]]:
+        """
+        按创建时间游标分页列出会话（时间参数和游标为单调时间戳）
+        返回: (本页会话记录列表, 下一页游标；没有更多时为None)
+        """
+        limit = max(1, limit)
+        with self._lock:
+            # 下界：游标与created_after取较大者
+            lower: SortKey = (float("-inf"), "")
+            if created_after is not None:
+                lower = (created_after, "")
+            if cursor:
+                # 游标指向的会话仍在时使用其精确排序键；否则（如游标来自其他worker）墙上时间换算有浮点误差，
+                # 往前放宽1微秒，宁可重复一条也不遗漏
+                record = self.sessions.get(cursor[1])
+                cursor = record.sort_key if record is not None else (cursor[0] - 1e-6, "")
+            if cursor and cursor > lower:
+                lower = (cursor[0], cursor[1] + "\x00")
+            upper: Optional[SortKey] = (created_before, "") if created_before is not None else None
+
+            if statuses is None:
+                # 无状态过滤：直接在有序索引上二分定位，O(log n + limit)
+                start = bisect.bisect_left(self._created_index, lower)
+                end = bisect.bisect_left(self._created_index, upper) if upper else len(self._created_index)
+                keys = self._created_index[start:min(end, start + limit + 1)]
+            else:
+                # 有状态过滤：只扫描对应状态桶，取最小的limit+1个，O(k log limit)
+                candidates = (
+                    key
+                    for status in set(statuses)
+                    for key in self._status_index[status].values()
+                    if key >= lower and (upper is None or key < upper)
+                )
+                keys = heapq.nsmallest(limit + 1, candidates)
+
+            page = [self.sessions[key[1]] for key in keys[:limit]]
+
+        next_cursor = keys[limit - 1] if len(keys) > limit else None
+        return page, next_cursor
+
+    def iter_sessions(
+        self,
+        statuses: Optional[Iterable[SessionStatus]] = None,
+        created_after: Optional[float] = None,
+        created_before: Optional[float] = None,
+        batch_size: int = 500,
+    ) -> Iterator[SessionRecord]:
+        """按创建时间分批遍历会话，每批只持有batch_size个引用，内存占用恒定"""
+        statuses = list(statuses) if statuses is not None else None
+        cursor: Optional[SortKey] = None
+        while True:
+            page, cursor = self.list_sessions(
+                statuses=statuses,
+                created_after=created_after,
+                created_before=created_before,
+                cursor=cursor,
+                limit=batch_size,
+            )
+            yield from page
+            if cursor is None:
+                return
+
 # 全局会话管理器实例
 session_manager = SessionManager()
+
+metrics.gauge(
+    "sessions", "内存中的会话数量", ("status",),
+    callback=lambda: [((status.value,), session_manager.count_sessions(status)) for status in SessionStatus],
+)
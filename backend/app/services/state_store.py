@@ -0,0 +1,200 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class StateStore(ABC):
+    """
+    可插拔的键值状态存储接口；缺少任一方法的实现在实例化时即报错
+    值需可JSON序列化；ttl单位为秒，None表示不过期
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """仅当键不存在（或已过期）时写入，返回是否写入成功"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def update(self, key: str, func: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        """
+        原子地读-改-写：func接收旧值（不存在时为None）并返回新值
+        新值为None时删除该键；返回新值
+        """
+
+class MemoryStateStore(StateStore):
+    """进程内状态存储（单worker或本地开发使用）"""
+
+    def __init__(self, sweep_every: int = 1000):
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+        self._sweep_every = sweep_every
+
+    def _live(self, key: str, now: float) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= now:
+            del self._data[key]
+            return None
+        return value
+
+    def _maybe_sweep(self, now: float) -> None:
+        # 周期性清理过期键，避免只写不读的键无限增长
+        self._ops += 1
+        if self._ops % self._sweep_every:
+            return
+        expired = [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]
+        for k in expired:
+            del self._data[k]
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._data[key] = (value, now + ttl if ttl else None)
+            self._maybe_sweep(now)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = (value, now + ttl if ttl else None)
+            self._maybe_sweep(now)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def update(self, key: str, func: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        now = time.time()
+        with self._lock:
+            new_value = func(self._live(key, now))
+            if new_value is None:
+                self._data.pop(key, None)
+            else:
+                self._data[key] = (new_value, now + ttl if ttl else None)
+            self._maybe_sweep(now)
+            return new_value
+
+class SQLiteStateStore(StateStore):
+    """
+    基于SQLite文件的状态存储
+    同一主机上的多个uvicorn worker共享同一个文件即可共享状态（限流、幂等键等）
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv_state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_state_expires ON kv_state(expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None 由我们显式管理事务
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _expiry(ttl: Optional[float]) -> Optional[float]:
+        return time.time() + ttl if ttl else None
+
+    def _read(self, conn: sqlite3.Connection, key: str) -> Optional[Any]:
+        row = conn.execute(
+            "SELECT value FROM kv_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._read(self._connect(), key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO kv_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), self._expiry(ttl)),
+        )
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM kv_state WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO kv_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), self._expiry(ttl)),
+            )
+            conn.execute("COMMIT")
+            return cursor.rowcount == 1
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM kv_state WHERE key = ?", (key,))
+
+    def update(self, key: str, func: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        conn = self._connect()
+        # BEGIN IMMEDIATE 立即获取写锁，保证跨进程的读-改-写原子性
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            new_value = func(self._read(conn, key))
+            if new_value is None:
+                conn.execute("DELETE FROM kv_state WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO kv_state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(new_value, ensure_ascii=False), self._expiry(ttl)),
+                )
+            conn.execute("COMMIT")
+            return new_value
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def create_state_store(url: Optional[str] = None) -> StateStore:
+    """
+    根据 STATE_STORE_URL 创建状态存储
+    - memory://           进程内存储（默认）
+    - sqlite:///path.db   本机多worker共享的SQLite文件
+    """
+    url = url or os.getenv("STATE_STORE_URL", "memory://")
+    if url.startswith("sqlite:///"):
+        return SQLiteStateStore(url[len("sqlite:///"):])
+    if url.startswith("memory://"):
+        return MemoryStateStore()
+    raise RuntimeError(f"不支持的STATE_STORE_URL: {url}")
+
+# 全局状态存储实例
+state_store = create_state_store()
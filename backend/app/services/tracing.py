@@ -0,0 +1,302 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# OTLP中的span类型
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+# OTLP中的状态码
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+def _new_id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class _Trace:
+    """一条链路在本进程内的缓冲：子span结束后先暂存，根span结束时再决定是否导出"""
+    __slots__ = ("trace_id", "sampled", "spans", "closed", "lock")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+class Span:
+    __slots__ = (
+        "trace", "span_id", "parent_span_id", "name", "kind",
+        "start_ns", "end_ns", "attributes", "status_code", "status_message",
+    )
+
+    def __init__(self, trace: _Trace, name: str, parent_span_id: str = "", kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = _new_id(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.status_code = 0
+        self.status_message = ""
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.status_code = STATUS_ERROR
+        self.status_message = message
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": self.status_code, "message": self.status_message} if self.status_code else {},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+class _NoopSpan:
+    """追踪关闭时使用的空span，所有操作都是空操作"""
+    __slots__ = ()
+    trace_id = ""
+    span_id = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class SpanExporter:
+    """
+    后台批量导出器：span先进入有界队列，由后台线程按批次写成OTLP/JSON
+    - file: 每批一行 {"resourceSpans": [...]}，可直接交给OTel Collector的filelog/otlpjson接收器
+    - endpoint: POST到OTLP/HTTP的 /v1/traces（JSON编码）
+    """
+
+    def __init__(self, service_name: str, file_path: Optional[str] = None, endpoint: Optional[str] = None,
+                 interval: float = 2.0, max_queue: int = 10000, batch_size: int = 512):
+        self.service_name = service_name
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.interval = interval
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: Deque[Span] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def export(self, spans: List[Span]) -> None:
+        with self._cond:
+            room = self.max_queue - len(self._queue)
+            if room < len(spans):
+                self.dropped += len(spans) - max(room, 0)
+                spans = spans[:max(room, 0)]
+            self._queue.extend(spans)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _payload(self, spans: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "app.services.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.interval)
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size))]
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch: List[Span]) -> None:
+        payload = self._payload(batch)
+        try:
+            if self.file_path:
+                with open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            if self.endpoint:
+                import requests
+                requests.post(self.endpoint, json=payload, timeout=5)
+        except Exception as e:
+            print(f"⚠️ 导出追踪数据失败: {e}")
+
+class Tracer:
+    """
+    轻量级请求追踪
+    - 未配置导出目标时完全关闭，span()直接返回空span
+    - 开启后每个请求都会在内存中记录span，请求结束时按以下规则决定是否导出：
+      命中采样率、上游traceparent标记为已采样、请求带调试头、返回5xx或耗时超过慢请求阈值
+    - span通过contextvars传递，生成调度器的工作线程会继承提交时的上下文
+    """
+
+    def __init__(self, exporter: Optional[SpanExporter], sample_rate: float, slow_threshold: float):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """给当前span添加属性（没有活动span时忽略）"""
+        span = _current_span.get()
+        if span is not None:
+            span.set_attribute(key, value)
+
+    @contextmanager
+    def trace_request(self, name: str, traceparent: Optional[str] = None, force: bool = False,
+                      **attributes) -> Iterator[Optional[Span]]:
+        """
+        开始一条新链路并把根span设为当前span（追踪关闭时yield None）
+        根span结束时按采样规则导出整条链路；调用方可对根span调用set_error()强制导出
+        """
+        if not self.enabled:
+            yield None
+            return
+        trace_id, parent_span_id, sampled = "", "", force or random.random() < self.sample_rate
+        if traceparent:
+            # W3C traceparent: 00-<trace_id>-<parent_id>-<flags>
+            parts = traceparent.strip().split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                trace_id, parent_span_id = parts[1], parts[2]
+                sampled = sampled or parts[3] == "01"
+        span = Span(_Trace(trace_id or _new_id(16), sampled), name, parent_span_id, SPAN_KIND_SERVER, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            trace = span.trace
+            with trace.lock:
+                trace.closed = True
+                trace.spans.append(span)
+                spans, trace.spans = trace.spans, []
+            if self._will_export(span, span.end_ns):
+                trace.sampled = True
+                self.exporter.export(spans)
+
+    def _will_export(self, root: Span, now_ns: int) -> bool:
+        """根span在now_ns结束时链路是否导出：已采样、出错或耗时超过slow_threshold"""
+        slow = (now_ns - root.start_ns) / 1e9 >= self.slow_threshold
+        return root.trace.sampled or slow or root.status_code == STATUS_ERROR
+
+    def will_export(self, root: Span) -> bool:
+        """根span现在结束时链路是否会被导出（之后只会更慢），用于决定是否向客户端返回trace id"""
+        return self._will_export(root, time.time_ns())
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Iterator[Any]:
+        """在当前链路下创建子span；没有活动链路时返回空span"""
+        parent = _current_span.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+        span = Span(parent.trace, name, parent.span_id, kind, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        trace = span.trace
+        with trace.lock:
+            if not trace.closed:
+                trace.spans.append(span)
+                return
+        # 根span已结束后才完成的span（如请求取消后仍在执行的生成任务）
+        if trace.sampled:
+            self.exporter.export([span])
+
+    def traced(self, name: str, kind: int = SPAN_KIND_INTERNAL) -> Callable:
+        """函数装饰器：每次调用包在一个span里"""
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(name, kind):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+def create_tracer() -> Tracer:
+    """
+    根据环境变量创建追踪器
+    TRACE_EXPORT_FILE   导出文件路径（OTLP/JSON，每批一行）
+    TRACE_OTLP_ENDPOINT OTLP/HTTP收集器地址，如 http://127.0.0.1:4318/v1/traces
+    TRACE_SAMPLE_RATE   头部采样率，默认0.01
+    TRACE_SLOW_SECONDS  超过该耗时的请求总是导出，默认30秒
+    """
+    file_path = os.getenv("TRACE_EXPORT_FILE") or None
+    endpoint = os.getenv("TRACE_OTLP_ENDPOINT") or None
+    exporter = None
+    if file_path or endpoint:
+        exporter = SpanExporter(
+            service_name=os.getenv("TRACE_SERVICE_NAME", "yiyunchengyin-backend"),
+            file_path=file_path,
+            endpoint=endpoint,
+        )
+    return Tracer(
+        exporter,
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0.01)),
+        slow_threshold=float(os.getenv("TRACE_SLOW_SECONDS", 30)),
+    )
+
+# 全局追踪器实例
+tracer = create_tracer()
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.models.schemas import MusicPrompt
+from app.services.generation_scheduler import generation_scheduler
+from app.services.rate_limiter import rate_limiter
+
+load_dotenv()
+
+class VariantRunner:
+    """
+    多版本并行生成
+    - 同一提示词的多个版本同时提交到生成队列，按完成顺序返回，总耗时接近单次生成
+    - 每个用户同一时间最多per_user个版本在生成（跨worker的租约），每个版本还要占用一个Coze全局并发名额
+    - 第一个版本按interactive优先级排队，其余版本按bulk优先级，不挤占其他用户的单次生成
+    """
+
+    def __init__(self, per_user: int, upstream_wait: float):
+        self.per_user = per_user
+        self.upstream_wait = upstream_wait
+
+    def _user_key(self, user_id: str) -> str:
+        return f"concurrency:variants:{user_id}"
+
+    async def _acquire(self, user_id: str) -> Tuple[str, Optional[str]]:
+        """等待用户名额和Coze并发名额，超过upstream_wait抛出RuntimeError"""
+        deadline = time.monotonic() + self.upstream_wait
+        user_lease = coze_lease = None
+        try:
+            while True:
+                if user_lease is None:
+                    user_lease = await asyncio.to_thread(rate_limiter.acquire_lease, self._user_key(user_id), self.per_user)
+                if user_lease is not None:
+                    # 未配置Coze并发上限时不需要租约
+                    if not rate_limiter.upstream_caps.get("coze"):
+                        break
+                    coze_lease = await asyncio.to_thread(rate_limiter.acquire_upstream, "coze")
+                    if coze_lease is not None:
+                        break
+                if time.monotonic() >= deadline:
+                    raise RuntimeError("生成服务繁忙，请稍后重试")
+                await asyncio.sleep(0.2)
+        except BaseException:
+            self._release(user_id, (user_lease, coze_lease))
+            raise
+        return user_lease, coze_lease
+
+    def _release(self, user_id: str, leases: Tuple[Optional[str], Optional[str]]) -> None:
+        user_lease, coze_lease = leases
+        if user_lease:
+            rate_limiter.release_lease(self._user_key(user_id), user_lease)
+        if coze_lease:
+            rate_limiter.release_upstream("coze", coze_lease)
+
+    async def _generate(self, user_id: str, index: int, prompt: MusicPrompt,
+                        generate: Callable[[MusicPrompt], Tuple[bool, str, Optional[str]]]) -> Dict[str, Any]:
+        try:
+            leases = await self._acquire(user_id)
+        except RuntimeError as e:
+            return {"status": "failed", "error": str(e)}
+        try:
+            future = generation_scheduler.submit(
+                lambda: generate(prompt),
+                user_id=user_id,
+                interface=prompt.interface,
+                duration=prompt.duration,
+                priority="interactive" if index == 0 else "bulk",
+            )
+        except BaseException:
+            self._release(user_id, leases)
+            raise
+        # 名额在任务真正结束时归还：客户端断开后已开始执行的生成仍会跑完
+        future.add_done_callback(lambda _: self._release(user_id, leases))
+        try:
+            success, result, lyrics = await asyncio.wrap_future(future)
+        except Exception as e:
+            return {"status": "failed", "error": str(e)}
+        if not success:
+            return {"status": "failed", "error": result}
+        data = {"status": "done", "music_url": result}
+        if lyrics:
+            data["lyrics"] = lyrics
+        return data
+
+    async def run(self, user_id: str, variants: List[Tuple[MusicPrompt, Dict[str, Any]]],
+                  generate: Callable[[MusicPrompt], Tuple[bool, str, Optional[str]]]) -> AsyncIterator[Dict[str, Any]]:
+        """并行生成所有版本，按完成顺序产出每个版本的结果，最后产出汇总"""
+        started = time.monotonic()
+
+        async def handle(index: int, prompt: MusicPrompt, changes: Dict[str, Any]):
+            result = await self._generate(user_id, index, prompt, generate)
+            return {"type": "variant", "index": index, "changes": changes, "music_prompt": prompt, **result}
+
+        tasks = [asyncio.create_task(handle(i, prompt, changes)) for i, (prompt, changes) in enumerate(variants)]
+        succeeded = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                line = await finished
+                succeeded += line["status"] == "done"
+                yield line
+        finally:
+            # 客户端断开时取消仍在排队的版本
+            for task in tasks:
+                task.cancel()
+
+        yield {
+            "type": "summary",
+            "variants": len(variants),
+            "succeeded": succeeded,
+            "failed": len(variants) - succeeded,
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+
+# 单次请求最多生成的版本数
+VARIANT_MAX_COUNT = int(os.getenv("VARIANT_MAX_COUNT", 4))
+
+# 全局多版本生成实例
+variant_runner = VariantRunner(
+    per_user=int(os.getenv("VARIANT_MAX_CONCURRENCY_PER_USER", 4)),
+    upstream_wait=float(os.getenv("VARIANT_UPSTREAM_WAIT", 120)),
+)
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.models.schemas import MusicPrompt
+from app.services.audio_cache import audio_cache
+from app.services.coze_music_service import coze_music_service
+from app.services.generation_scheduler import generation_scheduler, SchedulerClosed
+from app.services.metrics import WARM_POOL_REQUESTS, WARM_POOL_GENERATIONS
+from app.services.rate_limiter import rate_limiter
+from app.services.state_store import StateStore, state_store
+
+load_dotenv()
+
+def canonical_key(prompt: MusicPrompt) -> Optional[str]:
+    """
+    gen_bgm提示词的规范化键（需先经过参数校验）：mood/genre/theme/instrument排序去重后加上时长
+    text描述不参与，规范化参数相同的请求视为同一预设；其他接口返回None
+    """
+    if prompt.interface != "gen_bgm":
+        return None
+    parts = [sorted(set(getattr(prompt, name) or [])) for name in ("mood", "genre", "theme", "instrument")]
+    raw = json.dumps([parts, prompt.duration], separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+class WarmPool:
+    """
+    热门gen_bgm预设的预生成曲目池
+    - record()按规范化提示词统计请求频率（指数衰减，近期请求权重更高）
+    - 后台预热线程周期性为最热门的prompts个预设各保持size首现成曲目，以background优先级排队，
+      每小时最多生成budget_per_hour首，且只在拿得到Coze并发名额时提交，不与用户请求争抢
+    - take()取走一首与请求匹配的曲目（每首只发给一个用户），曲目超过track_ttl后丢弃
+    频率、曲目池和预算都保存在共享状态存储中，多个worker同一时间只有一个在预热
+    （预热租约在每首曲目排队和生成期间定期续约，一轮可以包含多首最长300秒的生成）
+    """
+
+    def __init__(self, store: StateStore, size: int, prompts: int, min_hits: float, refresh: float,
+                 budget_per_hour: int, track_ttl: float, half_life: float):
+        self.store = store
+        self.size = size
+        self.prompts = prompts
+        self.min_hits = min_hits
+        self.refresh = refresh
+        self.budget_per_hour = budget_per_hour
+        self.track_ttl = track_ttl
+        self.half_life = half_life
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and self.prompts > 0
+
+    def _ensure_warmer(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._warm_loop, name="warm-pool", daemon=True)
+                self._thread.start()
+
+    def _decayed(self, entry: Dict[str, Any], now: float) -> float:
+        return entry["hits"] * 0.5 ** ((now - entry["ts"]) / self.half_life)
+
+    def record(self, prompt: MusicPrompt) -> None:
+        """统计一次生成请求（prompt需已规范化）"""
+        key = canonical_key(prompt) if self.enabled else None
+        if key is None:
+            return
+        self._ensure_warmer()
+        now = time.time()
+
+        def bump(freq):
+            freq = freq or {}
+            entry = freq.get(key)
+            hits = self._decayed(entry, now) if entry else 0.0
+            # 保存最近一次的完整提示词，预热时按它生成
+            freq[key] = {"hits": hits + 1.0, "ts": now, "prompt": prompt.model_dump()}
+            if len(freq) > self.prompts * 20:
+                # 只保留较热的预设，防止长尾组合撑大状态
+                ranked = sorted(freq, key=lambda k: self._decayed(freq[k], now), reverse=True)
+                freq = {k: freq[k] for k in ranked[:self.prompts * 10]}
+            return freq
+
+        self.store.update("warmpool:freq", bump)
+
+    def take(self, prompt: MusicPrompt) -> Optional[Dict[str, Any]]:
+        """取走一首匹配的预生成曲目，返回 {"music_url", "lyrics", "created_at"}；没有则返回None"""
+        key = canonical_key(prompt) if self.enabled else None
+        if key is None:
+            return None
+        now = time.time()
+        taken = {}
+
+        def pop(tracks):
+            tracks = [t for t in (tracks or []) if t["created_at"] + self.track_ttl > now]
+            if tracks:
+                taken["track"] = tracks.pop(0)
+            return tracks or None
+
+        self.store.update(f"warmpool:tracks:{key}", pop, ttl=self.track_ttl)
+        track = taken.get("track")
+        WARM_POOL_REQUESTS.inc(result="hit" if track else "miss")
+        return track
+
+    def _ready(self, key: str, now: float) -> int:
+        tracks = self.store.get(f"warmpool:tracks:{key}") or []
+        return sum(1 for t in tracks if t["created_at"] + self.track_ttl > now)
+
+    def _hot_prompts(self, now: float) -> List[Tuple[str, MusicPrompt]]:
+        freq = self.store.get("warmpool:freq") or {}
+        ranked = sorted(freq.items(), key=lambda item: self._decayed(item[1], now), reverse=True)
+        return [
+            (key, MusicPrompt(**entry["prompt"]))
+            for key, entry in ranked[:self.prompts]
+            if self._decayed(entry, now) >= self.min_hits
+        ]
+
+    def _take_budget(self, now: float) -> bool:
+        """预热预算：最近一小时内的生成次数不超过budget_per_hour"""
+        result = {}
+
+        def spend(starts):
+            starts = [t for t in (starts or []) if t > now - 3600]
+            result["ok"] = len(starts) < self.budget_per_hour
+            if result["ok"]:
+                starts.append(now)
+            return starts
+
+        self.store.update("warmpool:budget", spend, ttl=3600)
+        return result["ok"]
+
+    def _fill(self, key: str, prompt: MusicPrompt) -> None:
+        """生成一首曲目放入池中（在调度器工作线程中执行）"""
+        success, result, lyrics = coze_music_service.generate_music(prompt)
+        WARM_POOL_GENERATIONS.inc(status="success" if success else "failed")
+        if not success:
+            return
+        # 预热的曲目提前缓存到本地，命中时可以直接从本地播放
+        audio_cache.register(result)
+        track = {"music_url": result, "lyrics": lyrics, "created_at": time.time()}
+        self.store.update(f"warmpool:tracks:{key}", lambda tracks: (tracks or []) + [track], ttl=self.track_ttl)
+
+    def _wait(self, future: Future, leases: List[Tuple[str, str]]) -> None:
+        """等待一首曲目完成；排队加生成可能超过租约有效期，等待期间每lease_ttl/3秒续约一次"""
+        while True:
+            try:
+                future.result(timeout=rate_limiter.lease_ttl / 3)
+                return
+            except FutureTimeout:
+                for key, lease_id in leases:
+                    rate_limiter.renew_lease(key, lease_id)
+
+    def warm_once(self, warmer_lease: Optional[str] = None) -> int:
+        """执行一轮预热，返回本轮提交的生成数；warmer_lease为本worker持有的预热租约"""
+        now = time.time()
+        coze_capped = bool(rate_limiter.upstream_caps.get("coze"))
+        submitted = 0
+        for key, prompt in self._hot_prompts(now):
+            for _ in range(self.size - self._ready(key, now)):
+                if self._stop.is_set():
+                    return submitted
+                if warmer_lease and not rate_limiter.renew_lease("warmpool:warmer", warmer_lease):
+                    # 租约已失效，可能已有其他worker接手预热
+                    return submitted
+                lease_id = rate_limiter.acquire_upstream("coze") if coze_capped else None
+                if coze_capped and lease_id is None:
+                    # 上游繁忙，留给用户请求，下一轮再补
+                    return submitted
+                try:
+                    if not self._take_budget(now):
+                        return submitted
+                    # 逐首提交并等待完成，避免一轮内把预算全部压进队列
+                    future = generation_scheduler.submit(
+                        lambda key=key, prompt=prompt: self._fill(key, prompt),
+                        user_id="warm-pool", interface=prompt.interface, duration=prompt.duration,
+                        priority="background",
+                    )
+                    leases = [("warmpool:warmer", warmer_lease)] if warmer_lease else []
+                    if lease_id:
+                        leases.append(("concurrency:coze", lease_id))
+                    self._wait(future, leases)
+                except SchedulerClosed:
+                    return submitted
+                finally:
+                    if lease_id:
+                        rate_limiter.release_upstream("coze", lease_id)
+                submitted += 1
+        return submitted
+
+    def _warm_loop(self) -> None:
+        while not self._stop.wait(self.refresh):
+            # 多个worker时只有拿到租约的一个执行本轮预热
+            lease_id = rate_limiter.acquire_lease("warmpool:warmer", 1)
+            if lease_id is None:
+                continue
+            try:
+                self.warm_once(lease_id)
+            except Exception as e:
+                print(f"预热曲目池失败: {e}")
+            finally:
+                rate_limiter.release_lease("warmpool:warmer", lease_id)
+
+    def close(self) -> None:
+        """停止后台预热（正在执行的一轮会在当前曲目完成后结束）"""
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "presets": [
+                {
+                    "key": key,
+                    "mood": prompt.mood,
+                    "genre": prompt.genre,
+                    "theme": prompt.theme,
+                    "instrument": prompt.instrument,
+                    "duration": prompt.duration,
+                    "ready": self._ready(key, now),
+                }
+                for key, prompt in self._hot_prompts(now)
+            ],
+        }
+
+# 全局曲目池实例；WARM_POOL_SIZE为0（默认）时关闭
+warm_pool = WarmPool(
+    state_store,
+    size=int(os.getenv("WARM_POOL_SIZE", 0)),
+    prompts=int(os.getenv("WARM_POOL_PROMPTS", 5)),
+    min_hits=float(os.getenv("WARM_POOL_MIN_HITS", 3)),
+    refresh=float(os.getenv("WARM_POOL_REFRESH_SECONDS", 300)),
+    budget_per_hour=int(os.getenv("WARM_POOL_BUDGET_PER_HOUR", 20)),
+    track_ttl=float(os.getenv("WARM_POOL_TRACK_TTL", 6 * 3600)),
+    half_life=float(os.getenv("WARM_POOL_HALF_LIFE", 6 * 3600)),
+)
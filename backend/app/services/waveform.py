@@ -0,0 +1,196 @@
+import io
+import os
+import shutil
+import subprocess
+import threading
+import wave
+import zipfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from app.services.audio_cache import audio_cache
+
+load_dotenv()
+
+# 解码器：输入文件路径，返回 (形状为(采样数, 声道数)的float32数组，取值[-1, 1], 采样率)
+Decoder = Callable[[str], Tuple[np.ndarray, int]]
+
+PEAKS_SUFFIX = ".peaks.npz"
+
+def decode_wav(path: str) -> Tuple[np.ndarray, int]:
+    """用标准库wave解码PCM WAV（8/16/24/32位）"""
+    with wave.open(path, "rb") as f:
+        channels, width, rate, frames = f.getnchannels(), f.getsampwidth(), f.getframerate(), f.getnframes()
+        raw = f.readframes(frames)
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        # 24位小端：补一个低位字节后按int32解释
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(packed), 4), dtype=np.uint8)
+        padded[:, 1:] = packed
+        samples = padded.view("<i4").reshape(-1).astype(np.float32) / 2147483648.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"不支持的WAV采样位宽: {width * 8}")
+    return samples.reshape(-1, channels), rate
+
+def ffmpeg_decoder(binary: str, rate: int = 22050) -> Decoder:
+    """通过ffmpeg把任意格式解码为单声道16位PCM"""
+    def decode(path: str) -> Tuple[np.ndarray, int]:
+        result = subprocess.run(
+            [binary, "-v", "error", "-i", path, "-f", "s16le", "-ac", "1", "-ar", str(rate), "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=120,
+        )
+        samples = np.frombuffer(result.stdout, dtype="<i2").astype(np.float32) / 32768.0
+        return samples.reshape(-1, 1), rate
+    return decode
+
+def _quantize(values: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(values * 127.0), -128, 127).astype(np.int8)
+
+def compute_peaks(samples: np.ndarray, max_bins: int, min_bins: int) -> List[Tuple[int, np.ndarray]]:
+    """
+    多分辨率min/max峰值
+    最细一级不超过max_bins个区间，之后每级区间数减半，直到不超过min_bins
+    返回 [(每区间采样数, int8数组[min0, max0, min1, max1, ...])]，从细到粗
+    """
+    total, channels = samples.shape
+    if total == 0:
+        return [(1, np.zeros(0, dtype=np.int8))]
+    per_bin = max(1, -(-total // max_bins))
+    bins = -(-total // per_bin)
+    padded = samples
+    if bins * per_bin != total:
+        padded = np.concatenate([samples, np.repeat(samples[-1:], bins * per_bin - total, axis=0)])
+    # (区间数, 每区间采样数×声道数)，一次规约得到所有声道的最小/最大值
+    frames = padded.reshape(bins, per_bin * channels)
+    mins, maxs = frames.min(axis=1), frames.max(axis=1)
+
+    levels = []
+    while True:
+        interleaved = np.empty(len(mins) * 2, dtype=np.int8)
+        interleaved[0::2] = _quantize(mins)
+        interleaved[1::2] = _quantize(maxs)
+        levels.append((per_bin, interleaved))
+        if len(mins) <= min_bins:
+            return levels
+        if len(mins) % 2:
+            mins, maxs = np.append(mins, mins[-1]), np.append(maxs, maxs[-1])
+        mins, maxs = mins.reshape(-1, 2).min(axis=1), maxs.reshape(-1, 2).max(axis=1)
+        per_bin *= 2
+
+class WaveformService:
+    """
+    曲目缓存完成后计算波形峰值，前端无需下载和解码音频即可立即绘制波形
+    - WAV用标准库解码；其他格式按content-type选择注册的解码器（默认在有ffmpeg时注册mp3/m4a等）
+    - 峰值以int8保存为npz，与曲目放在同一缓存目录；被淘汰后在请求时重新计算
+    """
+
+    def __init__(self, max_bins: int, min_bins: int):
+        self.max_bins = max_bins
+        self.min_bins = min_bins
+        self._decoders: Dict[str, Decoder] = {}
+        self._lock = threading.Lock()
+        self.register_decoder(("audio/wav", "audio/x-wav", "audio/wave"), decode_wav)
+
+    def register_decoder(self, content_types, decoder: Decoder) -> None:
+        for content_type in content_types:
+            self._decoders[content_type] = decoder
+
+    def decoder_for(self, content_type: str) -> Optional[Decoder]:
+        return self._decoders.get((content_type or "").lower())
+
+    def on_cached(self, digest: str, path: str, content_type: str) -> None:
+        """AudioCache的后处理步骤"""
+        if not os.path.exists(audio_cache.sidecar_path(digest, PEAKS_SUFFIX)):
+            self.build(digest, path, content_type)
+
+    def build(self, digest: str, path: str, content_type: str) -> bool:
+        """解码并保存峰值，没有可用解码器时返回False"""
+        decoder = self.decoder_for(content_type)
+        if decoder is None:
+            return False
+        samples, rate = decoder(path)
+        levels = compute_peaks(samples, self.max_bins, self.min_bins)
+        buffer = io.BytesIO()
+        arrays = {f"level{i}": data for i, (_, data) in enumerate(levels)}
+        np.savez(
+            buffer,
+            meta=np.array([rate, len(samples)], dtype=np.int64),
+            samples_per_bin=np.array([per_bin for per_bin, _ in levels], dtype=np.int64),
+            bins=np.array([len(data) // 2 for _, data in levels], dtype=np.int64),
+            **arrays,
+        )
+        audio_cache.write_sidecar(digest, PEAKS_SUFFIX, buffer.getvalue())
+        return True
+
+    def load(self, track: Dict[str, Any], bins: int) -> Optional[Dict[str, Any]]:
+        """
+        读取不少于bins个区间的最粗一级（没有则返回最细一级），格式与audiowaveform的JSON输出一致
+        峰值尚不可用（曲目未缓存或无解码器）时返回None
+        峰值文件在读取前被LRU淘汰或已损坏时重新生成一次，仍然失败时同样返回None
+        """
+        path = audio_cache.sidecar_path(track["sha256"], PEAKS_SUFFIX)
+        for rebuild in (False, True):
+            blob = audio_cache.open_blob(track)
+            if blob is None:
+                return None
+            if rebuild or not os.path.exists(path):
+                with self._lock:
+                    if (rebuild or not os.path.exists(path)) and not self._build_quietly(track, blob):
+                        return None
+            try:
+                return self._read(path, bins)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile) as e:
+                print(f"波形文件损坏，重新生成: {path}: {e}")
+        return None
+
+    def _build_quietly(self, track: Dict[str, Any], blob: str) -> bool:
+        """load中的生成：解码失败（如曲目刚被淘汰）时返回False"""
+        try:
+            return self.build(track["sha256"], blob, track["content_type"])
+        except Exception as e:
+            print(f"生成波形失败 {track['sha256']}: {e}")
+            return False
+
+    @staticmethod
+    def _read(path: str, bins: int) -> Dict[str, Any]:
+        with np.load(path) as peaks:
+            rate, total = (int(v) for v in peaks["meta"])
+            samples_per_bin = [int(v) for v in peaks["samples_per_bin"]]
+            level_bins = [int(v) for v in peaks["bins"]]
+            level = len(level_bins) - 1
+            while level > 0 and level_bins[level] < bins:
+                level -= 1
+            data = peaks[f"level{level}"]
+        return {
+            "version": 2,
+            "channels": 1,
+            "sample_rate": rate,
+            "samples_per_pixel": samples_per_bin[level],
+            "bits": 8,
+            "length": len(data) // 2,
+            "duration": round(total / rate, 3) if rate else 0.0,
+            "data": data.tolist(),
+        }
+
+# 全局波形服务实例
+waveform_service = WaveformService(
+    max_bins=int(os.getenv("WAVEFORM_MAX_BINS", 4096)),
+    min_bins=int(os.getenv("WAVEFORM_MIN_BINS", 128)),
+)
+
+_ffmpeg = os.getenv("WAVEFORM_FFMPEG") or shutil.which("ffmpeg")
+if _ffmpeg:
+    waveform_service.register_decoder(
+        ("audio/mpeg", "audio/mp3", "audio/mp4", "audio/aac", "audio/x-m4a", "audio/ogg", "audio/flac"),
+        ffmpeg_decoder(_ffmpeg),
+    )
+
+audio_cache.add_listener(waveform_service.on_cached)
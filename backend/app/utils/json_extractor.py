@@ -0,0 +1,217 @@
+"""
+LLM响应中的JSON提取与修复
+
+单遍扫描：只在预编译正则找到的结构字符处停下，其余文本整段复制；扫描过程中同时完成
+  - 跳过markdown代码块和对象前后的说明文字
+  - 删除对象/数组结尾多余的逗号
+  - 把结构位置上的全角引号（“ ” ＂）替换成半角引号，字符串内容里的全角引号保持不变
+  - 字符串内未转义的半角引号（如 "她说"你好""）按内容处理并补上转义
+  - 输出因max_tokens被截断时，补全未闭合的字符串和括号，必要时回退到最后一个完整的成员
+支持流式逐段feed()，随时可以用snapshot()取得当前能解析出的部分结果
+"""
+import json
+import re
+from typing import Any, List, Optional, Set, Tuple
+
+# 字符串外需要处理的结构字符（包括全角引号）
+_STRUCTURAL = re.compile(r'[{}\[\],:"\\“”＂]')
+# 半角引号字符串内只关心引号和转义
+_IN_STRING = re.compile(r'["\\]')
+# 全角引号字符串内还要识别全角结束引号
+_IN_FULLWIDTH_STRING = re.compile(r'["\\”＂]')
+# 结束引号后面必须紧跟结构字符才算字符串结束，否则视为字符串内容
+_CLOSE_FOLLOW = re.compile(r'\s*[:,}\]]')
+
+_FULLWIDTH_QUOTES = "“”＂"
+_CLOSERS = {"{": "}", "[": "]"}
+
+class JSONStreamExtractor:
+    """
+    增量JSON提取器
+    用法:
+        extractor = JSONStreamExtractor()
+        for chunk in stream: extractor.feed(chunk); partial = extractor.snapshot()
+        data = extractor.result()
+    """
+
+    def __init__(self):
+        self._out: List[str] = []        # 修复后的输出片段
+        self._stack: List[str] = []      # 未闭合的括号
+        self._in_string = False
+        self._fullwidth_string = False   # 当前字符串以全角引号开始
+        self._pending_escape = False     # 上一段以反斜杠结尾
+        self._tail = ""                  # 结束引号判定时需要向后看的残留文本（以该引号开头）
+        # 可以安全截断的位置：(输出长度, 当时的括号栈)，出现在每个成员结束之后
+        self._safe_points: List[Tuple[int, str]] = []
+        self.done = False
+        self.repairs: Set[str] = set()
+
+    def feed(self, chunk: str) -> "JSONStreamExtractor":
+        if self.done or not chunk:
+            return self
+        text = self._tail + chunk
+        self._tail = ""
+        pos = 0
+        if not self._out:
+            start = text.find("{")
+            if start == -1:
+                # 保留结尾两个字符，以便识别跨段的```标记
+                self._tail = text[-2:]
+                return self
+            if "```" in text[:start]:
+                self.repairs.add("markdown")
+            pos = start
+        pos = self._scan(text, pos)
+        if pos < len(text) and not self.done:
+            self._tail = text[pos:]
+        return self
+
+    def _emit_closing(self) -> None:
+        """写出右括号前删除多余的逗号"""
+        i = len(self._out) - 1
+        while i >= 0 and self._out[i].isspace():
+            i -= 1
+        if i >= 0 and self._out[i] == ",":
+            del self._out[i]
+            self.repairs.add("trailing_comma")
+
+    def _scan(self, text: str, pos: int) -> int:
+        out = self._out
+        n = len(text)
+        if self._pending_escape:
+            if pos >= n:
+                return pos
+            out.append(text[pos])
+            pos += 1
+            self._pending_escape = False
+
+        while pos < n:
+            if self._in_string:
+                pattern = _IN_FULLWIDTH_STRING if self._fullwidth_string else _IN_STRING
+                match = pattern.search(text, pos)
+                if match is None:
+                    out.append(text[pos:])
+                    return n
+                idx = match.start()
+                if idx > pos:
+                    out.append(text[pos:idx])
+                ch = text[idx]
+                if ch == "\\":
+                    if idx + 1 >= n:
+                        out.append(ch)
+                        self._pending_escape = True
+                        return n
+                    out.append(text[idx:idx + 2])
+                    pos = idx + 2
+                    continue
+                if ch == '"' and self._fullwidth_string:
+                    # 全角引号字符串内的半角引号是内容，需要转义
+                    out.append('\\"')
+                    pos = idx + 1
+                    continue
+                if _CLOSE_FOLLOW.match(text, idx + 1) is None:
+                    if text[idx + 1:].strip() == "":
+                        # 还看不到后面的字符，等下一段再判断
+                        return idx
+                    if ch == '"':
+                        out.append('\\"')
+                        self.repairs.add("unescaped_quote")
+                    else:
+                        out.append(ch)
+                    pos = idx + 1
+                    continue
+                out.append('"')
+                self._in_string = False
+                self._fullwidth_string = False
+                pos = idx + 1
+                continue
+
+            match = _STRUCTURAL.search(text, pos)
+            if match is None:
+                out.append(text[pos:])
+                return n
+            idx = match.start()
+            if idx > pos:
+                out.append(text[pos:idx])
+            ch = text[idx]
+            pos = idx + 1
+            if ch == '"' or ch in _FULLWIDTH_QUOTES:
+                if ch != '"':
+                    self.repairs.add("fullwidth_quote")
+                    self._fullwidth_string = True
+                out.append('"')
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append(ch)
+                out.append(ch)
+                self._safe_points.append((len(out), "".join(self._stack)))
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._emit_closing()
+                self._stack.pop()
+                out.append(ch)
+                if not self._stack:
+                    self.done = True
+                    return pos
+            elif ch == ",":
+                self._safe_points.append((len(out), "".join(self._stack)))
+                out.append(ch)
+            else:
+                out.append(ch)
+        return pos
+
+    def _close(self, parts: List[str], stack: str) -> str:
+        text = "".join(parts).rstrip()
+        if text.endswith(","):
+            text = text[:-1]
+        return text + "".join(_CLOSERS[c] for c in reversed(stack))
+
+    def _candidates(self):
+        """候选修复文本：先尝试原样补全，失败后逐个回退到更早的安全截断点"""
+        if self.done:
+            yield "".join(self._out)
+            return
+        parts = list(self._out)
+        if self._pending_escape:
+            parts.pop()
+        if self._in_string:
+            # 残留文本以待判定的引号开头，截断时按结束引号处理
+            parts.append('"')
+        yield self._close(parts, "".join(self._stack))
+        for length, stack in reversed(self._safe_points):
+            yield self._close(self._out[:length], stack)
+
+    def snapshot(self) -> Optional[Any]:
+        """当前已接收内容能解析出的最大JSON对象（尚未开始时返回None）"""
+        if not self._out:
+            return None
+        for candidate in self._candidates():
+            try:
+                return json.loads(candidate)
+            except ValueError:
+                continue
+        return None
+
+    def result(self) -> Any:
+        """解析最终结果，失败时抛出json.JSONDecodeError"""
+        value = self.snapshot()
+        if value is None:
+            raise json.JSONDecodeError("未找到可解析的JSON对象", "".join(self._out), 0)
+        if not self.done:
+            self.repairs.add("truncated")
+        return value
+
+def extract_json(content: str) -> Any:
+    """从完整的LLM响应中提取JSON对象，失败时抛出json.JSONDecodeError"""
+    # 快速路径：大多数回复去掉首尾说明文字后就是合法JSON，直接交给C实现的json.loads
+    start, end = content.find("{"), content.rfind("}")
+    if start != -1 and end > start:
+        try:
+            value = json.loads(content[start:end + 1])
+        except ValueError:
+            pass
+        else:
+            if isinstance(value, dict):
+                return value
+    return JSONStreamExtractor().feed(content).result()
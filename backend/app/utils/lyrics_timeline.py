@@ -0,0 +1,177 @@
+"""
+歌词/字幕时间轴
+把Coze SongDetail中的Lyrics（LRC）或Captions（SRT/VTT文本或JSON列表）解析为按开始时间排序的紧凑时间轴，
+按播放时间用二分查找定位当前行（O(log n)）
+
+紧凑格式（列式，时间单位毫秒）:
+    {"v": 1, "t": [开始时间...], "d": [持续时间...], "text": [歌词...], "meta": {"ti": "...", ...}}
+"""
+import json
+import re
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+# [mm:ss]、[mm:ss.xx]、[mm:ss:xx]
+_LRC_TIME = re.compile(r"\[(\d{1,3}):(\d{1,2})(?:[.:](\d{1,3}))?\]")
+# [ar:歌手]、[offset:+200] 等标签行
+_LRC_META = re.compile(r"^\[([A-Za-z#]+):([^\]]*)\]\s*$")
+# 增强LRC的逐字时间 <mm:ss.xx>
+_WORD_TIME = re.compile(r"<\d{1,3}:\d{1,2}(?:[.:]\d{1,3})?>")
+# SRT/VTT时间行 00:00:01,000 --> 00:00:04,000
+_CUE_TIME = re.compile(
+    r"(?:(\d+):)?(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{1,2})[,.](\d{1,3})"
+)
+
+# 最后一行没有结束时间时的默认显示时长
+LAST_LINE_MS = 5000
+
+def _fraction_ms(fraction: Optional[str]) -> int:
+    """小数部分转毫秒：.5 → 500，.50 → 500，.500 → 500"""
+    return int(fraction.ljust(3, "0")[:3]) if fraction else 0
+
+class LyricsTimeline:
+    """按开始时间排序的歌词行，ends[i]为第i行结束时间（不含）"""
+    __slots__ = ("starts", "ends", "texts", "meta")
+
+    def __init__(self, starts: List[int], ends: List[int], texts: List[str], meta: Optional[Dict[str, str]] = None):
+        self.starts = starts
+        self.ends = ends
+        self.texts = texts
+        self.meta = meta or {}
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def at(self, ms: int) -> int:
+        """播放到ms毫秒时所在行的下标，处于行间空白或开头之前时返回-1"""
+        i = bisect_right(self.starts, ms) - 1
+        if i >= 0 and ms < self.ends[i]:
+            return i
+        return -1
+
+    def to_compact(self) -> Dict[str, Any]:
+        data = {
+            "v": 1,
+            "t": self.starts,
+            "d": [end - start for start, end in zip(self.starts, self.ends)],
+            "text": self.texts,
+        }
+        if self.meta:
+            data["meta"] = self.meta
+        return data
+
+    @classmethod
+    def from_compact(cls, data: Dict[str, Any]) -> "LyricsTimeline":
+        starts = list(data["t"])
+        return cls(starts, [s + d for s, d in zip(starts, data["d"])], list(data["text"]), data.get("meta"))
+
+def _build(entries: List[Tuple[int, Optional[int], str]], meta: Dict[str, str],
+           duration_ms: Optional[int]) -> Optional[LyricsTimeline]:
+    """entries: (开始, 结束或None, 文本)；没有结束时间的行持续到下一行开始，空文本行只用作上一行的结束标记"""
+    if not entries:
+        return None
+    entries.sort(key=lambda entry: entry[0])
+    starts, ends, texts = [], [], []
+    for i, (start, end, text) in enumerate(entries):
+        if end is None:
+            following = [s for s, _, _ in entries[i + 1:] if s > start]
+            end = following[0] if following else max(start + LAST_LINE_MS, duration_ms or 0)
+        if text:
+            starts.append(start)
+            ends.append(max(end, start))
+            texts.append(text)
+    if not starts:
+        return None
+    return LyricsTimeline(starts, ends, texts, meta)
+
+def parse_lrc(raw: str, duration_ms: Optional[int] = None) -> Optional[LyricsTimeline]:
+    entries: List[Tuple[int, Optional[int], str]] = []
+    meta: Dict[str, str] = {}
+    offset = 0
+    for line in raw.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        stamps = list(_LRC_TIME.finditer(line))
+        if not stamps:
+            match = _LRC_META.match(line)
+            if match:
+                key, value = match.group(1).lower(), match.group(2).strip()
+                if key == "offset":
+                    # 正值表示歌词提前显示
+                    offset = int(value) if re.fullmatch(r"[+-]?\d+", value) else 0
+                else:
+                    meta[key] = value
+            continue
+        text = _WORD_TIME.sub("", line[stamps[-1].end():]).strip()
+        # 一行可以有多个时间标签（副歌重复）
+        for stamp in stamps:
+            minutes, seconds, fraction = stamp.groups()
+            entries.append(((int(minutes) * 60 + int(seconds)) * 1000 + _fraction_ms(fraction), None, text))
+    if offset:
+        entries = [(max(start - offset, 0), end, text) for start, end, text in entries]
+    return _build(entries, meta, duration_ms)
+
+def _cue_ms(hours: Optional[str], minutes: str, seconds: str, fraction: str) -> int:
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + _fraction_ms(fraction)
+
+def parse_cues(raw: str, duration_ms: Optional[int] = None) -> Optional[LyricsTimeline]:
+    """SRT/WebVTT：时间行之后直到空行的文本为一条字幕"""
+    entries: List[Tuple[int, Optional[int], str]] = []
+    current: Optional[Tuple[int, int]] = None
+    lines: List[str] = []
+    for line in raw.splitlines() + [""]:
+        match = _CUE_TIME.search(line)
+        if match:
+            current = (_cue_ms(*match.groups()[:4]), _cue_ms(*match.groups()[4:]))
+            lines = []
+        elif line.strip():
+            if current is not None:
+                lines.append(line.strip())
+        elif current is not None:
+            entries.append((current[0], current[1], " ".join(lines)))
+            current = None
+    return _build(entries, {}, duration_ms)
+
+def _pick(item: Dict[str, Any], *names: str) -> Any:
+    for name in names:
+        if name in item:
+            return item[name]
+    return None
+
+def parse_caption_list(items: List[Any], duration_ms: Optional[int] = None) -> Optional[LyricsTimeline]:
+    """JSON字幕列表：[{"text", "start_time", "end_time"}...]，时间最大值超过1小时时按毫秒处理，否则按秒"""
+    rows = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        start = _pick(item, "start_time", "startTime", "start", "begin_time", "beginTime", "begin")
+        end = _pick(item, "end_time", "endTime", "end")
+        text = _pick(item, "text", "content", "line", "words")
+        if isinstance(start, (int, float)) and isinstance(text, str):
+            rows.append((start, end if isinstance(end, (int, float)) else None, text.strip()))
+    if not rows:
+        return None
+    scale = 1 if max(max(s, e or 0) for s, e, _ in rows) > 3600 else 1000
+    entries = [(int(s * scale), int(e * scale) if e is not None else None, t) for s, e, t in rows]
+    return _build(entries, {}, duration_ms)
+
+def parse_lyrics(raw: Any, duration_ms: Optional[int] = None) -> Optional[LyricsTimeline]:
+    """自动识别LRC、SRT/VTT或JSON字幕，不含时间信息（纯文本歌词）时返回None"""
+    if isinstance(raw, list):
+        return parse_caption_list(raw, duration_ms)
+    if not isinstance(raw, str) or not raw.strip():
+        return None
+    text = raw.strip()
+    if text[0] in "[{" and not _LRC_TIME.match(text) and not _LRC_META.match(text.splitlines()[0]):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            data = _pick(data, "captions", "Captions", "lines", "sentences", "data")
+        if isinstance(data, list):
+            return parse_caption_list(data, duration_ms)
+    if _CUE_TIME.search(text):
+        return parse_cues(text, duration_ms)
+    return parse_lrc(text, duration_ms)
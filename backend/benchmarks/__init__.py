@@ -0,0 +1,5 @@
+"""
+性能基准脚本集合
+在 backend 目录下以模块方式运行，例如：
+    python -m benchmarks.bench_session_response
+"""
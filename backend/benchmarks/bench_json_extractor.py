@@ -0,0 +1,145 @@
+"""
+LLM回复JSON提取基准
+对比旧的 _clean_json_response + json.loads 与 app.utils.json_extractor 的解析成功率和耗时
+
+语料来源：
+  - 默认：基于替身服务的分析结果/提示词结果，注入常见的模型输出问题（markdown包裹、前后说明文字、
+    多余逗号、全角引号、未转义引号、max_tokens截断）生成的合成语料
+  - --corpus：真实记录的回复（后端设置 LLM_RESPONSE_RECORD_FILE 后生成的JSONL，每行含content字段）
+
+运行: python -m benchmarks.bench_json_extractor [--corpus records.jsonl] [--per-fault 200]
+"""
+import argparse
+import json
+import random
+import re
+import timeit
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+from app.utils.json_extractor import JSONStreamExtractor, extract_json
+from benchmarks.mock_dashscope import ANALYSIS_RESULT, PROMPT_RESULT
+
+def legacy_clean(content: str) -> str:
+    """旧实现（QwenOmniService._clean_json_response）"""
+    content = re.sub(r'```json\s*', '', content)
+    content = re.sub(r'```\s*$', '', content)
+    content = re.sub(r'```', '', content)
+    content = content.strip()
+    start_idx = content.find('{')
+    end_idx = content.rfind('}')
+    if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
+        content = content[start_idx:end_idx + 1]
+    return content
+
+def legacy_parse(content: str):
+    return json.loads(legacy_clean(content))
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, indent=random.choice((None, 2)))
+
+def _fault_markdown(data) -> str:
+    return f"好的，以下是分析结果：\n```json\n{_dumps(data)}\n```"
+
+def _fault_prose(data) -> str:
+    return f"根据您的描述，我给出如下结果：\n{_dumps(data)}\n如需调整{{风格}}或节奏，请告诉我。"
+
+def _fault_trailing_comma(data) -> str:
+    return re.sub(r'(["\]}\d])(\s*)([}\]])', r'\1,\2\3', _dumps(data))
+
+def _fault_fullwidth_quote(data) -> str:
+    text = json.dumps(data, ensure_ascii=False)
+    # 把键名和部分字符串值的引号换成全角引号
+    return re.sub(r'"([^"\\]*)"(\s*[:,}\]])', lambda m: f"“{m.group(1)}”{m.group(2)}"
+                  if random.random() < 0.6 else m.group(0), text)
+
+def _fault_unescaped_quote(data) -> str:
+    data = json.loads(json.dumps(data))
+    key = "understanding" if "understanding" in data else "text"
+    data[key] = data[key] + '，就像"夏日的风"一样'
+    return _dumps(data).replace('\\"', '"')
+
+def _fault_truncated(data) -> str:
+    text = _dumps(data)
+    return text[:random.randint(len(text) // 3, len(text) - 2)]
+
+def _fault_combined(data) -> str:
+    return _fault_truncated_from(_fault_trailing_comma(data))
+
+def _fault_truncated_from(text: str) -> str:
+    return "```json\n" + text[:random.randint(len(text) // 2, len(text) - 2)]
+
+FAULTS: Dict[str, Callable] = {
+    "clean": _dumps,
+    "markdown": _fault_markdown,
+    "prose": _fault_prose,
+    "trailing_comma": _fault_trailing_comma,
+    "fullwidth_quote": _fault_fullwidth_quote,
+    "unescaped_quote": _fault_unescaped_quote,
+    "truncated": _fault_truncated,
+    "combined": _fault_combined,
+}
+
+def synthetic_corpus(per_fault: int, seed: int) -> List[Tuple[str, str]]:
+    random.seed(seed)
+    corpus = []
+    for fault, make in FAULTS.items():
+        for i in range(per_fault):
+            corpus.append((fault, make(ANALYSIS_RESULT if i % 2 == 0 else PROMPT_RESULT)))
+    return corpus
+
+def recorded_corpus(paths: List[str]) -> List[Tuple[str, str]]:
+    corpus = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    corpus.append((f"recorded:{record.get('stage', '?')}", record["content"]))
+    return corpus
+
+def try_parse(func: Callable, content: str) -> bool:
+    try:
+        return isinstance(func(content), dict)
+    except ValueError:
+        return False
+
+def streamed(content: str, chunk: int = 8):
+    extractor = JSONStreamExtractor()
+    for i in range(0, len(content), chunk):
+        extractor.feed(content[i:i + chunk])
+    return extractor.result()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", action="append", default=[], help="记录的回复JSONL，可重复指定")
+    parser.add_argument("--per-fault", type=int, default=200, help="合成语料中每种问题的样本数")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    corpus = recorded_corpus(args.corpus) if args.corpus else synthetic_corpus(args.per_fault, args.seed)
+    totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+    for category, content in corpus:
+        row = totals[category]
+        row[0] += 1
+        row[1] += try_parse(legacy_parse, content)
+        row[2] += try_parse(extract_json, content)
+        row[3] += try_parse(streamed, content)
+
+    print(f"语料 {len(corpus)} 条（{'记录' if args.corpus else '合成'}）")
+    print(f"{'类别':<20}{'样本':>6}{'旧实现':>10}{'提取器':>10}{'流式':>10}")
+    overall = [0, 0, 0, 0]
+    for category, row in totals.items():
+        overall = [a + b for a, b in zip(overall, row)]
+        print(f"{category:<20}{row[0]:>6}" + "".join(f"{v / row[0]:>10.1%}" for v in row[1:]))
+    print(f"{'总计':<20}{overall[0]:>6}" + "".join(f"{v / overall[0]:>10.1%}" for v in overall[1:]))
+
+    contents = [content for _, content in corpus]
+    for name, func in (("legacy", legacy_parse), ("extractor", extract_json)):
+        seconds = min(timeit.repeat(
+            lambda: [try_parse(func, content) for content in contents], number=args.iterations, repeat=3
+        ))
+        print(f"{name:>9}: {seconds / args.iterations / len(contents) * 1e6:8.2f} µs/条")
+
+if __name__ == "__main__":
+    main()
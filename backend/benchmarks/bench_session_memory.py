@@ -0,0 +1,105 @@
+"""
+会话存储内存基准
+分别用旧的pydantic Session字典与SessionManager紧凑记录保存N个走完澄清流程的会话，
+用tracemalloc统计每个会话占用的字节数
+
+运行: python -m benchmarks.bench_session_memory [--sessions 100000]
+"""
+import argparse
+import gc
+import tracemalloc
+import uuid
+from datetime import datetime
+from app.models.schemas import (
+    AIAnalysis, ClarificationQuestion, ClarificationResponse, InputType,
+    MusicPrompt, Session, SessionStatus, UserInput
+)
+from app.services.session_manager import SessionManager
+
+# 与 QwenOmniService._generate_targeted_questions 相同的固定模板
+QUESTION_TEMPLATES = [
+    ("希望音乐表达什么情感？", ["欢快活泼", "轻松愉快", "激昂兴奋", "温暖幸福"], "mood_q1"),
+    ("偏好什么乐器组合？", ["钢琴独奏", "吉他弹唱", "电子合成", "弦乐组合"], "instrument_q1"),
+    ("音乐主要用于什么场合？", ["个人聆听", "放松冥想", "工作学习", "情感表达"], "purpose_q1"),
+    ("希望音乐的节奏感如何？", ["慢节奏", "中等节奏", "快节奏", "变化节奏"], "tempo_q1"),
+]
+
+def make_payload(i: int):
+    """为第i个会话构造输入、分析、澄清和提示词（每个会话的文本互不相同）"""
+    user_input = UserInput(input_type=InputType.TEXT, text_content=f"第{i}个描述：夏夜的海边，微风吹过")
+    analysis = AIAnalysis(
+        understanding=f"第{i}个理解：用户描述了一个宁静而浪漫的夏夜海边场景",
+        music_elements={"style": "轻音乐", "mood": "平静", "instruments": ["钢琴", "吉他"], "tempo": "慢"},
+        needs_clarification=True,
+        clarification_questions=[
+            ClarificationQuestion(question=q, options=list(options), question_id=qid)
+            for q, options, qid in QUESTION_TEMPLATES
+        ]
+    )
+    prompt = MusicPrompt(
+        interface="gen_bgm", mood=["calm"], text=f"第{i}段背景纯音乐",
+        genre=["ambient"], theme=["meditation"], instrument=["piano"]
+    )
+    return user_input, analysis, prompt
+
+def fill_legacy(n: int) -> dict:
+    """旧实现：每个会话一个完整的pydantic Session，时间为ISO字符串"""
+    sessions = {}
+    for i in range(n):
+        user_input, analysis, prompt = make_payload(i)
+        session_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        session = Session(
+            session_id=session_id, status=SessionStatus.INITIAL, original_input=user_input,
+            created_at=now, updated_at=now
+        )
+        session.ai_analysis = analysis
+        for q in analysis.clarification_questions:
+            session.clarification_history.append(
+                ClarificationResponse(session_id=session_id, question_id=q.question_id, selected_option=q.options[0])
+            )
+        session.final_prompt = prompt
+        session.status = SessionStatus.COMPLETED
+        session.updated_at = datetime.now().isoformat()
+        sessions[session_id] = session
+    return sessions
+
+def fill_compact(n: int) -> SessionManager:
+    """新实现：SessionManager内部的紧凑记录"""
+    manager = SessionManager()
+    for i in range(n):
+        user_input, analysis, prompt = make_payload(i)
+        session_id = manager.create_session(user_input)
+        manager.update_ai_analysis(session_id, analysis)
+        for q in analysis.clarification_questions:
+            manager.add_clarification_response(
+                session_id,
+                ClarificationResponse(session_id=session_id, question_id=q.question_id, selected_option=q.options[0])
+            )
+        manager.set_final_prompt(session_id, prompt)
+        manager.set_generated_music(session_id, f"https://example.com/music/{i}.mp3")
+    return manager
+
+def measure(fill, n: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = fill(n)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    return after - before
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"会话数: {args.sessions}")
+    for name, fill in (("legacy", fill_legacy), ("compact", fill_compact)):
+        total = measure(fill, args.sessions)
+        print(f"{name:>8}: 共 {total / 1024 / 1024:8.1f} MiB  每会话 {total / args.sessions:8.0f} 字节")
+
+if __name__ == "__main__":
+    main()
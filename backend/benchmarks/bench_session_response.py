@@ -0,0 +1,105 @@
+"""
+/session/{session_id} 响应序列化微基准
+对比旧路径 JSONResponse(APIResponse(...).dict()) 与 api_response() 的耗时和输出大小
+
+运行: python -m benchmarks.bench_session_response [--iterations N]
+"""
+import argparse
+import gzip
+import timeit
+import warnings
+from fastapi.responses import JSONResponse
+from app.api.responses import api_response
+from app.models.schemas import (
+    AIAnalysis, APIResponse, ClarificationQuestion, ClarificationResponse,
+    InputType, MusicPrompt, Session, SessionStatus, UserInput
+)
+
+def build_session() -> Session:
+    """构造一个走完澄清流程、字段齐全的典型会话"""
+    session_id = "3f1c2a9e-8d7b-4c6a-9e1f-2b3c4d5e6f70"
+    questions = [
+        ClarificationQuestion(
+            question=f"问题{i}：希望音乐表达什么情感？",
+            options=["欢快活泼", "轻松愉快", "激昂兴奋", "温暖幸福"],
+            question_id=f"q{i}"
+        )
+        for i in range(4)
+    ]
+    return Session(
+        session_id=session_id,
+        status=SessionStatus.COMPLETED,
+        original_input=UserInput(
+            session_id=session_id,
+            input_type=InputType.TEXT,
+            text_content="夏夜的海边，微风吹过，星星一颗颗亮起来" * 3
+        ),
+        ai_analysis=AIAnalysis(
+            understanding="用户描述了一个宁静而浪漫的夏夜海边场景" * 4,
+            music_elements={
+                "style": "轻音乐",
+                "mood": "平静",
+                "instruments": ["钢琴", "吉他", "弦乐"],
+                "tempo": "慢",
+                "genre": "氛围音乐",
+                "atmosphere": "宁静浪漫"
+            },
+            needs_clarification=True,
+            clarification_questions=questions
+        ),
+        clarification_history=[
+            ClarificationResponse(session_id=session_id, question_id=q.question_id, selected_option=q.options[0])
+            for q in questions
+        ],
+        final_prompt=MusicPrompt(
+            interface="gen_bgm",
+            mood=["calm", "romantic"],
+            text="夏夜海边的背景纯音乐",
+            genre=["ambient"],
+            theme=["meditation"],
+            instrument=["piano", "strings"]
+        ),
+        generated_music_url="https://example.com/music/3f1c2a9e.mp3",
+        created_at="2025-01-01T12:00:00.000000",
+        updated_at="2025-01-01T12:03:00.000000"
+    )
+
+def legacy_render(session: Session) -> bytes:
+    """旧实现：先.dict()再经标准库json编码"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        return JSONResponse(content=APIResponse(
+            success=True,
+            message="会话状态获取成功",
+            data={"session": session.dict()},
+            session_id=session.session_id
+        ).dict()).body
+
+def fast_render(session: Session) -> bytes:
+    """新实现：模型直接序列化为bytes"""
+    return api_response(
+        success=True,
+        message="会话状态获取成功",
+        data={"session": session},
+        session_id=session.session_id
+    ).body
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    session = build_session()
+    legacy_body = legacy_render(session)
+    fast_body = fast_render(session)
+
+    print(f"迭代次数: {args.iterations}")
+    for name, func, body in (("legacy", legacy_render, legacy_body), ("fast", fast_render, fast_body)):
+        seconds = min(timeit.repeat(lambda: func(session), number=args.iterations, repeat=3))
+        print(
+            f"{name:>7}: {seconds / args.iterations * 1e6:8.2f} µs/次  "
+            f"响应 {len(body)} 字节  gzip后 {len(gzip.compress(body))} 字节"
+        )
+
+if __name__ == "__main__":
+    main()
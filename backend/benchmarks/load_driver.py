@@ -0,0 +1,135 @@
+"""
+analyze → clarify → generate 全流程压测驱动
+在逐级增加的并发下反复执行完整流程，按端点统计 p50/p95/p99 延迟、吞吐量和错误数
+
+1. 启动替身服务（或使用 --with-mocks 由本脚本内嵌启动）：
+     python -m benchmarks.mock_dashscope --port 9001
+     python -m benchmarks.mock_coze --port 9002
+2. 让后端指向替身服务并关闭限流后启动：
+     DASHSCOPE_API_URL=http://127.0.0.1:9001/api/v1/services/aigc/multimodal-generation/generation \\
+     COZE_API_BASE_URL=http://127.0.0.1:9002 \\
+     RATE_LIMIT_ANALYZE_TEXT=0 RATE_LIMIT_GENERATE=0 \\
+     uvicorn app.main:app --port 8000
+3. 运行压测：
+     python -m benchmarks.load_driver --base-url http://127.0.0.1:8000/api --concurrency 1,4,16 --duration 30
+"""
+import argparse
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List
+import requests
+
+ENDPOINTS = ("analyze_text", "clarify", "generate")
+
+class Recorder:
+    """线程安全地收集每个端点的延迟与错误"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+def timed(recorder: Recorder, endpoint: str, func):
+    start = time.perf_counter()
+    try:
+        response = func()
+        ok = response.status_code == 200 and response.json().get("success", False)
+    except Exception:
+        response, ok = None, False
+    recorder.record(endpoint, time.perf_counter() - start, ok)
+    return response if ok else None
+
+def run_pipeline(http: requests.Session, base_url: str, recorder: Recorder, timeout: float) -> None:
+    """执行一次完整流程：文本分析 → 依次回答澄清问题 → 生成音乐"""
+    response = timed(recorder, "analyze_text", lambda: http.post(
+        f"{base_url}/analyze/text", data={"text_content": "夏夜的海边，微风吹过，星星一颗颗亮起来"}, timeout=timeout
+    ))
+    if response is None:
+        return
+    body = response.json()
+    session_id = body["session_id"]
+    for question in body["data"].get("clarification_questions") or []:
+        response = timed(recorder, "clarify", lambda: http.post(f"{base_url}/clarify", json={
+            "session_id": session_id,
+            "question_id": question["question_id"],
+            "selected_option": question["options"][0],
+        }, timeout=timeout))
+        if response is None:
+            return
+    timed(recorder, "generate", lambda: http.post(f"{base_url}/generate/{session_id}", timeout=timeout))
+
+def run_level(base_url: str, concurrency: int, duration: float, timeout: float) -> Recorder:
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        http = requests.Session()
+        # 每个虚拟用户使用独立身份，避免所有请求落在同一个限流桶/公平队列里
+        http.headers["X-User-Id"] = f"load-{uuid.uuid4().hex[:8]}"
+        while time.monotonic() < deadline:
+            run_pipeline(http, base_url, recorder, timeout)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder
+
+def report(concurrency: int, recorder: Recorder, elapsed: float) -> None:
+    print(f"\n并发 {concurrency}（{elapsed:.1f}s）")
+    print(f"{'端点':<14}{'请求数':>8}{'错误':>6}{'req/s':>9}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for endpoint in ENDPOINTS:
+        samples = recorder.latencies.get(endpoint, [])
+        print(
+            f"{endpoint:<14}{len(samples):>8}{recorder.errors.get(endpoint, 0):>6}"
+            f"{len(samples) / elapsed:>9.2f}"
+            f"{percentile(samples, 0.50) * 1000:>10.0f}"
+            f"{percentile(samples, 0.95) * 1000:>10.0f}"
+            f"{percentile(samples, 0.99) * 1000:>10.0f}"
+        )
+
+def start_mocks(args: argparse.Namespace) -> None:
+    """内嵌启动两个替身服务，使用各自的默认参数"""
+    from benchmarks import mock_coze, mock_dashscope
+    dashscope_args = mock_dashscope.build_parser().parse_args(["--port", str(args.dashscope_port)])
+    coze_args = mock_coze.build_parser().parse_args(["--port", str(args.coze_port)])
+    mock_dashscope.serve(dashscope_args)
+    mock_coze.serve(coze_args)
+    print(f"已启动替身服务: DashScope :{args.dashscope_port}  Coze :{args.coze_port}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000/api")
+    parser.add_argument("--concurrency", default="1,4,16", help="逐级并发数，逗号分隔")
+    parser.add_argument("--duration", type=float, default=30.0, help="每级持续时间（秒）")
+    parser.add_argument("--timeout", type=float, default=330.0, help="单个请求超时（秒）")
+    parser.add_argument("--with-mocks", action="store_true", help="在本进程内启动替身服务")
+    parser.add_argument("--dashscope-port", type=int, default=9001)
+    parser.add_argument("--coze-port", type=int, default=9002)
+    args = parser.parse_args()
+
+    if args.with_mocks:
+        start_mocks(args)
+
+    for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        start = time.monotonic()
+        recorder = run_level(args.base_url, concurrency, args.duration, args.timeout)
+        report(concurrency, recorder, time.monotonic() - start)
+
+if __name__ == "__main__":
+    main()
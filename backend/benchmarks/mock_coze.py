@@ -0,0 +1,175 @@
+"""
+Coze v3 对话接口的本地替身服务
+模拟 CozeMusicService 使用的三个接口：
+  - POST /v3/chat                创建对话，返回chat_id与conversation_id
+  - GET  /v3/chat/retrieve       在生成时长内返回in_progress，之后返回completed/failed
+  - GET  /v3/chat/message/list   返回插件调用消息、插件结果和收尾文本
+插件结果格式可配置：
+  - songdetail  {"code":0,"data":{"SongDetail":{"AudioUrl":...,"Lyrics":...}}}
+  - data_url    {"code":0,"data":{"music_url":...,"lyrics":...}}
+  - text        第一行是链接，后面是歌词
+  - error       {"code":702323005,"msg":"参数输入错误"}
+
+运行: python -m benchmarks.mock_coze --port 9002 --gen-time 6 --formats songdetail,text --error-rate 0.05
+后端配置: COZE_API_BASE_URL=http://127.0.0.1:9002
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlparse
+
+LRC_LYRICS = "[00:00.00]夏夜的海风\n[00:05.50]吹过沙滩\n[00:11.20]星光点点\n[00:17.80]照亮归途"
+
+class MockConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.latency = args.latency
+        self.gen_time = args.gen_time
+        self.gen_jitter = args.gen_jitter
+        self.error_rate = args.error_rate
+        self.fail_rate = args.fail_rate
+        self.formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+        self.early_result = args.early_result
+        self.chats: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+def plugin_result(fmt: str, chat_id: str) -> str:
+    url = f"https://mock-cdn.example.com/music/{chat_id}.mp3"
+    if fmt == "songdetail":
+        return json.dumps({"code": 0, "msg": "", "data": {"SongDetail": {"AudioUrl": url, "Lyrics": LRC_LYRICS}}}, ensure_ascii=False)
+    if fmt == "data_url":
+        return json.dumps({"code": 0, "msg": "", "data": {"music_url": url, "lyrics": LRC_LYRICS}}, ensure_ascii=False)
+    if fmt == "text":
+        return f"{url}\n{LRC_LYRICS}"
+    return json.dumps({"code": 702323005, "msg": "参数输入错误"}, ensure_ascii=False)
+
+def build_messages(chat: Dict[str, Any], now: float) -> list:
+    """按对话进度生成消息列表：插件调用 → 插件结果 → 收尾文本"""
+    chat_id = chat["id"]
+    elapsed = now - chat["created_at"]
+    messages = [{
+        "id": f"{chat_id}-1", "role": "assistant", "type": "function_call", "content_type": "text",
+        "content": json.dumps({"name": "yinleshengcheng-gen_bgm", "arguments": {}}, ensure_ascii=False)
+    }]
+    # early_result: 插件结果比对话状态变为completed早到达（模拟机器人还在写收尾文本）
+    result_at = chat["gen_time"] * (0.7 if chat["early_result"] else 1.0)
+    if elapsed >= result_at:
+        messages.append({
+            "id": f"{chat_id}-2", "role": "assistant", "type": "tool_response", "content_type": "text",
+            "content": plugin_result(chat["format"], chat_id)
+        })
+    if elapsed >= chat["gen_time"]:
+        messages.append({
+            "id": f"{chat_id}-3", "role": "assistant", "type": "answer", "content_type": "text",
+            "content": "您的音乐已生成完成，请点击播放。"
+        })
+    return messages
+
+def make_handler(config: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Any) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _delay_or_error(self) -> bool:
+            time.sleep(max(0.0, random.gauss(config.latency, config.latency / 4)))
+            if random.random() < config.error_rate:
+                self._send(500, {"code": 5000, "msg": "mock upstream error"})
+                return True
+            return False
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            if urlparse(self.path).path != "/v3/chat":
+                self._send(404, {"code": 4004, "msg": "not found"})
+                return
+            if self._delay_or_error():
+                return
+            chat = {
+                "id": uuid.uuid4().hex,
+                "conversation_id": uuid.uuid4().hex,
+                "created_at": time.time(),
+                "gen_time": max(0.5, random.gauss(config.gen_time, config.gen_jitter)),
+                "format": random.choice(config.formats),
+                "failed": random.random() < config.fail_rate,
+                "early_result": config.early_result,
+            }
+            with config.lock:
+                config.chats[chat["id"]] = chat
+            self._send(200, {"code": 0, "msg": "", "data": {
+                "id": chat["id"], "conversation_id": chat["conversation_id"], "status": "in_progress"
+            }})
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            chat_id = parse_qs(parsed.query).get("chat_id", [""])[0]
+            with config.lock:
+                chat = config.chats.get(chat_id)
+            if chat is None:
+                self._send(200, {"code": 4000, "msg": "chat not found"})
+                return
+            if self._delay_or_error():
+                return
+            now = time.time()
+
+            if parsed.path == "/v3/chat/retrieve":
+                if now - chat["created_at"] < chat["gen_time"]:
+                    status = "in_progress"
+                else:
+                    status = "failed" if chat["failed"] else "completed"
+                self._send(200, {"code": 0, "msg": "", "data": {
+                    "id": chat_id, "conversation_id": chat["conversation_id"], "status": status
+                }})
+            elif parsed.path == "/v3/chat/message/list":
+                self._send(200, {"code": 0, "msg": "", "data": build_messages(chat, now)})
+            else:
+                self._send(404, {"code": 4004, "msg": "not found"})
+
+    return Handler
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9002)
+    parser.add_argument("--latency", type=float, default=0.05, help="单次接口调用延迟（秒）")
+    parser.add_argument("--gen-time", type=float, default=6.0, help="平均生成耗时（秒）")
+    parser.add_argument("--gen-jitter", type=float, default=1.5, help="生成耗时标准差（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="接口返回HTTP 500的比例")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="对话最终状态为failed的比例")
+    parser.add_argument("--formats", default="songdetail,data_url,text", help="插件结果格式，逗号分隔，随机选择")
+    parser.add_argument("--early-result", action="store_true", help="插件结果早于completed状态出现")
+    return parser
+
+def serve(args: argparse.Namespace) -> ThreadingHTTPServer:
+    """在后台线程启动服务并返回server对象（供load_driver内嵌启动）"""
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockConfig(args)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-coze", daemon=True).start()
+    return server
+
+def main():
+    args = build_parser().parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockConfig(args)))
+    server.daemon_threads = True
+    print(f"Mock Coze 已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+DashScope 多模态生成接口的本地替身服务
+模拟 QwenOmniService.analyze_input / generate_final_prompt 能处理的各种响应结构：
+  - choices[0].message.content 为数组 [{"text": ...}]
+  - choices[0].message.content 为字符串
+  - output.text
+  - 业务错误 {"code": ..., "message": ...}
+并可配置延迟、HTTP错误率和JSON被markdown包裹的比例
+请求头 X-DashScope-SSE: enable 时按SSE逐段返回增量文本（incremental_output），用于流式分析
+
+运行: python -m benchmarks.mock_dashscope --port 9001 --latency 0.8 --jitter 0.3 --error-rate 0.02
+后端配置: DASHSCOPE_API_URL=http://127.0.0.1:9001/api/v1/services/aigc/multimodal-generation/generation
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+ANALYSIS_RESULT = {
+    "understanding": "用户描述了一个宁静而浪漫的夏夜海边场景，适合舒缓的音乐",
+    "music_elements": {
+        "style": "轻音乐",
+        "mood": "平静",
+        "instruments": ["钢琴", "吉他"],
+        "tempo": "慢",
+        "genre": "氛围音乐",
+        "atmosphere": "宁静浪漫"
+    },
+    "needs_clarification": True,
+    "clarification_questions": [
+        {"question": "希望音乐表达什么情感？", "options": ["平静", "浪漫", "怀旧", "欢快"], "question_id": "mood"}
+    ]
+}
+
+PROMPT_RESULT = {
+    "interface": "gen_bgm",
+    "mood": ["calm"],
+    "text": "夏夜海边的背景纯音乐",
+    "genre": ["ambient"],
+    "theme": ["meditation"],
+    "duration": 30,
+    "instrument": ["piano"]
+}
+
+# 响应结构及其默认权重
+SHAPES = ("content_list", "content_str", "output_text")
+
+class MockConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.latency = args.latency
+        self.jitter = args.jitter
+        self.error_rate = args.error_rate
+        self.api_error_rate = args.api_error_rate
+        self.markdown_rate = args.markdown_rate
+        self.shapes = [s.strip() for s in args.shapes.split(",") if s.strip()]
+        self.chunk_chars = args.chunk_chars
+        self.token_interval = args.token_interval
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def delay(self) -> None:
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+def build_text(config: MockConfig, payload: Dict[str, Any]) -> str:
+    """根据请求内容选择返回分析结果还是最终提示词"""
+    messages = payload.get("input", {}).get("messages", [])
+    system = messages[0].get("content", "") if messages else ""
+    result = PROMPT_RESULT if "音乐生成专家" in str(system) else ANALYSIS_RESULT
+    text = json.dumps(result, ensure_ascii=False)
+    if random.random() < config.markdown_rate:
+        text = f"好的，以下是分析结果：\n```json\n{text}\n```"
+    return text
+
+def build_body(config: MockConfig, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """包装成随机的响应结构"""
+    text = build_text(config, payload)
+    shape = random.choice(config.shapes)
+    usage = {"input_tokens": 600, "output_tokens": len(text) // 2}
+    if shape == "content_list":
+        output = {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": [{"text": text}]}}]}
+    elif shape == "content_str":
+        output = {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": text}}]}
+    else:
+        output = {"text": text, "finish_reason": "stop"}
+    return {"output": output, "usage": usage, "request_id": f"mock-{random.getrandbits(48):012x}"}
+
+def make_handler(config: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            with config.lock:
+                config.requests += 1
+            config.delay()
+
+            if random.random() < config.error_rate:
+                self._send(503, {"code": "ServiceUnavailable", "message": "mock upstream error"})
+                return
+            if random.random() < config.api_error_rate:
+                self._send(200, {"code": "InvalidParameter", "message": "mock api error"})
+                return
+            if self.headers.get("X-DashScope-SSE", "").lower() == "enable":
+                self._stream(build_text(config, payload))
+                return
+            self._send(200, build_body(config, payload))
+
+        def _stream(self, text: str) -> None:
+            """按DashScope SSE格式逐段发送增量文本，发送完毕后关闭连接"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream;charset=UTF-8")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            request_id = f"mock-{random.getrandbits(48):012x}"
+            chunks = [text[i:i + config.chunk_chars] for i in range(0, len(text), config.chunk_chars)]
+            for n, chunk in enumerate(chunks, 1):
+                finish = "stop" if n == len(chunks) else "null"
+                data = {
+                    "output": {"choices": [{"finish_reason": finish, "message": {"role": "assistant", "content": [{"text": chunk}]}}]},
+                    "usage": {"input_tokens": 600, "output_tokens": n},
+                    "request_id": request_id,
+                }
+                event = f"id:{n}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n"
+                try:
+                    self.wfile.write(event.encode("utf-8"))
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                time.sleep(config.token_interval)
+
+    return Handler
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.8, help="平均响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟标准差（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回HTTP 503的比例")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="返回200但为业务错误体的比例")
+    parser.add_argument("--markdown-rate", type=float, default=0.3, help="JSON被markdown代码块包裹的比例")
+    parser.add_argument("--chunk-chars", type=int, default=6, help="流式模式下每个事件的字符数")
+    parser.add_argument("--token-interval", type=float, default=0.03, help="流式模式下事件间隔（秒）")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="参与随机的响应结构，逗号分隔")
+    return parser
+
+def serve(args: argparse.Namespace) -> ThreadingHTTPServer:
+    """在后台线程启动服务并返回server对象（供load_driver内嵌启动）"""
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockConfig(args)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-dashscope", daemon=True).start()
+    return server
+
+def main():
+    args = build_parser().parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockConfig(args)))
+    server.daemon_threads = True
+    print(f"Mock DashScope 已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
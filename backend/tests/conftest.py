@@ -0,0 +1,6 @@
+import os
+
+# 上游服务在导入时检查凭据配置；测试不访问真实上游，未配置时使用占位值
+os.environ.setdefault("DASHSCOPE_API_KEY", "test-dashscope-key")
+os.environ.setdefault("COZE_TOKEN", "test-coze-token")
+os.environ.setdefault("COZE_BOT_ID", "test-bot")
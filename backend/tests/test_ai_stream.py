@@ -0,0 +1,72 @@
+import json
+from typing import Any, List, Tuple
+import pytest
+from app.models.schemas import AIAnalysis, InputType, UserInput
+from app.services import ai_service as ai_module
+from app.services.ai_service import ai_service
+
+ANALYSIS = {
+    "understanding": "夏夜的海边，微风和海浪",
+    "music_elements": {"style": "氛围", "mood": "平静", "instruments": ["钢琴", "合成器"], "tempo": "慢"},
+    "needs_clarification": True,
+    "clarification_questions": [],
+}
+TEXT_INPUT = UserInput(input_type=InputType.TEXT, text_content="夏夜海边")
+
+def _sse(text: str, size: int) -> List[str]:
+    lines = []
+    for i in range(0, len(text), size):
+        chunk = {"output": {"choices": [{"message": {"content": [{"text": text[i:i + size]}]}}]}}
+        lines += ["event:result", "data:" + json.dumps(chunk, ensure_ascii=False), ""]
+    return lines
+
+class _Response:
+    def __init__(self, status_code: int, lines: List[str]):
+        self.status_code = status_code
+        self.lines = lines
+        self.headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+def _stream(monkeypatch, response: _Response) -> List[Tuple[str, Any]]:
+    monkeypatch.setattr(ai_module.requests, "post", lambda *args, **kwargs: response)
+    return list(ai_service.stream_analysis(TEXT_INPUT))
+
+def test_events_arrive_in_order_while_streaming(monkeypatch):
+    content = json.dumps(ANALYSIS, ensure_ascii=False)
+    events = _stream(monkeypatch, _Response(200, _sse(content, 7)))
+    kinds = [kind for kind, _ in events]
+    first_elements = kinds.index("music_elements")
+    assert set(kinds[:first_elements]) == {"understanding"} and kinds.count("understanding") > 1
+    assert kinds[first_elements:] == ["music_elements", "clarification_questions", "analysis"]
+    assert "".join(value for kind, value in events if kind == "understanding") == ANALYSIS["understanding"]
+    assert events[first_elements][1] == ANALYSIS["music_elements"]
+    analysis = events[-1][1]
+    assert isinstance(analysis, AIAnalysis) and analysis.understanding == ANALYSIS["understanding"]
+    # 最终结果中的问题就是流式推送过的那一组
+    assert analysis.clarification_questions == events[first_elements + 1][1]
+
+def test_http_error_falls_back_to_local_analysis(monkeypatch):
+    events = _stream(monkeypatch, _Response(500, []))
+    assert [kind for kind, _ in events] == ["analysis"]
+    assert isinstance(events[0][1], AIAnalysis)
+
+def test_sse_error_event_raises():
+    response = _Response(200, ["event:error", 'data:{"code": "Throttling", "message": "rate limited"}'])
+    with pytest.raises(Exception, match="rate limited"):
+        list(ai_service._iter_sse_text(response))
+
+def test_sse_text_format_and_empty_choices():
+    response = _Response(200, [
+        'data:{"output": {"choices": []}}', "",
+        'data:{"output": {"text": "片段"}}', "",
+        'data:{"output": {"choices": [{"message": {"content": "正文"}}]}}', "",
+    ])
+    assert list(ai_service._iter_sse_text(response)) == ["片段", "正文"]
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from typing import Any, Dict, List
+import pytest
+from app.services import batch_service
+from app.services.batch_service import BatchItem, BatchRunner
+from app.services.rate_limiter import RateLimiter
+from app.services.state_store import MemoryStateStore
+
+@pytest.fixture
+def limiter(monkeypatch) -> RateLimiter:
+    limiter = RateLimiter(MemoryStateStore())
+    limiter.upstream_caps = {"dashscope": 2}
+    monkeypatch.setattr(batch_service, "rate_limiter", limiter)
+    return limiter
+
+def _runner(parallelism: int = 4, upstream_wait: float = 5) -> BatchRunner:
+    return BatchRunner(MemoryStateStore(), parallelism=parallelism, ttl=60, upstream_wait=upstream_wait)
+
+def _collect(runner: BatchRunner, batch_id: str, items: List[BatchItem], process) -> List[Dict[str, Any]]:
+    async def run():
+        return [line async for line in runner.run(batch_id, items, process)]
+    return asyncio.run(run())
+
+def _texts(*texts) -> List[BatchItem]:
+    return [BatchItem(i, f"c{i}", "text", text=text) for i, text in enumerate(texts)]
+
+def test_duplicates_are_processed_once(limiter):
+    calls = []
+    lines = _collect(_runner(), "b1", _texts("海边", "山间", "海边"),
+                     lambda item: calls.append(item.text) or {"mood": item.text})
+    assert sorted(calls) == ["山间", "海边"]
+    items = sorted((line for line in lines if line["type"] == "item"), key=lambda line: line["index"])
+    assert [(line["id"], line["mood"]) for line in items] == [("c0", "海边"), ("c1", "山间"), ("c2", "海边")]
+    assert items[2]["duplicate_of"] == 0
+    assert lines[-1] == {"type": "summary", "batch_id": "b1", "inputs": 3, "unique": 2,
+                         "succeeded": 2, "failed": 0, "resumed": 0}
+
+def test_resubmission_reuses_successful_results(limiter):
+    runner = _runner()
+
+    def flaky(item):
+        if item.text == "坏":
+            raise ValueError("解析失败")
+        return {"mood": item.text}
+
+    first = _collect(runner, "b1", _texts("好", "坏"), flaky)
+    assert first[-1]["succeeded"] == 1 and first[-1]["failed"] == 1
+    assert runner.get_batch("b1")["total"] == 2 and len(runner.get_batch("b1")["failed"]) == 1
+
+    calls = []
+    second = _collect(runner, "b1", _texts("好", "坏"), lambda item: calls.append(item.text) or {"mood": "修复"})
+    assert calls == ["坏"]
+    assert {line["index"]: line["cached"] for line in second if line["type"] == "item"} == {0: True, 1: False}
+    assert second[-1]["resumed"] == 1 and second[-1]["succeeded"] == 2
+    assert runner.get_batch("b1")["failed"] == []
+
+def test_upstream_cap_bounds_concurrency(limiter):
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def slow(item):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        threading.Event().wait(0.05)
+        with lock:
+            active[0] -= 1
+        return {}
+
+    lines = _collect(_runner(parallelism=8), "b1", _texts(*map(str, range(6))), slow)
+    assert lines[-1]["succeeded"] == 6
+    assert peak[0] <= 2
+    assert limiter.acquire_upstream("dashscope") and limiter.acquire_upstream("dashscope")
+
+def test_upstream_busy_fails_item(limiter):
+    held = [limiter.acquire_upstream("dashscope") for _ in range(2)]
+    lines = _collect(_runner(upstream_wait=0.1), "b1", _texts("海边"), lambda item: {})
+    assert lines[0]["status"] == "failed" and "繁忙" in lines[0]["error"]
+    for lease_id in held:
+        limiter.release_upstream("dashscope", lease_id)
@@ -0,0 +1,82 @@
+import threading
+import time
+import pytest
+from app.services.concurrency_limiter import AdaptiveLimiter, UpstreamOverloaded
+from app.services.deadline import deadline
+
+def _limiter(limit: int = 1, max_queue: int = 4, queue_timeout: float = 2.0) -> AdaptiveLimiter:
+    return AdaptiveLimiter(
+        "test", initial=limit, min_limit=1, max_limit=limit, tolerance=1.5, smoothing=0.2, backoff=0.9,
+        max_error_rate=0.1, max_queue=max_queue, queue_timeout=queue_timeout, long_window=10,
+    )
+
+def _hold(limiter: AdaptiveLimiter, release: threading.Event) -> threading.Thread:
+    """占满一个名额直到release被设置"""
+    acquired = threading.Event()
+
+    def run():
+        with limiter.acquire():
+            acquired.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert acquired.wait(5)
+    return thread
+
+def test_queued_call_gets_slot_when_released():
+    limiter = _limiter()
+    release = threading.Event()
+    holder = _hold(limiter, release)
+    threading.Timer(0.1, release.set).start()
+    with limiter.acquire():
+        assert limiter.in_flight == 1
+    holder.join()
+    assert limiter.shed == 0 and limiter.queued == 0 and limiter.in_flight == 0
+
+def test_queued_call_sheds_after_queue_timeout():
+    limiter = _limiter(queue_timeout=0.1)
+    release = threading.Event()
+    holder = _hold(limiter, release)
+    with pytest.raises(UpstreamOverloaded):
+        with limiter.acquire():
+            pass
+    release.set()
+    holder.join()
+    assert limiter.shed == 1 and limiter.queued == 0
+
+def test_queue_wait_bounded_by_request_deadline():
+    limiter = _limiter(queue_timeout=5.0)
+    release = threading.Event()
+    holder = _hold(limiter, release)
+    start = time.monotonic()
+    with deadline(0.1), pytest.raises(UpstreamOverloaded):
+        with limiter.acquire():
+            pass
+    assert time.monotonic() - start < 1.0
+    release.set()
+    holder.join()
+
+def test_full_queue_sheds_immediately():
+    limiter = _limiter(max_queue=0)
+    release = threading.Event()
+    holder = _hold(limiter, release)
+    with pytest.raises(UpstreamOverloaded) as exc:
+        with limiter.acquire():
+            pass
+    assert exc.value.reason == "排队已满"
+    release.set()
+    holder.join()
+
+def test_try_acquire_does_not_queue():
+    limiter = _limiter()
+    release = threading.Event()
+    holder = _hold(limiter, release)
+    assert limiter.try_acquire() is None
+    assert limiter.queued == 0 and limiter.shed == 0
+    release.set()
+    holder.join()
+    slot = limiter.try_acquire()
+    assert slot is not None and limiter.in_flight == 1
+    limiter.release(slot, observe=False)
+    assert limiter.in_flight == 0
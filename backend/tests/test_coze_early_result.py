@@ -0,0 +1,70 @@
+import json
+from typing import Dict, List
+import pytest
+from app.services import coze_music_service as coze
+from app.services.metrics import COZE_PARSE_RESULT
+
+SONG = json.dumps({"code": 0, "data": {"SongDetail": {"AudioUrl": "http://cdn/song.mp3", "Lyrics": "[00:01.00]一"}}})
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, messages: List[Dict]):
+        self.messages = messages
+
+    def json(self):
+        return {"data": self.messages}
+
+def _parse_count() -> float:
+    return sum(value for _, value in COZE_PARSE_RESULT._snapshot_shards())
+
+@pytest.fixture
+def messages(monkeypatch) -> List[Dict]:
+    messages: List[Dict] = []
+    monkeypatch.setattr(coze.requests, "get", lambda url, **kwargs: _Response(list(messages)))
+    return messages
+
+def _peek(seen):
+    return coze.coze_music_service._peek_chat_messages("chat", "conv", {}, seen)
+
+def test_only_plugin_results_are_trusted(messages):
+    messages.append({"id": "m1", "type": "answer", "content": "http://cdn/half-written.mp3"})
+    seen = set()
+    assert _peek(seen) == (None, None)
+    assert seen == set()
+
+def test_plugin_result_without_content_is_checked_again(messages):
+    messages.append({"id": "m1", "type": "tool_response", "content": ""})
+    seen = set()
+    assert _peek(seen) == (None, None)
+    assert seen == set()
+    messages[0] = {"id": "m1", "type": "tool_response", "content": SONG}
+    assert _peek(seen) == ("http://cdn/song.mp3", "[00:01.00]一")
+
+def test_seen_messages_are_parsed_once_and_not_counted(messages, monkeypatch):
+    messages.append({"id": "m1", "type": "tool_response", "content": json.dumps({"name": "yinleshengcheng"})})
+    parsed = []
+    original = coze.coze_music_service._parse_music_content
+    monkeypatch.setattr(coze.coze_music_service, "_parse_music_content",
+                        lambda content: parsed.append(content) or original(content))
+    seen = set()
+    before = _parse_count()
+    assert _peek(seen) == (None, None)
+    assert _peek(seen) == (None, None)
+    assert len(parsed) == 1 and seen == {"m1"}
+    assert _parse_count() == before
+
+def test_found_url_is_counted_once(messages):
+    messages.extend([
+        {"id": "m1", "type": "tool_response", "content": json.dumps({"code": 4000, "msg": "busy"})},
+        {"id": "m2", "type": "tool_output", "content": SONG},
+    ])
+    before = _parse_count()
+    assert _peek(set()) == ("http://cdn/song.mp3", "[00:01.00]一")
+    assert _parse_count() == before + 1
+
+def test_request_failure_keeps_polling(monkeypatch):
+    def fail(url, **kwargs):
+        raise ConnectionError("reset")
+    monkeypatch.setattr(coze.requests, "get", fail)
+    assert _peek(set()) == (None, None)
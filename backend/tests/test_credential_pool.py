@@ -0,0 +1,78 @@
+import time
+import pytest
+from app.services.credential_pool import (
+    Credential, CredentialNotFound, CredentialPool, _coze_credentials, _dashscope_credentials
+)
+from app.services.state_store import MemoryStateStore
+
+def _pool(count: int = 3) -> CredentialPool:
+    return CredentialPool(MemoryStateStore(), "dashscope", [Credential(f"key{i}", f"sk-{i}") for i in range(count)],
+                          quarantine=60)
+
+def test_picks_least_outstanding_then_least_used():
+    pool = _pool()
+    with pool.lease() as first, pool.lease() as second, pool.lease() as third:
+        assert {first.name, second.name, third.name} == {"key0", "key1", "key2"}
+        with pool.lease() as fourth:
+            assert fourth.name == "key0"
+    with pool.lease() as fifth:
+        # 都空闲时选累计请求最少的
+        assert fifth.name == "key1"
+
+def test_throttled_credential_is_quarantined():
+    pool = _pool(2)
+    with pool.lease() as lease:
+        lease.throttled()
+    throttled = lease.name
+    for _ in range(3):
+        with pool.lease() as lease:
+            assert lease.name != throttled
+    stats = {row["name"]: row for row in pool.stats()}
+    assert stats[throttled]["throttled"] == 1 and stats[throttled]["quarantined_for"] > 0
+
+def test_all_quarantined_returns_earliest_release():
+    pool = _pool(2)
+    pool.quarantine(pool.get("key0"), 30)
+    pool.quarantine(pool.get("key1"), 10)
+    with pool.lease() as lease:
+        assert lease.name == "key1"
+
+def test_quarantine_expires(monkeypatch):
+    pool = _pool(2)
+    pool.quarantine(pool.get("key0"), 10)
+    with pool.lease() as lease:
+        assert lease.name == "key1"
+    later = time.time() + 11
+    monkeypatch.setattr(time, "time", lambda: later)
+    with pool.lease() as lease:
+        assert lease.name == "key0"
+
+def test_lease_by_name_and_unknown_name():
+    pool = _pool()
+    with pool.lease("key2") as lease:
+        assert lease.secret == "sk-2"
+    with pytest.raises(CredentialNotFound) as info:
+        with pool.lease("removed"):
+            pass
+    assert info.value.name == "removed" and "removed" in info.value.message
+    assert all(c.outstanding == 0 for c in pool.credentials)
+
+def test_exception_counts_as_error_and_releases():
+    pool = _pool(1)
+    with pytest.raises(RuntimeError):
+        with pool.lease():
+            raise RuntimeError("upstream")
+    [row] = pool.stats()
+    assert row["errors"] == 1 and row["outstanding"] == 0 and row["requests"] == 1
+
+def test_credentials_from_env(monkeypatch):
+    monkeypatch.setenv("DASHSCOPE_API_KEYS", "sk-aaaaaaaa1111, sk-bbbbbbbb2222")
+    assert [c.name for c in _dashscope_credentials()] == ["dashscope-0-1111", "dashscope-1-2222"]
+    monkeypatch.setenv("COZE_CREDENTIALS", "pat_aaaaaaaa1111:bot1,pat:bbbb:bot2,invalid")
+    assert [(c.secret, c.extra["bot_id"]) for c in _coze_credentials()] == [
+        ("pat_aaaaaaaa1111", "bot1"), ("pat:bbbb", "bot2"),
+    ]
+    monkeypatch.delenv("COZE_CREDENTIALS")
+    monkeypatch.setenv("COZE_TOKEN", "pat_x")
+    monkeypatch.setenv("COZE_BOT_IDS", "b1,b2")
+    assert [c.extra["bot_id"] for c in _coze_credentials()] == ["b1", "b2"]
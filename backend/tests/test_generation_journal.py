@@ -0,0 +1,131 @@
+import glob
+import io
+import json
+import os
+import time
+from typing import List
+import pytest
+from app.models.schemas import MusicPrompt
+from app.services.generation_journal import GenerationJournal, current_session
+from app.services.state_store import MemoryStateStore
+
+PROMPT = MusicPrompt(interface="gen_bgm", mood=["平静"])
+
+def _journal(directory, compact_every: int = 100, max_age: float = 3600) -> GenerationJournal:
+    return GenerationJournal(MemoryStateStore(), str(directory), fsync_interval=0.001, compact_every=compact_every,
+                             max_age=max_age, result_ttl=60, adopt_interval=0)
+
+def _submit(journal: GenerationJournal, session_id: str, chat_id: str) -> str:
+    token = current_session.set(session_id)
+    try:
+        return journal.submitted(chat_id, f"conv-{chat_id}", PROMPT, credential="main")
+    finally:
+        current_session.reset(token)
+
+def _files(directory) -> List[str]:
+    return glob.glob(os.path.join(str(directory), "journal-*.jsonl"))
+
+def _lines(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+@pytest.fixture
+def journals():
+    opened: List[GenerationJournal] = []
+    yield opened
+    for journal in opened:
+        journal.close()
+
+def test_replay_returns_unfinished_entries_and_skips_torn_line():
+    events = [
+        {"id": "a", "state": "submitted", "chat_id": "1"},
+        {"id": "b", "state": "submitted", "chat_id": "2"},
+        {"id": "a", "state": "completed"},
+        {"id": "c", "state": "submitted", "chat_id": "3"},
+        {"id": "c", "state": "failed"},
+    ]
+    raw = "".join(json.dumps(event) + "\n" for event in events) + '{"id": "d", "state": "subm'
+    assert [entry["id"] for entry in GenerationJournal._replay(io.StringIO(raw))] == ["b"]
+
+def test_submission_needs_session_and_directory(tmp_path, journals):
+    journal = _journal(tmp_path)
+    journals.append(journal)
+    assert journal.submitted("chat", "conv", PROMPT) is None
+    assert _journal("").submitted("chat", "conv", PROMPT) is None
+    assert _submit(journal, "s1", "chat") is not None
+    [path] = _files(tmp_path)
+    [entry] = _lines(path)
+    assert entry["session_id"] == "s1" and entry["chat_id"] == "chat" and entry["credential"] == "main"
+
+def test_compaction_keeps_only_unfinished_entries(tmp_path, journals):
+    journal = _journal(tmp_path, compact_every=2)
+    journals.append(journal)
+    ids = [_submit(journal, f"s{i}", f"chat{i}") for i in range(3)]
+    journal.finished(ids[0], True, "http://music/0.mp3", None)
+    journal.finished(ids[1], False, "上游失败", None)
+    [path] = _files(tmp_path)
+    assert [entry["id"] for entry in _lines(path)] == [ids[2]]
+    assert journal.pending() == 1
+    assert journal.result("s0")["music_url"] == "http://music/0.mp3"
+    assert journal.result("s1")["error"] == "上游失败"
+
+def test_close_removes_file_only_when_nothing_is_pending(tmp_path):
+    journal = _journal(tmp_path)
+    journal.finished(_submit(journal, "s1", "chat1"), True, "http://music/1.mp3", None)
+    journal.close()
+    assert _files(tmp_path) == []
+
+def test_orphan_is_adopted_and_resumed(tmp_path, journals):
+    dead = _journal(tmp_path)
+    _submit(dead, "s1", "chat1")
+    finished = _submit(dead, "s2", "chat2")
+    dead.finished(finished, True, "http://music/2.mp3", None)
+    dead.close()
+    [orphan] = _files(tmp_path)
+
+    journal = _journal(tmp_path)
+    journals.append(journal)
+    resumed = []
+
+    def resume(chat_id, conversation_id, credential):
+        resumed.append((chat_id, conversation_id, credential))
+        return True, "http://music/1.mp3", "歌词"
+
+    assert journal.recover(resume, lambda job, interface: job()) == 1
+    assert resumed == [("chat1", "conv-chat1", "main")]
+    assert journal.result("s1")["lyrics"] == "歌词"
+    assert journal.pending() == 0
+    assert orphan not in _files(tmp_path)
+
+def test_live_journal_is_not_adopted(tmp_path, journals):
+    live = _journal(tmp_path)
+    journals.append(live)
+    _submit(live, "s1", "chat1")
+    other = _journal(tmp_path)
+    journals.append(other)
+    assert other.recover(lambda *args: (True, "", None), lambda job, interface: job()) == 0
+    assert live.pending() == 1
+
+def test_expired_orphan_is_failed_without_resuming(tmp_path, journals, monkeypatch):
+    dead = _journal(tmp_path)
+    _submit(dead, "s1", "chat1")
+    dead.close()
+    journal = _journal(tmp_path, max_age=60)
+    journals.append(journal)
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert journal.recover(lambda *args: pytest.fail("不应恢复"), lambda job, interface: job()) == 0
+    assert journal.result("s1")["error"] == "生成任务已过期"
+
+def test_closed_journal_leaves_orphan_on_disk(tmp_path):
+    dead = _journal(tmp_path)
+    _submit(dead, "s1", "chat1")
+    dead.close()
+    [orphan] = _files(tmp_path)
+    # 下线交接：接管时本进程日志已关闭，条目写不进去，原文件必须保留
+    journal = _journal(tmp_path)
+    journal.close()
+    assert journal._adopt_orphans() == []
+    assert journal.pending() == 0
+    assert _files(tmp_path) == [orphan]
+    assert len(_lines(orphan)) == 1
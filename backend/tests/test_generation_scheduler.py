@@ -0,0 +1,99 @@
+import threading
+from typing import List
+import pytest
+from app.services.deadline import DeadlineExceeded, deadline
+from app.services.generation_scheduler import (
+    GenerationJob, GenerationScheduler, SchedulerClosed, estimate_cost, DEFAULT_MAX_WAIT
+)
+
+def _scheduler(workers: int = 1) -> GenerationScheduler:
+    return GenerationScheduler(workers=workers, max_wait=dict(DEFAULT_MAX_WAIT))
+
+def _run_in_order(submissions) -> List[str]:
+    """单个工作线程先被占住，再按submissions提交任务，返回执行顺序"""
+    scheduler = _scheduler()
+    started, gate = threading.Event(), threading.Event()
+    scheduler.submit(lambda: (started.set(), gate.wait(5)), user_id="gate", interface="gen_bgm")
+    assert started.wait(5)
+    order: List[str] = []
+    futures = [
+        scheduler.submit(lambda label=label: order.append(label), user_id=user, interface=interface,
+                         duration=duration, priority=priority)
+        for label, user, interface, duration, priority in submissions
+    ]
+    gate.set()
+    for future in futures:
+        future.result(5)
+    scheduler.close()
+    return order
+
+def test_users_are_interleaved_within_a_class():
+    order = _run_in_order(
+        [(f"a{i}", "alice", "gen_bgm", 30, "interactive") for i in range(4)]
+        + [("b0", "bob", "gen_bgm", 30, "interactive")]
+    )
+    assert order == ["a0", "b0", "a1", "a2", "a3"]
+
+def test_short_job_is_not_stuck_behind_a_long_one():
+    order = _run_in_order([
+        ("long", "alice", "lyrics_gen_song", 180, "interactive"),
+        ("short", "bob", "gen_bgm", 30, "interactive"),
+    ])
+    assert order == ["short", "long"]
+
+def test_higher_priority_class_runs_first():
+    order = _run_in_order([
+        ("background", "warm-pool", "gen_bgm", 30, "background"),
+        ("bulk", "alice", "gen_bgm", 30, "bulk"),
+        ("interactive", "bob", "gen_bgm", 30, "interactive"),
+    ])
+    assert order == ["interactive", "bulk", "background"]
+
+def test_overdue_job_beats_priority():
+    # 排队超过本类别max_wait的任务无视优先级先执行，防止饿死
+    def pick(waited: float) -> str:
+        scheduler = _scheduler()
+        background = GenerationJob(0, "warm-pool", "background", "gen_bgm", 1.0, lambda: None)
+        interactive = GenerationJob(1, "alice", "interactive", "gen_bgm", 1.0, lambda: None)
+        interactive.enqueued_at = background.enqueued_at + waited - 1
+        scheduler._queues["background"].push(background)
+        scheduler._queues["interactive"].push(interactive)
+        return scheduler._pick(background.enqueued_at + waited).user_id
+
+    assert pick(DEFAULT_MAX_WAIT["background"] - 1) == "alice"
+    assert pick(DEFAULT_MAX_WAIT["background"] + 1) == "warm-pool"
+
+def test_most_overdue_class_wins():
+    scheduler = _scheduler()
+    bulk = GenerationJob(0, "alice", "bulk", "gen_bgm", 1.0, lambda: None)
+    interactive = GenerationJob(1, "bob", "interactive", "gen_bgm", 1.0, lambda: None)
+    interactive.enqueued_at = bulk.enqueued_at
+    scheduler._queues["bulk"].push(bulk)
+    scheduler._queues["interactive"].push(interactive)
+    # 等待200秒：interactive超时3.3倍，bulk超时1.1倍
+    assert scheduler._pick(bulk.enqueued_at + 200) is interactive
+
+def test_estimate_cost_weights_interface_and_duration():
+    assert estimate_cost("gen_bgm", 30) == 1.0
+    assert estimate_cost("gen_song", 60) == 4.0
+    assert estimate_cost("gen_bgm", 1) == estimate_cost("gen_bgm", 10)
+
+def test_closed_scheduler_rejects_new_jobs():
+    scheduler = _scheduler()
+    scheduler.close()
+    with pytest.raises(SchedulerClosed):
+        scheduler.submit(lambda: None, user_id="alice", interface="gen_bgm")
+
+def test_job_past_its_deadline_is_not_run():
+    scheduler = _scheduler()
+    started, gate = threading.Event(), threading.Event()
+    scheduler.submit(lambda: (started.set(), gate.wait(5)), user_id="gate", interface="gen_bgm")
+    assert started.wait(5)
+    ran = threading.Event()
+    with deadline(0.01):
+        future = scheduler.submit(ran.set, user_id="alice", interface="gen_bgm")
+    threading.Timer(0.05, gate.set).start()
+    with pytest.raises(DeadlineExceeded):
+        future.result(5)
+    assert not ran.is_set()
+    scheduler.close()
@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from starlette.requests import Request
+from app.api import idempotency
+from app.api.idempotency import IdempotencyError, IdempotentReplay
+from app.services.state_store import MemoryStateStore
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch) -> MemoryStateStore:
+    store = MemoryStateStore()
+    monkeypatch.setattr(idempotency, "state_store", store)
+    return store
+
+def _request(key=None, body: bytes = b'{"prompt": 1}', user: str = "alice", path: str = "/api/generate") -> Request:
+    headers = [(b"x-user-id", user.encode())]
+    if key is not None:
+        headers.append((b"idempotency-key", key.encode()))
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers, "query_string": b"",
+             "client": ("127.0.0.1", 1234)}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+def _check(request: Request):
+    asyncio.run(idempotency.idempotency("generate")(request))
+    return getattr(request.state, "idempotency_claim", None)
+
+def test_without_key_nothing_is_claimed():
+    assert _check(_request()) is None
+
+@pytest.mark.parametrize("key", ["   ", "k" * 256])
+def test_invalid_key(key):
+    with pytest.raises(IdempotencyError) as info:
+        _check(_request(key))
+    assert info.value.status_code == 400
+
+def test_completed_request_is_replayed():
+    claim = _check(_request("k1"))
+    claim.complete(200, b'{"ok": true}', {"content-type": "application/json", "content-length": "12", "x-a": "1"})
+    with pytest.raises(IdempotentReplay) as info:
+        _check(_request("k1"))
+    response = info.value.to_response()
+    assert response.status_code == 200 and response.body == b'{"ok": true}'
+    assert response.headers["idempotent-replayed"] == "true" and response.headers["x-a"] == "1"
+    assert response.headers["content-length"] == "12"
+
+def test_keys_are_scoped_per_caller():
+    _check(_request("k1", user="alice")).complete(200, b"{}", {})
+    assert _check(_request("k1", user="bob")) is not None
+
+def test_same_key_with_different_body_is_rejected():
+    _check(_request("k1", body=b'{"prompt": 1}'))
+    with pytest.raises(IdempotencyError) as info:
+        _check(_request("k1", body=b'{"prompt": 2}'))
+    assert info.value.status_code == 422
+    with pytest.raises(IdempotencyError) as info:
+        _check(_request("k1", path="/api/generate-variants"))
+    assert info.value.status_code == 422
+
+def test_in_progress_duplicate_times_out_with_409(monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT", 0)
+    assert _check(_request("k1")) is not None
+    with pytest.raises(IdempotencyError) as info:
+        _check(_request("k1"))
+    assert info.value.status_code == 409 and info.value.retry_after == 5
+
+def test_duplicate_waits_for_original_to_finish():
+    claim = _check(_request("k1"))
+
+    async def run():
+        async def finish():
+            await asyncio.sleep(0.05)
+            claim.complete(201, b"done", {})
+        task = asyncio.ensure_future(finish())
+        with pytest.raises(IdempotentReplay) as info:
+            await idempotency.idempotency("generate")(_request("k1"))
+        await task
+        return info.value.record
+
+    assert asyncio.run(run())["status_code"] == 201
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_failed_request_releases_key(status_code):
+    _check(_request("k1")).complete(status_code, b"error", {})
+    assert _check(_request("k1")) is not None
+
+def test_release_keeps_a_newer_claim():
+    stale = _check(_request("k1"))
+    stale.release()
+    fresh = _check(_request("k1"))
+    stale.release()
+    fresh.complete(200, b"{}", {})
+    with pytest.raises(IdempotentReplay):
+        _check(_request("k1"))
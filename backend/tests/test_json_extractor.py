@@ -0,0 +1,53 @@
+import json
+import pytest
+from app.utils.json_extractor import JSONStreamExtractor, extract_json
+
+ANALYSIS = {"understanding": "夏夜海边", "questions": [{"q": "情绪？", "options": ["平静", "欢快"]}]}
+
+def test_plain_json():
+    assert extract_json(json.dumps(ANALYSIS, ensure_ascii=False)) == ANALYSIS
+
+def test_markdown_fence_and_surrounding_text():
+    content = "好的，分析如下：\n```json\n" + json.dumps(ANALYSIS, ensure_ascii=False) + "\n```\n希望有帮助"
+    assert extract_json(content) == ANALYSIS
+
+def test_trailing_commas():
+    assert extract_json('{"a": [1, 2, ], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+
+def test_fullwidth_quotes_in_structure():
+    assert extract_json('{“mood”: “平静”, "genre": ＂ambient＂}') == {"mood": "平静", "genre": "ambient"}
+
+def test_fullwidth_quotes_inside_strings_are_kept():
+    assert extract_json('{"text": "他说“你好”"}') == {"text": "他说“你好”"}
+
+def test_unescaped_quotes_inside_string():
+    assert extract_json('{"text": "她说"你好"然后走了", "n": 1}') == {"text": '她说"你好"然后走了', "n": 1}
+
+def test_truncated_output_is_closed():
+    extractor = JSONStreamExtractor().feed('{"understanding": "夏夜", "questions": [{"q": "情绪？", "options": ["平静"')
+    assert extractor.result() == {"understanding": "夏夜", "questions": [{"q": "情绪？", "options": ["平静"]}]}
+    assert "truncated" in extractor.repairs
+
+def test_truncated_after_key_falls_back_to_last_complete_member():
+    assert extract_json('{"a": 1, "b": {"c": 2}, "d":') == {"a": 1, "b": {"c": 2}}
+
+def test_no_object_raises():
+    with pytest.raises(json.JSONDecodeError):
+        extract_json("抱歉，我无法完成这个请求")
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_streamed_chunks_match_whole_input(size):
+    content = '前言```json\n{"text": "她说"你好"", “mood”: [“平静”, "欢快",], "esc": "a\\\\b\\"c"}\n```'
+    extractor = JSONStreamExtractor()
+    for i in range(0, len(content), size):
+        extractor.feed(content[i:i + size])
+    assert extractor.done
+    assert extractor.result() == extract_json(content)
+
+def test_snapshot_grows_while_streaming():
+    extractor = JSONStreamExtractor()
+    assert extractor.snapshot() is None
+    extractor.feed('{"understanding": "夏')
+    assert extractor.snapshot() == {"understanding": "夏"}
+    extractor.feed('夜海边", "questions": [')
+    assert extractor.snapshot() == {"understanding": "夏夜海边", "questions": []}
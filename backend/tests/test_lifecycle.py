@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+from app.services.lifecycle import DrainController, ServiceDraining
+
+def test_draining_rejects_new_requests_and_waits_for_in_flight():
+    controller = DrainController(timeout=5, retry_after=7)
+    handed_off = []
+    controller.add_handoff(lambda: handed_off.append(controller.in_flight()))
+
+    async def run():
+        tracked = controller.track()
+        tracked.__enter__()
+        drain = asyncio.ensure_future(controller.drain())
+        await asyncio.sleep(0.05)
+        assert controller.draining and not drain.done()
+        with pytest.raises(ServiceDraining) as info:
+            with controller.track():
+                pass
+        assert info.value.retry_after == 7
+        tracked.__exit__(None, None, None)
+        return await drain
+
+    assert asyncio.run(run()) is True
+    assert handed_off == [0]
+
+def test_timeout_still_runs_every_handoff():
+    controller = DrainController(timeout=0.1, retry_after=5)
+    controller.add_idle_check(lambda: False)
+    order = []
+
+    def broken():
+        raise RuntimeError("flush failed")
+
+    controller.add_handoff(lambda: order.append("scheduler"))
+    controller.add_handoff(broken)
+    controller.add_handoff(lambda: order.append("journal"))
+    assert asyncio.run(controller.drain()) is False
+    assert order == ["scheduler", "journal"]
+
+def test_failed_request_is_no_longer_in_flight():
+    controller = DrainController(timeout=1, retry_after=5)
+    with pytest.raises(ValueError):
+        with controller.track():
+            assert controller.in_flight() == 1
+            raise ValueError
+    assert controller.in_flight() == 0 and controller.idle()
@@ -0,0 +1,57 @@
+from app.utils.lyrics_timeline import (
+    LAST_LINE_MS, LyricsTimeline, parse_caption_list, parse_cues, parse_lrc, parse_lyrics
+)
+
+def _rows(timeline: LyricsTimeline):
+    return list(zip(timeline.starts, timeline.ends, timeline.texts))
+
+def test_lrc_lines_end_at_next_line():
+    timeline = parse_lrc("[ti:夏夜]\n[00:01.5]第一句\n[00:04.25]第二句\n[00:07:100]第三句")
+    assert _rows(timeline) == [(1500, 4250, "第一句"), (4250, 7100, "第二句"), (7100, 7100 + LAST_LINE_MS, "第三句")]
+    assert timeline.meta == {"ti": "夏夜"}
+
+def test_lrc_repeated_stamps_offset_and_word_timing():
+    raw = "[offset:+500]\n[00:10.00][00:02.00]<00:02.00>副<00:02.50>歌\n[00:05.00]\n[00:06.00]间奏"
+    timeline = parse_lrc(raw)
+    # 空文本行只作为上一行的结束标记
+    assert _rows(timeline) == [
+        (1500, 4500, "副歌"), (5500, 9500, "间奏"), (9500, 9500 + LAST_LINE_MS, "副歌"),
+    ]
+
+def test_lrc_last_line_extends_to_duration():
+    timeline = parse_lrc("[00:01.00]唯一一句", duration_ms=60_000)
+    assert _rows(timeline) == [(1000, 60_000, "唯一一句")]
+
+def test_plain_text_has_no_timeline():
+    assert parse_lrc("没有时间标签的歌词\n第二行") is None
+    assert parse_lyrics("没有时间标签的歌词") is None
+
+def test_srt_and_vtt_cues():
+    srt = "1\n00:00:01,000 --> 00:00:03,500\n第一句\n续行\n\n2\n00:00:04,000 --> 00:00:06,000\n第二句\n"
+    assert _rows(parse_cues(srt)) == [(1000, 3500, "第一句 续行"), (4000, 6000, "第二句")]
+    vtt = "WEBVTT\n\n01:02.5 --> 01:04.000\n短格式"
+    assert _rows(parse_cues(vtt)) == [(62500, 64000, "短格式")]
+
+def test_caption_list_seconds_and_milliseconds():
+    seconds = parse_caption_list([{"text": "一", "start_time": 1.5, "end_time": 3}, {"content": "二", "start": 3}])
+    assert _rows(seconds) == [(1500, 3000, "一"), (3000, 3000 + LAST_LINE_MS, "二")]
+    millis = parse_caption_list([{"text": "一", "startTime": 4000, "endTime": 6000}, "无效项"])
+    assert _rows(millis) == [(4000, 6000, "一")]
+    assert parse_caption_list([{"start": 1}]) is None
+
+def test_parse_lyrics_detects_format():
+    assert parse_lyrics('{"captions": [{"text": "一", "start": 1, "end": 2}]}').texts == ["一"]
+    assert parse_lyrics("[00:01.00]一").texts == ["一"]
+    assert parse_lyrics("00:00:01,000 --> 00:00:02,000\n一").texts == ["一"]
+
+def test_at_finds_line_or_gap():
+    timeline = LyricsTimeline([1000, 4000, 8000], [3000, 8000, 9000], ["一", "二", "三"])
+    assert [timeline.at(ms) for ms in (0, 999, 1000, 2999, 3000, 3999, 4000, 7999, 8000, 8999, 9000)] == [
+        -1, -1, 0, 0, -1, -1, 1, 1, 2, 2, -1,
+    ]
+
+def test_compact_round_trip():
+    timeline = parse_lrc("[ar:歌手]\n[00:01.00]一\n[00:02.00]二")
+    restored = LyricsTimeline.from_compact(timeline.to_compact())
+    assert _rows(restored) == _rows(timeline)
+    assert restored.meta == {"ar": "歌手"}
@@ -0,0 +1,53 @@
+import threading
+from app.services.metrics import MetricsRegistry
+
+def _samples(registry: MetricsRegistry):
+    return [line for line in registry.render().splitlines() if not line.startswith("#")]
+
+def test_counter_merges_thread_shards():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs", "任务数", ("status",))
+    threads = [threading.Thread(target=lambda: [counter.inc(status="ok") for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(2.5, status="failed")
+    assert _samples(registry) == ['jobs_total{status="failed"} 2.5', 'jobs_total{status="ok"} 4000']
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "耗时", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, route="/a")
+    assert _samples(registry) == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 3.65',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+def test_histogram_timer_records_labels_set_inside_block():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("call_seconds", "耗时", ("outcome",))
+    with histogram.time() as labels:
+        labels["outcome"] = "ok"
+    assert 'call_seconds_count{outcome="ok"} 1' in _samples(registry)
+
+def test_render_has_help_and_type_and_escapes_labels():
+    registry = MetricsRegistry()
+    registry.counter("errors", "错误数", ("message",)).inc(message='a "b"\nc\\d')
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP errors 错误数", "# TYPE errors counter"]
+    assert lines[2] == 'errors_total{message="a \\"b\\"\\nc\\\\d"} 1'
+
+def test_gauge_callback_and_failure():
+    registry = MetricsRegistry()
+    registry.gauge("queue_depth", "排队数", ("queue",), callback=lambda: [(("bulk",), 3)])
+    registry.gauge("broken", "采集失败", callback=lambda: 1 / 0)
+    assert _samples(registry) == ['queue_depth{queue="bulk"} 3']
+
+def test_same_name_returns_registered_metric():
+    registry = MetricsRegistry()
+    assert registry.counter("jobs", "任务数") is registry.counter("jobs", "任务数")
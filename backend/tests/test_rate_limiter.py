@@ -0,0 +1,98 @@
+import time
+import pytest
+from app.services.rate_limiter import RateLimiter, _parse_rate
+from app.services.state_store import MemoryStateStore, SQLiteStateStore, StateStore
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path) -> StateStore:
+    if request.param == "sqlite":
+        return SQLiteStateStore(str(tmp_path / "state.db"))
+    return MemoryStateStore()
+
+def _limiter(store: StateStore, rate: str = "2/10", cap: int = 1, lease_ttl: float = 30) -> RateLimiter:
+    limiter = RateLimiter(store)
+    limiter.endpoint_rates = {"generate": _parse_rate(rate)}
+    limiter.upstream_caps = {"coze": cap}
+    limiter.lease_ttl = lease_ttl
+    return limiter
+
+def test_parse_rate():
+    assert _parse_rate("5/60") == (5, 60.0)
+    assert _parse_rate("5") == (5, 60.0)
+    assert _parse_rate("0") is None
+    assert _parse_rate("") is None
+
+def test_token_bucket_allows_burst_then_refills(store, clock):
+    limiter = _limiter(store, rate="2/10")
+    assert limiter.take_token("generate", "u1")[0]
+    assert limiter.take_token("generate", "u1")[0]
+    allowed, wait = limiter.take_token("generate", "u1")
+    assert not allowed and wait == pytest.approx(5.0)
+    # 其他用户有自己的桶
+    assert limiter.take_token("generate", "u2")[0]
+    clock.now += 5
+    assert limiter.take_token("generate", "u1")[0]
+    assert not limiter.take_token("generate", "u1")[0]
+
+def test_unlimited_endpoint_always_allowed(store, clock):
+    limiter = _limiter(store)
+    assert all(limiter.take_token("clarify", "u1")[0] for _ in range(100))
+
+def test_lease_cap_and_release(store, clock):
+    limiter = _limiter(store, cap=2)
+    first = limiter.acquire_upstream("coze")
+    second = limiter.acquire_upstream("coze")
+    assert first and second
+    assert limiter.acquire_upstream("coze") is None
+    limiter.release_upstream("coze", first)
+    assert limiter.acquire_upstream("coze") is not None
+
+def test_expired_lease_frees_its_slot(store, clock):
+    # worker崩溃后未释放的租约在lease_ttl后自动失效
+    limiter = _limiter(store, cap=1, lease_ttl=30)
+    lease_id = limiter.acquire_upstream("coze")
+    assert limiter.acquire_upstream("coze") is None
+    clock.now += 31
+    assert limiter.acquire_upstream("coze") is not None
+    assert not limiter.renew_lease("concurrency:coze", lease_id)
+
+def test_renewed_lease_outlives_ttl(store, clock):
+    limiter = _limiter(store, cap=1, lease_ttl=30)
+    lease_id = limiter.acquire_lease("warmpool:warmer", 1)
+    clock.now += 20
+    assert limiter.renew_lease("warmpool:warmer", lease_id)
+    clock.now += 20
+    assert limiter.acquire_lease("warmpool:warmer", 1) is None
+
+def test_upstream_busy_rejection_refunds_token(store, clock):
+    limiter = _limiter(store, rate="2/10", cap=1)
+    held = limiter.admit("generate", "u1", upstream="coze")
+    assert held.allowed
+    for _ in range(3):
+        busy = limiter.admit("generate", "u1", upstream="coze")
+        assert not busy.allowed and busy.reason == "服务繁忙"
+    held.release()
+    assert limiter.admit("generate", "u1", upstream="coze").allowed
+    rejected = limiter.admit("generate", "u1", upstream="coze")
+    assert not rejected.allowed and rejected.reason == "请求过于频繁"
+
+def test_state_store_requires_every_method():
+    class Partial(StateStore):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,91 @@
+import json
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from app.api.responses import RangeFileResponse, SelectiveGZipMiddleware, _parse_range, api_response
+from app.models.schemas import AIAnalysis, ClarificationQuestion, MusicPrompt
+
+ETAG = '"abc123"'
+BODY = bytes(range(256)) * 8
+
+def test_api_response_serializes_models_like_dict_encoding():
+    analysis = AIAnalysis(
+        understanding="夏夜海边", music_elements={"mood": "平静", "tempo": None}, needs_clarification=True,
+        clarification_questions=[ClarificationQuestion(question="情绪？", options=["平静", "欢快"], question_id="q1")],
+    )
+    prompt = MusicPrompt(interface="gen_bgm", mood=["calm"])
+    response = api_response(True, "完成", data={"analysis": analysis, "music_prompt": prompt, "count": 2},
+                            session_id="s1", status_code=201, headers={"X-A": "1"})
+    assert response.status_code == 201 and response.headers["x-a"] == "1"
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == {
+        "success": True, "message": "完成", "session_id": "s1",
+        "data": {"analysis": analysis.model_dump(), "music_prompt": prompt.model_dump(), "count": 2},
+    }
+
+def test_api_response_without_data():
+    body = json.loads(api_response(False, "会话不存在", status_code=404).body)
+    assert body == {"success": False, "message": "会话不存在", "data": None, "session_id": None}
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=100-199", (100, 199)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-10", (990, 999)),
+    ("bytes=-5000", (0, 999)),
+    (" bytes=0-0 ", (0, 0)),
+])
+def test_parse_range(value, expected):
+    assert _parse_range(value, 1000) == expected
+
+@pytest.mark.parametrize("value", ["bytes=1000-", "bytes=200-100", "bytes=-0"])
+def test_unsatisfiable_range(value):
+    with pytest.raises(ValueError):
+        _parse_range(value, 1000)
+
+@pytest.mark.parametrize("value", ["bytes=0-1,5-9", "bytes=-", "items=0-9", "bytes=a-b"])
+def test_unsupported_range_is_ignored(value):
+    assert _parse_range(value, 1000) is None
+
+@pytest.fixture
+def client(tmp_path) -> TestClient:
+    path = tmp_path / "track.mp3"
+    path.write_bytes(BODY)
+
+    async def track(request: Request):
+        return RangeFileResponse(str(path), request.headers, ETAG, "audio/mpeg")
+
+    async def text(request: Request):
+        return Response("a" * 2000, media_type="application/json")
+
+    app = Starlette(routes=[Route("/track", track, methods=["GET", "HEAD"]), Route("/text", text)])
+    app.add_middleware(SelectiveGZipMiddleware, minimum_size=500)
+    return TestClient(app)
+
+def test_full_and_partial_content(client):
+    full = client.get("/track")
+    assert full.status_code == 200 and full.content == BODY
+    assert full.headers["accept-ranges"] == "bytes" and full.headers["etag"] == ETAG
+    partial = client.get("/track", headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206 and partial.content == BODY[10:20]
+    assert partial.headers["content-range"] == f"bytes 10-19/{len(BODY)}"
+
+def test_unsatisfiable_range_returns_416(client):
+    response = client.get("/track", headers={"Range": f"bytes={len(BODY)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(BODY)}"
+
+def test_conditional_requests(client):
+    assert client.get("/track", headers={"If-None-Match": ETAG}).status_code == 304
+    stale = client.get("/track", headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+    assert stale.status_code == 200 and stale.content == BODY
+
+def test_audio_is_not_gzipped_but_json_is(client):
+    audio = client.get("/track", headers={"Accept-Encoding": "gzip", "Range": "bytes=0-999"})
+    assert "content-encoding" not in audio.headers
+    assert audio.headers["content-length"] == "1000" and audio.content == BODY[:1000]
+    text = client.get("/text", headers={"Accept-Encoding": "gzip"})
+    assert text.headers["content-encoding"] == "gzip"
@@ -0,0 +1,74 @@
+from typing import List, Optional
+from app.models.schemas import InputType, SessionStatus, UserInput
+from app.services.session_manager import SessionManager, monotonic_to_wall, wall_to_monotonic
+
+def _manager(count: int) -> SessionManager:
+    manager = SessionManager()
+    for i in range(count):
+        manager.create_session(UserInput(input_type=InputType.TEXT, text_content=f"会话{i}"))
+    return manager
+
+def _ordered_ids(manager: SessionManager, status: Optional[SessionStatus] = None) -> List[str]:
+    records = [r for r in manager.sessions.values() if status is None or r.status == status]
+    return [r.session_id for r in sorted(records, key=lambda r: r.sort_key)]
+
+def _pages(manager: SessionManager, limit: int, **filters) -> List[List[str]]:
+    pages, cursor = [], None
+    while True:
+        page, cursor = manager.list_sessions(cursor=cursor, limit=limit, **filters)
+        pages.append([record.session_id for record in page])
+        if cursor is None:
+            return pages
+
+def test_pages_cover_every_session_once_in_creation_order():
+    manager = _manager(7)
+    pages = _pages(manager, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == _ordered_ids(manager)
+
+def test_exact_multiple_of_limit_has_no_empty_trailing_page():
+    manager = _manager(6)
+    pages = _pages(manager, limit=3)
+    assert [len(page) for page in pages] == [3, 3]
+
+def test_status_filter_pages_only_matching_sessions():
+    manager = _manager(9)
+    for session_id in _ordered_ids(manager)[::2]:
+        manager.update_session_status(session_id, SessionStatus.COMPLETED)
+    pages = _pages(manager, limit=2, statuses=[SessionStatus.COMPLETED])
+    assert sum(pages, []) == _ordered_ids(manager, SessionStatus.COMPLETED)
+    assert len(sum(pages, [])) == 5
+    assert manager.count_sessions(SessionStatus.COMPLETED) == 5
+
+def test_created_time_window_is_half_open():
+    manager = _manager(5)
+    ids = _ordered_ids(manager)
+    after = manager.sessions[ids[1]].created_at
+    before = manager.sessions[ids[4]].created_at
+    page, cursor = manager.list_sessions(created_after=after, created_before=before, limit=10)
+    assert [record.session_id for record in page] == ids[1:4]
+    assert cursor is None
+
+def test_iter_sessions_walks_all_batches():
+    manager = _manager(11)
+    assert [r.session_id for r in manager.iter_sessions(batch_size=4)] == _ordered_ids(manager)
+
+def test_cursor_survives_wall_clock_round_trip():
+    # 游标以墙上时间传给客户端，再换算回单调时间
+    manager = _manager(6)
+    ids = _ordered_ids(manager)
+    page, cursor = manager.list_sessions(limit=2)
+    wall_cursor = (monotonic_to_wall(cursor[0]), cursor[1])
+    page, _ = manager.list_sessions(cursor=(wall_to_monotonic(wall_cursor[0]), wall_cursor[1]), limit=10)
+    assert [record.session_id for record in page] == ids[2:]
+
+def test_cursor_from_another_worker_never_skips_sessions():
+    # 游标指向的会话不在本进程：换算误差下宁可重复一条也不能遗漏
+    manager = _manager(6)
+    ids = _ordered_ids(manager)
+    created_at = manager.sessions[ids[1]].created_at
+    for skew in (-1e-7, 0.0, 1e-7):
+        page, _ = manager.list_sessions(cursor=(created_at + skew, "unknown-session"), limit=10)
+        returned = [record.session_id for record in page]
+        assert returned[-4:] == ids[2:]
+        assert set(returned) <= set(ids[1:])
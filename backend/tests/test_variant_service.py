@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from typing import Any, Dict, List
+import pytest
+from app.models.schemas import MusicPrompt
+from app.services import variant_service
+from app.services.coze_music_service import BGM_MOOD_VALUES, coze_music_service
+from app.services.generation_scheduler import DEFAULT_MAX_WAIT, GenerationScheduler
+from app.services.rate_limiter import RateLimiter
+from app.services.state_store import MemoryStateStore
+from app.services.variant_service import VariantRunner
+
+PROMPT = MusicPrompt(interface="gen_bgm", mood=["calm", "dreamy"], genre=["ambient"], instrument=["piano"])
+
+@pytest.fixture
+def limiter(monkeypatch) -> RateLimiter:
+    limiter = RateLimiter(MemoryStateStore())
+    limiter.upstream_caps = {"coze": 2}
+    scheduler = GenerationScheduler(workers=4, max_wait=dict(DEFAULT_MAX_WAIT))
+    monkeypatch.setattr(variant_service, "rate_limiter", limiter)
+    monkeypatch.setattr(variant_service, "generation_scheduler", scheduler)
+    yield limiter
+    scheduler.close()
+
+def _collect(runner: VariantRunner, count: int, generate, variants=None) -> List[Dict[str, Any]]:
+    variants = variants or [(PROMPT, {"n": i}) for i in range(count)]
+
+    async def run():
+        return [line async for line in runner.run("alice", variants, generate)]
+    return asyncio.run(run())
+
+def test_derive_variants_changes_one_field_each():
+    variants = coze_music_service.derive_variants(PROMPT, 4, seed="s1")
+    base, changes = variants[0]
+    assert changes == {} and base.mood == ["calm", "dreamy"]
+    assert [list(changes) for _, changes in variants[1:]] == [["mood"], ["genre"], ["instrument"]]
+    mood_variant = variants[1][0]
+    assert mood_variant.mood[0] in BGM_MOOD_VALUES and mood_variant.mood[0] not in ("calm", "dreamy")
+    assert mood_variant.mood[1:] == ["dreamy"] and mood_variant.genre == base.genre
+    assert coze_music_service.derive_variants(PROMPT, 4, seed="s1") == variants
+
+def test_derive_variants_song_fields():
+    song = MusicPrompt(interface="gen_song", mood_single="Happy", genre_single="Pop", timbre="Warm", prompt="夏天")
+    variants = coze_music_service.derive_variants(song, 3)
+    assert variants[1][1]["mood_single"] != "Happy" and variants[2][1]["genre_single"] != "Pop"
+
+def test_results_stream_and_summary_counts_failures(limiter):
+    def generate(prompt):
+        return (True, "http://cdn/a.mp3", "歌词") if prompt.mood == ["calm", "dreamy"] else (False, "bad", None)
+
+    other = PROMPT.model_copy(update={"mood": ["happy"]})
+    variants = [(PROMPT, {}), (other, {"mood": ["happy"]}), (PROMPT, {})]
+    lines = _collect(VariantRunner(per_user=4, upstream_wait=5), 3, generate, variants)
+    results = {line["index"]: line for line in lines[:3]}
+    assert [results[i]["status"] for i in range(3)] == ["done", "failed", "done"]
+    assert results[0]["lyrics"] == "歌词" and results[1]["error"] == "bad"
+    assert results[1]["changes"] == {"mood": ["happy"]}
+    assert lines[-1]["type"] == "summary" and lines[-1]["succeeded"] == 2 and lines[-1]["failed"] == 1
+
+def test_per_user_and_upstream_caps_bound_concurrency(limiter):
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def generate(prompt):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        threading.Event().wait(0.1)
+        with lock:
+            active[0] -= 1
+        return True, "http://cdn/a.mp3", None
+
+    lines = _collect(VariantRunner(per_user=3, upstream_wait=5), 4, generate)
+    assert lines[-1]["succeeded"] == 4
+    assert peak[0] == 2
+    # 全部结束后名额都已归还
+    assert limiter.acquire_upstream("coze") and limiter.acquire_upstream("coze")
+    assert limiter.acquire_lease("concurrency:variants:alice", 3)
+
+def test_busy_upstream_fails_variant(limiter):
+    held = [limiter.acquire_upstream("coze") for _ in range(2)]
+    lines = _collect(VariantRunner(per_user=4, upstream_wait=0.1), 1, lambda prompt: (True, "", None))
+    assert lines[0]["status"] == "failed" and "繁忙" in lines[0]["error"]
+    assert limiter.acquire_lease("concurrency:variants:alice", 1)
+    for lease_id in held:
+        limiter.release_upstream("coze", lease_id)
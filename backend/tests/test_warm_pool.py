@@ -0,0 +1,86 @@
+import time
+import pytest
+from app.models.schemas import MusicPrompt
+from app.services import warm_pool as warm_pool_module
+from app.services.generation_scheduler import DEFAULT_MAX_WAIT, GenerationScheduler
+from app.services.rate_limiter import RateLimiter
+from app.services.state_store import MemoryStateStore
+from app.services.warm_pool import WarmPool, canonical_key
+
+def _bgm(**fields) -> MusicPrompt:
+    return MusicPrompt(interface="gen_bgm", **{"mood": ["calm"], "genre": ["ambient"], **fields})
+
+@pytest.fixture
+def pool(monkeypatch) -> WarmPool:
+    pool = WarmPool(MemoryStateStore(), size=2, prompts=2, min_hits=2, refresh=3600, budget_per_hour=3,
+                    track_ttl=600, half_life=3600)
+    monkeypatch.setattr(pool, "_ensure_warmer", lambda: None)
+    return pool
+
+@pytest.fixture
+def upstream(monkeypatch) -> RateLimiter:
+    """预热用到的上游：生成立即成功，Coze并发上限为1"""
+    limiter = RateLimiter(MemoryStateStore())
+    limiter.upstream_caps = {"coze": 1}
+    scheduler = GenerationScheduler(workers=1, max_wait=dict(DEFAULT_MAX_WAIT))
+    counter = iter(range(100))
+    monkeypatch.setattr(warm_pool_module, "rate_limiter", limiter)
+    monkeypatch.setattr(warm_pool_module, "generation_scheduler", scheduler)
+    monkeypatch.setattr(warm_pool_module.coze_music_service, "generate_music",
+                        lambda prompt: (True, f"http://cdn/{next(counter)}.mp3", None))
+    yield limiter
+    scheduler.close()
+
+def test_canonical_key_ignores_order_duplicates_and_text():
+    key = canonical_key(_bgm(mood=["calm", "dreamy"], text="海边"))
+    assert canonical_key(_bgm(mood=["dreamy", "calm", "calm"], text="山间")) == key
+    assert canonical_key(_bgm(mood=["calm", "dreamy"], duration=60)) != key
+    assert canonical_key(MusicPrompt(interface="gen_song", mood_single="Happy")) is None
+
+def test_hot_prompts_need_min_hits_and_decay(pool):
+    for _ in range(3):
+        pool.record(_bgm())
+    pool.record(_bgm(mood=["happy"]))
+    now = time.time()
+    assert [prompt.mood for _, prompt in pool._hot_prompts(now)] == [["calm"]]
+    # 两个半衰期后3次请求只相当于0.75次
+    assert pool._hot_prompts(now + 2 * 3600) == []
+
+def test_take_pops_each_track_once_and_drops_expired(pool):
+    key = canonical_key(_bgm())
+    now = time.time()
+    pool.store.set(f"warmpool:tracks:{key}", [
+        {"music_url": "http://cdn/old.mp3", "lyrics": None, "created_at": now - 700},
+        {"music_url": "http://cdn/new.mp3", "lyrics": None, "created_at": now},
+    ])
+    assert pool.take(_bgm(text="任意描述"))["music_url"] == "http://cdn/new.mp3"
+    assert pool.take(_bgm()) is None
+
+def test_budget_limits_generations_per_hour(pool):
+    now = time.time()
+    assert [pool._take_budget(now) for _ in range(4)] == [True, True, True, False]
+    assert pool._take_budget(now + 3601)
+
+def test_warm_once_fills_hot_presets_within_budget(pool, upstream):
+    for _ in range(3):
+        pool.record(_bgm())
+        pool.record(_bgm(mood=["happy"]))
+    assert pool.warm_once() == 3
+    assert sorted(preset["ready"] for preset in pool.stats()["presets"]) == [1, 2]
+    # 预热完成后归还了上游并发名额
+    assert upstream.acquire_upstream("coze") is not None
+
+def test_warm_once_yields_when_upstream_is_busy(pool, upstream):
+    for _ in range(3):
+        pool.record(_bgm())
+    held = upstream.acquire_upstream("coze")
+    assert pool.warm_once() == 0
+    upstream.release_upstream("coze", held)
+    assert pool.warm_once() == 2
+
+def test_warm_once_stops_when_warmer_lease_is_lost(pool, upstream):
+    for _ in range(3):
+        pool.record(_bgm())
+    assert pool.warm_once(warmer_lease="expired") == 0
+    lease_id = upstream.acquire_lease("warmpool:warmer", 1)
+    assert pool.warm_once(warmer_lease=lease_id) == 2
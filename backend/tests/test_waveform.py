@@ -0,0 +1,95 @@
+import os
+import wave
+import numpy as np
+import pytest
+from app.services import waveform
+from app.services.audio_cache import AudioCache
+from app.services.state_store import MemoryStateStore
+from app.services.waveform import PEAKS_SUFFIX, WaveformService, compute_peaks, decode_wav
+
+DIGEST = "ab" + "0" * 62
+
+def _column(*values) -> np.ndarray:
+    return np.array(values, dtype=np.float32).reshape(-1, 1)
+
+def _pairs(data: np.ndarray):
+    return [tuple(pair) for pair in data.reshape(-1, 2).tolist()]
+
+def test_levels_halve_from_finest_to_coarsest():
+    samples = _column(0.0, 0.5, -0.5, 0.25, 1.0, -1.0, 0.0, 0.0)
+    levels = compute_peaks(samples, max_bins=4, min_bins=1)
+    assert [per_bin for per_bin, _ in levels] == [2, 4, 8]
+    assert _pairs(levels[0][1]) == [(0, 64), (-64, 32), (-127, 127), (0, 0)]
+    assert _pairs(levels[1][1]) == [(-64, 64), (-127, 127)]
+    assert _pairs(levels[2][1]) == [(-127, 127)]
+
+def test_uneven_length_pads_with_last_sample():
+    levels = compute_peaks(_column(0.1, 0.2, 0.3, 0.4, -0.5), max_bins=2, min_bins=2)
+    assert levels == [(3, levels[0][1])]
+    assert _pairs(levels[0][1]) == [(13, 38), (-64, 51)]
+
+def test_odd_bin_count_repeats_last_bin():
+    levels = compute_peaks(_column(0.1, 0.2, 0.3), max_bins=3, min_bins=1)
+    assert [(per_bin, _pairs(data)) for per_bin, data in levels] == [
+        (1, [(13, 13), (25, 25), (38, 38)]),
+        (2, [(13, 25), (38, 38)]),
+        (4, [(13, 38)]),
+    ]
+
+def test_channels_share_one_envelope():
+    samples = np.array([[0.5, -0.5], [0.25, 1.0]], dtype=np.float32)
+    assert _pairs(compute_peaks(samples, max_bins=1, min_bins=1)[0][1]) == [(-64, 127)]
+
+def test_empty_input():
+    [(per_bin, data)] = compute_peaks(np.zeros((0, 1), dtype=np.float32), max_bins=8, min_bins=2)
+    assert per_bin == 1 and len(data) == 0
+
+def _write_wav(path, frames: np.ndarray, rate: int = 8000) -> None:
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(frames.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(frames.astype("<i2").tobytes())
+
+def test_decode_wav_16bit_stereo(tmp_path):
+    path = tmp_path / "stereo.wav"
+    _write_wav(path, np.array([[0, 16384], [-32768, 32767]]))
+    samples, rate = decode_wav(str(path))
+    assert rate == 8000 and samples.shape == (2, 2)
+    assert samples[0].tolist() == [0.0, 0.5]
+    assert samples[1, 0] == -1.0
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path) -> AudioCache:
+    cache = AudioCache(MemoryStateStore(), str(tmp_path), max_bytes=1 << 30, track_ttl=60,
+                       fetch_workers=1, fetch_timeout=1)
+    monkeypatch.setattr(waveform, "audio_cache", cache)
+    return cache
+
+def _track(cache: AudioCache, content_type: str = "audio/wav"):
+    blob = cache.sidecar_path(DIGEST, "")
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    _write_wav(blob, (np.sin(np.linspace(0, 20, 1024)) * 30000).reshape(-1, 1))
+    return {"url": "http://upstream/a.wav", "sha256": DIGEST, "size": None, "content_type": content_type}
+
+def test_load_builds_missing_peaks_and_picks_level(cache):
+    service = WaveformService(max_bins=64, min_bins=8)
+    track = _track(cache)
+    peaks = service.load(track, bins=20)
+    assert peaks["sample_rate"] == 8000 and peaks["duration"] == 0.128
+    assert peaks["length"] == 32 and peaks["samples_per_pixel"] == 32
+    assert len(peaks["data"]) == 64
+    assert service.load(track, bins=1000)["length"] == 64
+
+def test_load_rebuilds_corrupt_peaks(cache):
+    service = WaveformService(max_bins=64, min_bins=8)
+    track = _track(cache)
+    with open(cache.sidecar_path(DIGEST, PEAKS_SUFFIX), "wb") as f:
+        f.write(b"not a zip")
+    assert service.load(track, bins=8)["length"] == 8
+
+def test_load_not_ready_without_blob_or_decoder(cache, monkeypatch):
+    service = WaveformService(max_bins=64, min_bins=8)
+    assert service.load(_track(cache, content_type="audio/mpeg"), bins=8) is None
+    monkeypatch.setattr(cache, "_schedule", lambda track_id, url: None)
+    assert service.load({"url": "http://upstream/b.wav", "sha256": "cd" + "0" * 62}, bins=8) is None